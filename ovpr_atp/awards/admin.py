@@ -5,7 +5,7 @@ from django.contrib import admin, messages
 from .models import ProposalIntake, Proposal, KeyPersonnel, PerformanceSite, Award, AwardAcceptance, AwardNegotiation, \
     AwardSetup,Subaward, PTANumber, AwardManagement, PriorApproval, ReportSubmission, AwardCloseout, FinalReport, \
     PrimeSponsor, AllowedCostSchedule, AwardManager, AwardOrganization, AwardTemplate, \
-    CFDANumber, FedNegRate, FundingSource, IndirectCost, EASMapping, NegotiationStatus
+    CFDANumber, FedNegRate, FundingSource, IndirectCost, EASMapping, NegotiationStatus, OutboundEmail
 
 import reversion
 
@@ -28,47 +28,49 @@ class AwardAdmin(reversion.VersionAdmin):
                     'awardcloseout_admin',
                     )
 
+    def get_queryset(self, request):
+        # Loads what the list_display links need up front, instead of querying for each row
+        return Award.with_admin_links(super(AwardAdmin, self).get_queryset(request))
+
     def save_model(self, request, obj, form, change):
-        try:
-            old_object = Award.objects.get(id=obj.id)
-        except:
-            old_object = None
-        if old_object:
-            if obj.send_to_modification != old_object.send_to_modification:
-                if old_object.send_to_modification == True and obj.send_to_modification == False:
+        # The values the award was loaded with, so we don't have to read it again
+        old_values = obj.get_saved_values() if change else None
+        if old_values:
+            if obj.send_to_modification != old_values['send_to_modification']:
+                if old_values['send_to_modification'] == True and obj.send_to_modification == False:
                     messages.warning(request, "send_to_modification flag 'Un Checked' for the Award #%d, "
                                               "do you need this change?" %obj.id)
-                if old_object.send_to_modification == False and obj.send_to_modification == True:
+                if old_values['send_to_modification'] == False and obj.send_to_modification == True:
                     messages.warning(request, "send_to_modification flag 'Checked' for the Award #%d, "
                                               "do you need this change?" % obj.id)
                 obj.save()
-            if obj.status != old_object.status:
+            if obj.status != old_values['status']:
                 obj.save()
                 obj.send_email_update()
-            elif obj.status == 1 and obj.award_acceptance_user != old_object.award_acceptance_user:
+            elif obj.status == 1 and obj.award_acceptance_user_id != old_values['award_acceptance_user_id']:
                 obj.save()
                 obj.send_email_update()
-            elif obj.status == 2 and obj.award_negotiation_user != old_object.award_negotiation_user:
+            elif obj.status == 2 and obj.award_negotiation_user_id != old_values['award_negotiation_user_id']:
                 obj.save()
                 obj.send_email_update()
-            elif obj.status == 4 and obj.award_management_user != old_object.award_management_user:
+            elif obj.status == 4 and obj.award_management_user_id != old_values['award_management_user_id']:
                 obj.save()
                 obj.send_email_update()
-            elif obj.status == 5 and obj.award_closeout_user != old_object.award_closeout_user:
+            elif obj.status == 5 and obj.award_closeout_user_id != old_values['award_closeout_user_id']:
                 obj.save()
                 obj.send_email_update()
 
             if obj.status == 3 and obj.send_to_modification:
-                if obj.award_setup_user != old_object.award_setup_user:
+                if obj.award_setup_user_id != old_values['award_setup_user_id']:
                     obj.save()
-                elif obj.award_modification_user != old_object.award_modification_user:
+                elif obj.award_modification_user_id != old_values['award_modification_user_id']:
                     obj.save()
                     obj.send_email_update(modification_flag=True)
             else:
-                if obj.award_setup_user != old_object.award_setup_user:
+                if obj.award_setup_user_id != old_values['award_setup_user_id']:
                     obj.save()
                     obj.send_email_update()
-                elif obj.award_modification_user != old_object.award_modification_user:
+                elif obj.award_modification_user_id != old_values['award_modification_user_id']:
                     obj.save()
         else:
             super(AwardAdmin, self).save_model(request, obj, form, change)
@@ -124,6 +126,21 @@ class AwardManagerAdmin(admin.ModelAdmin):
     """Special admin class for AwardManager"""
     search_fields = ['gwid', 'full_name']
 
+
+class OutboundEmailAdmin(admin.ModelAdmin):
+    """Special admin class for OutboundEmail, where failed emails can be sent again"""
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'date_created', 'date_sent')
+    list_filter = ('status',)
+    search_fields = ['recipients', 'subject']
+    actions = ['retry_emails']
+
+    def retry_emails(self, request, queryset):
+        failed_emails = queryset.filter(status=OutboundEmail.FAILED)
+        for email in failed_emails:
+            email.retry()
+        messages.info(request, '%s email(s) will be sent again' % len(failed_emails))
+    retry_emails.short_description = 'Retry the selected failed emails'
+
 admin.site.register(AllowedCostSchedule, NonVersionedAdmin)
 admin.site.register(AwardManager, AwardManagerAdmin)
 admin.site.register(AwardOrganization, NonVersionedAdmin)
@@ -133,5 +150,6 @@ admin.site.register(FedNegRate, NonVersionedAdmin)
 admin.site.register(FundingSource, FundingSourceAdmin)
 admin.site.register(IndirectCost, NonVersionedAdmin)
 admin.site.register(PrimeSponsor, NonVersionedAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
 
 admin.site.register(EASMapping, NonVersionedAdmin)
@@ -6,12 +6,18 @@
 # See crispy-forms documentation at https://django-crispy-forms.readthedocs.org/en/latest/
 
 from dateutil import tz
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import Group
 from django import forms
+from django.apps import apps
 from django.core.urlresolvers import reverse
+from django.db.models.fields import FieldDoesNotExist
 from django.db.models import ForeignKey, OneToOneField, Q
 from django.forms import ValidationError
+from django.forms.utils import flatatt
 from django.forms.widgets import Textarea, DateInput, NumberInput, TextInput, HiddenInput
+from django.utils.encoding import force_text
+from django.utils.html import format_html
+from django.utils.text import capfirst
 
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, Button, ButtonHolder, Submit, Field, Div, Reset, HTML
@@ -33,7 +39,49 @@ from .models import (
     ReportSubmission,
     AwardCloseout,
     FinalReport,
-    NegotiationStatus)
+    NegotiationStatus,
+    AutocompleteMixin,
+    open_assignment_user_choices,
+    assignment_user_choices,
+    proposal_intake_user_choices)
+
+
+class AutocompleteSelect(forms.Widget):
+    """Chooses an object of an EAS reference model by searching for it, instead of
+    rendering the whole table as <select> options. The page fetches matching options from
+    get_autocomplete_options as the user types, so only the selected object is loaded here.
+    """
+
+    def __init__(self, model, attrs=None):
+        self.model = model
+        super(AutocompleteSelect, self).__init__(attrs)
+
+    def render(self, name, value, attrs=None):
+        final_attrs = self.build_attrs(attrs, type='hidden', name=name)
+        final_attrs['data-autocomplete-url'] = reverse(
+            'get_autocomplete_options',
+            kwargs={'model_name': self.model.__name__})
+
+        if value not in (None, ''):
+            final_attrs['value'] = force_text(value)
+            try:
+                selected = self.model.objects.filter(pk=value).first()
+            except (ValueError, TypeError):
+                selected = None
+            if selected:
+                final_attrs['data-text'] = force_text(selected)
+
+        return format_html('<input{0} />', flatatt(final_attrs))
+
+
+def use_autocomplete_widgets(form):
+    """Gives every field of the form that chooses an EAS reference object an AutocompleteSelect"""
+
+    for field in form.fields.values():
+        if isinstance(field, forms.ModelChoiceField) \
+                and not isinstance(field, forms.ModelMultipleChoiceField) \
+                and issubclass(field.queryset.model, AutocompleteMixin):
+            field.widget = AutocompleteSelect(field.queryset.model)
 
 
 class AwardForm(forms.ModelForm):
@@ -97,12 +145,9 @@ class EASMappingForm(forms.Form):
                 active=True),
             label='ATP value')
 
-        if atp_model.__name__ in (
-                'AwardManager',
-                'FundingSource',
-                'PrimeSponsor',
-                'AwardOrganization'):
-            css = 'select2 award-manager-select'
+        if issubclass(atp_model, AutocompleteMixin):
+            self.fields['atp_value'].widget = AutocompleteSelect(atp_model)
+            css = ''
         else:
             css = 'select2'
 
@@ -125,6 +170,61 @@ class EASMappingForm(forms.Form):
         )
 
 
+class EASMappingReconciliationForm(forms.Form):
+    """Create mappings for every unrecognized value found during an import's dry run"""
+
+    def __init__(self, unmapped_values, *args, **kwargs):
+        super(EASMappingReconciliationForm, self).__init__(*args, **kwargs)
+
+        self.unmapped_values = unmapped_values
+
+        layout = []
+        for index, unmapped_value in enumerate(unmapped_values):
+            atp_model = apps.get_model('awards', unmapped_value['atp_model'])
+            field_name = 'atp_value_%d' % index
+
+            try:
+                verbose_name = Proposal._meta.get_field(unmapped_value['field']).verbose_name
+            except FieldDoesNotExist:
+                verbose_name = unmapped_value['field'].replace('_', ' ')
+
+            self.fields[field_name] = forms.ModelChoiceField(
+                queryset=atp_model.objects.filter(
+                    active=True),
+                label='%s: %s' % (capfirst(verbose_name), unmapped_value['incoming_value']))
+
+            if issubclass(atp_model, AutocompleteMixin):
+                self.fields[field_name].widget = AutocompleteSelect(atp_model)
+                css = ''
+            else:
+                css = 'select2'
+
+            layout.append(Field(field_name, css_class=css))
+
+        self.helper = FormHelper()
+        self.helper.form_class = 'form-horizontal'
+        self.helper.label_class = 'col-md-3'
+        self.helper.field_class = 'col-md-3'
+        self.helper.layout = Layout(
+            *(layout + [
+                HTML("<div class='pull-right'>"),
+                FormActions(
+                    HTML('<a href="{{ award_url|default:"/"}}" class="btn">Cancel</a>'),
+                    Submit(
+                        'save',
+                        'Continue with import'),
+                ),
+                HTML("</div>"),
+            ])
+        )
+
+    def get_mappings(self):
+        """Gets the (unmapped value, selected ATP object) pairs from the cleaned data"""
+
+        return [(unmapped_value, self.cleaned_data['atp_value_%d' % index])
+                for index, unmapped_value in enumerate(self.unmapped_values)]
+
+
 class AutoFormMixin(object):
     """Dynamically populate django-crispy-form Layouts in a two-column format"""
 
@@ -182,12 +282,8 @@ class AutoFormMixin(object):
                     Field(field_name))
 
             elif field_name != 'move_to_next_step' and type(self.Meta.model._meta.get_field(field_name)) in (ForeignKey, OneToOneField):
-                if self.Meta.model._meta.get_field(field_name).rel.to.__name__ in (
-                        'AwardManager',
-                        'FundingSource',
-                        'PrimeSponsor',
-                        'AwardOrganization'):
-                    css = 'select2 award-manager-select'
+                if isinstance(field_value.widget, AutocompleteSelect):
+                    css = ''
                 else:
                     css = 'select2'
                 layout.append(
@@ -218,6 +314,7 @@ class AutoFormMixin(object):
 
     def __init__(self, *args, **kwargs):
         super(AutoFormMixin, self).__init__(*args, **kwargs)
+        use_autocomplete_widgets(self)
 
         self.helper = FormHelper()
         self.helper.form_id = 'section-form'
@@ -228,6 +325,10 @@ class AutoFormMixin(object):
         self.helper.form_error_title = 'Errors'
         self.helper.layout = Layout()
 
+        # Saves send this back, so they only save over the version the page was showing
+        if self.instance.pk and getattr(self.instance, 'version', None):
+            self.helper.attrs = {'data-version': self.instance.version}
+
         # Open the layout with a container and a row
         self.helper.layout.append(HTML('<div class="container">'))
 
@@ -341,11 +442,8 @@ class AwardSectionForm(AutoFormMixin, forms.ModelForm):
         )
         super(AwardSectionForm, self).__init__(*args, **kwargs)
         if self.Meta.model == ProposalIntake:
-            user_list = User.objects.filter(is_active=True, groups__name='Proposal Intake').order_by('first_name')
-            users = [(user.first_name + ' ' + user.last_name, user.first_name + ' ' + user.last_name) for user in
-                     user_list]
             choices = [(self.initial['spa1'], self.initial['spa1']), (u'', u'---------')]
-            choices.extend(users)
+            choices.extend(proposal_intake_user_choices())
             self.fields['spa1'].choices = choices
         if self.Meta.model == AwardAcceptance:
             acceptance = AwardAcceptance.objects.get(award_id=self.instance.award.id, current_modification=True)
@@ -493,6 +591,9 @@ class SubsectionForm(SubsectionFormMixin, AutoFormMixin, forms.ModelForm):
 class ProposalIntakeStandaloneForm(AutoFormMixin, forms.ModelForm):
     """A separate form for ProposalIntake objects that aren't associated to an award."""
 
+    # Choices are set per form, from proposal_intake_user_choices
+    spa1 = forms.ChoiceField(label='SPA I*')
+
     save_and_continue = forms.BooleanField(
         widget=forms.HiddenInput(),
         required=False)
@@ -510,9 +611,7 @@ class ProposalIntakeStandaloneForm(AutoFormMixin, forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(ProposalIntakeStandaloneForm, self).__init__(*args, **kwargs)
-        user_list = User.objects.filter(is_active=True, groups__name='Proposal Intake').order_by('first_name')
-        users = [(user.first_name + ' ' + user.last_name, user.first_name + ' ' + user.last_name) for user in
-                 user_list]
+        users = proposal_intake_user_choices()
         if self.instance.id:
             intake_user = ProposalIntake.objects.get(id=self.instance.id)
             # Lock the dropdown values if the proposal status is submitted
@@ -592,6 +691,9 @@ class ProposalForm(AutoFormMixin, forms.ModelForm):
 class ProposalIntakeForm(AwardSectionForm):
     """The form for editing ProposalIntakes from within an Award"""
 
+    # Choices are set per form, from proposal_intake_user_choices
+    spa1 = forms.ChoiceField(label='SPA I*')
+
     class Meta(AwardSectionForm.Meta):
         model = ProposalIntake
         exclude = AwardSectionForm.Meta.exclude + ['creation_date']
@@ -830,35 +932,55 @@ class ProposalStatisticsReportForm(forms.Form):
         )
 
 
+class AuditTrailExportForm(forms.Form):
+    """Filters and file format for the audit trail export"""
+
+    FILE_FORMAT_CHOICES = (
+        ('xlsx', 'Excel (.xlsx)'),
+        ('csv', 'CSV'),
+    )
+
+    from_date = forms.DateField(required=False)
+    to_date = forms.DateField(required=False)
+    award = forms.IntegerField(required=False, label='Award #')
+    file_format = forms.ChoiceField(choices=FILE_FORMAT_CHOICES)
+
+    def __init__(self, *args, **kwargs):
+        super(AuditTrailExportForm, self).__init__(*args, **kwargs)
+
+        self.helper = FormHelper()
+        self.helper.form_class = 'form-horizontal'
+        self.helper.label_class = 'col-md-3'
+        self.helper.field_class = 'col-md-3'
+        self.helper.layout = Layout(
+            Field('from_date', css_class='datePicker'),
+            Field('to_date', css_class='datePicker'),
+            Field('award'),
+            Field('file_format'),
+            HTML("<div class='pull-right'>"),
+            FormActions(
+                Submit('export', 'Export'),
+            ),
+            HTML("</div>"),
+        )
+
+
+def with_blank_choice(get_choices):
+    """Wraps a choices callable so the blank choice comes first. The choices are still
+    only fetched when the form is rendered or validated, not when this module is imported.
+    """
+
+    return lambda: [(u'', u'---------')] + get_choices()
+
+
 class AwardREAssaignementForm(forms.Form):
     """
     This form is for re-assigning the work to active user
     """
-    atp_users_choices = [(u'', u'---------')]
-    assignment_users_choices = [(u'', u'---------')]
-    for atp_user in User.objects.all().order_by('first_name'):
-        assigns = Award.objects.filter(Q(Q(award_acceptance_user_id=atp_user.id) | Q(award_closeout_user_id=atp_user) |
-                                       Q(award_management_user_id=atp_user.id) |
-                                       Q(award_modification_user_id=atp_user.id) | Q(subaward_user_id=atp_user.id) |
-                                       Q(award_negotiation_user_id=atp_user.id) | Q(award_setup_user_id=atp_user.id))
-                                       & Q(status__lt=6))
-        if len(assigns) > 0:
-            atp_users_choices.append((atp_user.id, atp_user.first_name + ' ' + atp_user.last_name))
-    assignment_users_list = [(user.id, user.first_name + ' ' + user.last_name) for user
-                             in User.objects.filter(is_active=True, groups__name__in=['Administrative',
-                                                                                      'Award Acceptance',
-                                                                                      'Award Closeout',
-                                                                                      'Award Management',
-                                                                                      'Award Modification',
-                                                                                      'Award Negotiation',
-                                                                                      'Award Setup',
-                                                                                      'Proposal Intake',
-                                                                                      'Subaward Management'
-                                                                                      ]).order_by('first_name').distinct()]
-    assignment_users_choices.extend(assignment_users_list)
-    atp_user = forms.ChoiceField(choices=atp_users_choices, label='ATP User')
+    atp_user = forms.ChoiceField(choices=with_blank_choice(open_assignment_user_choices), label='ATP User')
     user_department = forms.ChoiceField(label='Department', required=False)
-    assignment_user = forms.ChoiceField(choices=assignment_users_choices, label='Re-assignment User')
+    assignment_user = forms.ChoiceField(choices=with_blank_choice(assignment_user_choices),
+                                        label='Re-assignment User')
 
     def __init__(self, *args, **kwargs):
         super(AwardREAssaignementForm, self).__init__(*args, **kwargs)
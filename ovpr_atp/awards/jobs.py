@@ -0,0 +1,147 @@
+# Background jobs, run outside of the HTTP request that started them.
+#
+# BackgroundJob rows act as the queue: a view enqueues a job and starts it on a worker
+# thread, and the run_background_jobs management command can pick up anything left queued
+# (e.g. from cron). No external broker is needed.
+
+from django.core.mail import get_connection
+from django.db import connection, transaction
+import threading
+import traceback
+
+from .models import BackgroundJob, OutboundEmail, Proposal
+from .utils import iter_cayuse_submissions
+
+# Number of rows written per transaction by the Cayuse sync
+CAYUSE_SYNC_CHUNK_SIZE = 50
+
+# Number of queued emails sent over each SMTP connection
+EMAIL_BATCH_SIZE = 100
+
+
+def sync_cayuse_proposals(job):
+    """Saves every new Cayuse submission as a Proposal, committing a chunk of rows at a time"""
+
+    chunk = []
+    for proposal in iter_cayuse_submissions():
+        # Each row can take a Cayuse request or two, so a chunk can take a while
+        job.heartbeat()
+        chunk.append(proposal)
+        if len(chunk) >= CAYUSE_SYNC_CHUNK_SIZE:
+            _save_cayuse_chunk(job, chunk)
+            chunk = []
+
+    if chunk:
+        _save_cayuse_chunk(job, chunk)
+
+
+def _save_cayuse_chunk(job, chunk):
+    """Saves a chunk of Cayuse submissions and the job's progress in one transaction.
+    A row that fails to save is rolled back on its own and counted, without losing the rest.
+    Submissions saved since the sync started (e.g. by an import) are skipped.
+    """
+
+    proposal_ids = [proposal['proposal_id'] for proposal in chunk if proposal is not None]
+    new = failed = 0
+    with transaction.atomic():
+        existing_proposal_ids = set(
+            str(proposal_id) for proposal_id in Proposal.objects.filter(
+                proposal_id__in=proposal_ids).values_list('proposal_id', flat=True))
+
+        for proposal in chunk:
+            if proposal is None or str(proposal['proposal_id']) in existing_proposal_ids:
+                continue
+            try:
+                with transaction.atomic():
+                    Proposal(**proposal).save()
+                new += 1
+            except Exception:
+                failed += 1
+
+        job.record_progress(seen=len(chunk), new=new, failed=failed)
+
+
+JOB_RUNNERS = {
+    BackgroundJob.CAYUSE_SYNC: sync_cayuse_proposals,
+}
+
+
+def run_job(job):
+    """Claims and runs a queued job, recording the outcome on it"""
+
+    if not job.claim():
+        return
+
+    try:
+        JOB_RUNNERS[job.job_type](job)
+    except Exception:
+        job.finish(error=traceback.format_exc())
+    else:
+        job.finish()
+
+
+def _run_job_in_thread(job_pk):
+    try:
+        run_job(BackgroundJob.objects.get(pk=job_pk))
+    finally:
+        # Threads get their own database connection, which Django won't close for us
+        connection.close()
+
+
+def start_job(job_type, requested_by=None):
+    """Queues a job of the given type and runs it on a background thread.
+    If one is already queued or running, returns that job instead of starting another.
+    """
+
+    job, created = BackgroundJob.enqueue(job_type, requested_by)
+
+    if created:
+        thread = threading.Thread(target=_run_job_in_thread, args=(job.pk,))
+        thread.daemon = True
+        thread.start()
+
+    return job
+
+
+def run_queued_jobs():
+    """Runs every queued job in the current process. Returns the number of jobs run."""
+
+    jobs = list(BackgroundJob.objects.filter(status=BackgroundJob.QUEUED).order_by('date_created'))
+    for job in jobs:
+        run_job(job)
+
+    return len(jobs)
+
+
+def send_queued_emails(batch_size=EMAIL_BATCH_SIZE):
+    """Sends a batch of queued emails over a single mail server connection.
+    Returns the number of emails sent and the number that failed.
+    """
+
+    emails = OutboundEmail.claim_batch(batch_size)
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        for message_emails in OutboundEmail.group_into_messages(emails):
+            try:
+                # Does nothing while the connection is open; reconnects after a failure
+                mail_connection.open()
+                OutboundEmail.get_message(message_emails, mail_connection).send()
+            except Exception:
+                error = traceback.format_exc()
+                for email in message_emails:
+                    email.mark_failed(error)
+                failed += len(message_emails)
+                # The server may have dropped us, so don't reuse the connection
+                mail_connection.close()
+            else:
+                for email in message_emails:
+                    email.mark_sent()
+                sent += len(message_emails)
+    finally:
+        mail_connection.close()
+
+    return sent, failed
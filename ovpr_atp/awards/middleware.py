@@ -2,6 +2,9 @@ from django.utils.cache import add_never_cache_headers
 
 
 class DisableClientSideCachingMiddleware(object):
+    """Stops browsers from caching responses, except where the view set its own Cache-Control"""
+
     def process_response(self, request, response):
-        add_never_cache_headers(response)
-        return response
\ No newline at end of file
+        if not response.has_header('Cache-Control'):
+            add_never_cache_headers(response)
+        return response
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('awards', '0014_auto_20180924_0724'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('job_type', models.CharField(max_length=50, choices=[(b'cayuse_sync', b'Cayuse proposal sync')])),
+                ('status', models.CharField(default=b'Q', max_length=1, choices=[(b'Q', b'Queued'), (b'R', b'Running'), (b'C', b'Complete'), (b'F', b'Failed')])),
+                ('active_key', models.CharField(max_length=50, unique=True, null=True, blank=True)),
+                ('rows_seen', models.IntegerField(default=0)),
+                ('rows_new', models.IntegerField(default=0)),
+                ('rows_failed', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(null=True, blank=True)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('date_completed', models.DateTimeField(null=True, blank=True)),
+                ('requested_by', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def clear_orphaned_audit_trail(apps, schema_editor):
+    """Unlinks trail entries for awards that no longer exist, so the foreign key can be added"""
+
+    ATPAuditTrail = apps.get_model('awards', 'ATPAuditTrail')
+    Award = apps.get_model('awards', 'Award')
+    ATPAuditTrail.objects.exclude(award__in=Award.objects.values_list('id', flat=True)).update(award=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0015_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='atpaudittrail',
+            name='award',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(clear_orphaned_audit_trail, migrations.RunPython.noop),
+        # Create the composite index first, so the database can use it for the foreign key
+        migrations.AlterIndexTogether(
+            name='atpaudittrail',
+            index_together=set([('award', 'modification', 'workflow_step', 'assigned_user')]),
+        ),
+        migrations.AlterField(
+            model_name='atpaudittrail',
+            name='award',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, db_column=b'award', to='awards.Award', null=True, db_index=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+
+
+def set_modification_counts(apps, schema_editor):
+    Award = apps.get_model('awards', 'Award')
+    AwardAcceptance = apps.get_model('awards', 'AwardAcceptance')
+
+    acceptance_counts = AwardAcceptance.objects.values_list('award').annotate(Count('id')).order_by()
+    for award_id, count in acceptance_counts:
+        if count > 1:
+            Award.objects.filter(id=award_id).update(modification_count=count - 1)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0016_atpaudittrail_award_fk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='award',
+            name='modification_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_modification_counts, noop),
+    ]
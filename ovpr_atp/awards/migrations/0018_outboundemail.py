@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0017_award_modification_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('recipients', models.TextField()),
+                ('status', models.CharField(default=b'P', max_length=1, choices=[(b'P', b'Pending'), (b'S', b'Sending'), (b'D', b'Sent'), (b'F', b'Failed')])),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('claim_token', models.CharField(db_index=True, max_length=32, null=True, blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_claimed', models.DateTimeField(null=True, blank=True)),
+                ('date_sent', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboundemail',
+            index_together=set([('status', 'next_attempt')]),
+        ),
+    ]
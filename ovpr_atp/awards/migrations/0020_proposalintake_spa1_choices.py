@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0019_outboundemail_digest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='proposalintake',
+            name='spa1',
+            field=models.CharField(max_length=150, null=True, verbose_name=b'SPA I*'),
+        ),
+    ]
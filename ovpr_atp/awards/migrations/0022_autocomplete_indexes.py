@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0021_awardsection_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='allowedcostschedule',
+            index_together=set([('active', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='awardmanager',
+            index_together=set([('active', 'full_name'), ('active', 'gwid')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='awardorganization',
+            index_together=set([('active', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='awardtemplate',
+            index_together=set([('active', 'short_name'), ('active', 'number')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='cfdanumber',
+            index_together=set([('active', 'flex_value'), ('active', 'description')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='fednegrate',
+            index_together=set([('active', 'flex_value'), ('active', 'description')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='fundingsource',
+            index_together=set([('active', 'number'), ('active', 'name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='indirectcost',
+            index_together=set([('active', 'rate_schedule')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='primesponsor',
+            index_together=set([('active', 'name')]),
+        ),
+    ]
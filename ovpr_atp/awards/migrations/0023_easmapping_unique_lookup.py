@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+
+
+def check_for_duplicate_mappings(apps, schema_editor):
+    """Refuses to migrate while a value is mapped to more than one ATP object, rather than
+    picking one of them. Delete the wrong mappings in the admin, then migrate again.
+    """
+
+    EASMapping = apps.get_model('awards', 'EASMapping')
+    duplicates = EASMapping.objects.values('interface', 'field', 'incoming_value', 'atp_model') \
+        .annotate(mappings=Count('id')).filter(mappings__gt=1)
+    if duplicates:
+        raise RuntimeError('These EAS values are mapped more than once: %s' % ', '.join(
+            '(%(interface)s) %(field)s=%(incoming_value)s -> %(atp_model)s' % duplicate
+            for duplicate in duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awards', '0022_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_for_duplicate_mappings, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='easmapping',
+            unique_together=set([('interface', 'field', 'incoming_value', 'atp_model')]),
+        ),
+    ]
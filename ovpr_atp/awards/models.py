@@ -3,23 +3,32 @@
 # See the Django documentation at https://docs.djangoproject.com/en/1.6/topics/db/models/
 
 from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
-from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save, post_delete
+from django.core.cache import cache
+from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.mail import send_mail, EmailMessage
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Count, Sum, Min, Max, Case, When, Value, IntegerField, BooleanField, Prefetch
+from django.db.models.query import prefetch_related_objects
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
 from django.contrib.admin.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.utils.html import format_html
 from django.utils import timezone
+from collections import OrderedDict
+from contextlib import contextmanager
 from itertools import chain
 from decimal import Decimal
 from datetime import datetime, date, timedelta, tzinfo
 from dateutil.tz import tzutc, tzlocal
 from multiselectfield import MultiSelectField
 import reversion
+from reversion.models import Version
+import threading
+import time
+import uuid
 
 
 def get_value_from_choices(choices, code_to_find):
@@ -167,6 +176,158 @@ class FieldIteratorMixin(models.Model):
         abstract = True
 
 
+def get_latest_revisions(objects):
+    """Gets the most recent django-reversion revision of each of the given objects.
+    objects can mix model instances and querysets. Each queryset's pks are loaded with a query
+    of its own, then the revisions are found with two more.
+
+    Returns a dict of (model, pk) -> (user's full name, date created). Objects that don't
+    have any revisions are left out.
+    """
+
+    # MySQL runs an OR of IN (SELECT ...) subqueries very slowly, so look the versions up with
+    # plain lists of pks, one per model
+    pks_by_model = OrderedDict()
+    for item in objects:
+        if isinstance(item, models.query.QuerySet):
+            pks_by_model.setdefault(item.model._meta.concrete_model, set()).update(
+                item.values_list('pk', flat=True))
+        elif item is not None and item.pk is not None:
+            pks_by_model.setdefault(item._meta.concrete_model, set()).add(item.pk)
+
+    pks_by_model = OrderedDict((model, pks) for model, pks in pks_by_model.items() if pks)
+    if not pks_by_model:
+        return {}
+
+    # Content types are cached, so this only queries the first time
+    content_types = ContentType.objects.get_for_models(*pks_by_model.keys())
+    models_by_content_type = dict((content_type.id, model) for model, content_type in content_types.items())
+
+    versions = Q()
+    for model, pks in pks_by_model.items():
+        versions |= Q(content_type=content_types[model], object_id_int__in=sorted(pks))
+
+    latest_version_ids = list(Version.objects.filter(versions).values(
+        'content_type', 'object_id_int').annotate(latest_id=Max('pk')).values_list('latest_id', flat=True))
+
+    latest_revisions = {}
+    for content_type_id, object_id, date_created, first_name, last_name in Version.objects.filter(
+            pk__in=latest_version_ids).values_list(
+            'content_type', 'object_id_int', 'revision__date_created',
+            'revision__user__first_name', 'revision__user__last_name'):
+        if first_name is None:
+            user = 'ATP'
+        else:
+            user = ('%s %s' % (first_name, last_name)).strip()
+        latest_revisions[(models_by_content_type[content_type_id], object_id)] = (user, date_created)
+
+    return latest_revisions
+
+
+def get_latest_revision(obj, latest_revisions=None):
+    """Gets the (user's full name, date created) of the object's most recent revision, from the
+    result of get_latest_revisions if given (otherwise it's looked up on its own)
+    """
+
+    if latest_revisions is None:
+        latest_revisions = get_latest_revisions([obj])
+
+    return latest_revisions.get((obj._meta.concrete_model, obj.pk), ('ATP', None))
+
+
+class DirtyFieldsMixin(object):
+    """Remembers the values of the tracked fields as they were loaded from (or last saved to)
+    the database, so changes can be detected without reading the row again.
+
+    TRACKED_FIELDS lists the attnames to track; by default every concrete field is tracked.
+    With SAVE_DIRTY_FIELDS_ONLY, saving a loaded object only writes the fields that changed.
+    """
+
+    TRACKED_FIELDS = None
+
+    SAVE_DIRTY_FIELDS_ONLY = False
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DirtyFieldsMixin, cls).from_db(db, field_names, values)
+        instance.snapshot_fields()
+        return instance
+
+    def get_tracked_fields(self):
+        """Gets the attnames of the tracked fields"""
+
+        if self.TRACKED_FIELDS is not None:
+            return self.TRACKED_FIELDS
+        return [field.attname for field in self._meta.concrete_fields]
+
+    def snapshot_fields(self, fields=None):
+        """Remembers the current values of the tracked fields (or just the given ones)"""
+
+        if self._loaded_values is None:
+            self._loaded_values = {}
+        tracked_fields = set(self.get_tracked_fields())
+        for attname in fields if fields is not None else tracked_fields:
+            if attname in tracked_fields and attname in self.__dict__:
+                self._loaded_values[attname] = self.__dict__[attname]
+
+    def get_dirty_fields(self):
+        """Gets the old values of the tracked fields that have changed, keyed by attname.
+        For an object that wasn't loaded from the database, every tracked field has changed.
+        """
+
+        if self._loaded_values is None:
+            return dict((attname, None) for attname in self.get_tracked_fields())
+
+        return dict((attname, old_value) for attname, old_value in self._loaded_values.items()
+                    if self.__dict__.get(attname) != old_value)
+
+    def get_saved_values(self):
+        """Gets the values of the tracked fields as they were loaded or last saved, keyed by attname.
+        Objects that weren't loaded from the database are read back from it instead (once).
+        Returns None if the object isn't in the database.
+        """
+
+        if self._loaded_values is None:
+            try:
+                saved_object = self.__class__._default_manager.get(pk=self.pk)
+            except self.DoesNotExist:
+                return None
+            self._loaded_values = saved_object._loaded_values
+
+        return dict(self._loaded_values)
+
+    def set_field_values(self, values):
+        """Sets the given field values, and returns the names of the fields that actually changed.
+        Pass the result as update_fields to save only those columns.
+        """
+
+        changed_fields = []
+        for name, value in values.items():
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed_fields.append(name)
+
+        return changed_fields
+
+    def save(self, *args, **kwargs):
+        if (self.SAVE_DIRTY_FIELDS_ONLY and self.pk and self._loaded_values is not None and not args and
+                kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            dirty_fields = self.get_dirty_fields()
+            # With nothing to write, do a regular save so post_save (and reversion) still run
+            if dirty_fields:
+                kwargs['update_fields'] = list(dirty_fields) + [
+                    field.attname for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = [self._meta.get_field(name).attname for name in update_fields]
+        self.snapshot_fields(update_fields)
+
+
 class EASUpdateMixin(object):
     """If it's expired or inactive, unset this object from any foriegn key fields"""
 
@@ -195,9 +356,38 @@ class EASUpdateMixin(object):
                     item.save()
 
 
-class AllowedCostSchedule(EASUpdateMixin, models.Model):
+class AutocompleteMixin(object):
+    """Searches an EAS reference model a page at a time, for the autocomplete widgets.
+    Matches are active objects with an AUTOCOMPLETE_FIELDS value that starts with the search
+    term. Each of those fields is indexed together with active, so a search only reads the
+    rows it returns, however big the table is.
+    """
+
+    AUTOCOMPLETE_FIELDS = ()
+    AUTOCOMPLETE_PAGE_SIZE = 20
+
+    @classmethod
+    def autocomplete(cls, term, page=1):
+        """Gets a page of the objects matching the search term, and whether there are more"""
+
+        query = Q()
+        for field in cls.AUTOCOMPLETE_FIELDS:
+            query |= Q(**{'%s__istartswith' % field: term})
+
+        start = (page - 1) * cls.AUTOCOMPLETE_PAGE_SIZE
+        end = start + cls.AUTOCOMPLETE_PAGE_SIZE
+        # One extra row tells us if there's another page, without counting the matches
+        objects = list(cls.objects.filter(query, active=True).order_by(
+            cls.AUTOCOMPLETE_FIELDS[0], 'pk')[start:end + 1])
+
+        return objects[:cls.AUTOCOMPLETE_PAGE_SIZE], len(objects) > cls.AUTOCOMPLETE_PAGE_SIZE
+
+
+class AllowedCostSchedule(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the AllowedCostSchedule data"""
 
+    AUTOCOMPLETE_FIELDS = ('name',)
+
     EAS_FIELD_ORDER = [
         'id',
         'name',
@@ -215,11 +405,14 @@ class AllowedCostSchedule(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['name']
+        index_together = [['active', 'name']]
 
 
-class AwardManager(FieldIteratorMixin, EASUpdateMixin, models.Model):
+class AwardManager(FieldIteratorMixin, AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the AwardManager data"""
 
+    AUTOCOMPLETE_FIELDS = ('full_name', 'gwid')
+
     EAS_FIELD_ORDER = [
         'id',
         'full_name',
@@ -271,10 +464,15 @@ class AwardManager(FieldIteratorMixin, EASUpdateMixin, models.Model):
     def __unicode__(self):
         return self.full_name
 
+    class Meta:
+        index_together = [['active', 'full_name'], ['active', 'gwid']]
+
 
-class AwardOrganization(EASUpdateMixin, models.Model):
+class AwardOrganization(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the AwardOrganization data"""
 
+    AUTOCOMPLETE_FIELDS = ('name',)
+
     EAS_FIELD_ORDER = [
         'id',
         'name',
@@ -298,11 +496,14 @@ class AwardOrganization(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['name']
+        index_together = [['active', 'name']]
 
 
-class AwardTemplate(EASUpdateMixin, models.Model):
+class AwardTemplate(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the AwardTemplate data"""
 
+    AUTOCOMPLETE_FIELDS = ('number', 'short_name')
+
     EAS_FIELD_ORDER = [
         'id',
         'number',
@@ -320,11 +521,14 @@ class AwardTemplate(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['number']
+        index_together = [['active', 'number'], ['active', 'short_name']]
 
 
-class CFDANumber(EASUpdateMixin, models.Model):
+class CFDANumber(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the CFDANumber data"""
 
+    AUTOCOMPLETE_FIELDS = ('flex_value', 'description')
+
     EAS_FIELD_ORDER = [
         'flex_value',
         'description',
@@ -345,11 +549,14 @@ class CFDANumber(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['flex_value']
+        index_together = [['active', 'flex_value'], ['active', 'description']]
 
 
-class FedNegRate(EASUpdateMixin, models.Model):
+class FedNegRate(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the FedNegRate data"""
 
+    AUTOCOMPLETE_FIELDS = ('description', 'flex_value')
+
     EAS_FIELD_ORDER = [
         'flex_value',
         'description',
@@ -370,11 +577,14 @@ class FedNegRate(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['description']
+        index_together = [['active', 'description'], ['active', 'flex_value']]
 
 
-class FundingSource(EASUpdateMixin, models.Model):
+class FundingSource(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the FundingSource data"""
 
+    AUTOCOMPLETE_FIELDS = ('number', 'name')
+
     EAS_FIELD_ORDER = [
         'name',
         'number',
@@ -394,11 +604,14 @@ class FundingSource(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['number']
+        index_together = [['active', 'number'], ['active', 'name']]
 
 
-class IndirectCost(EASUpdateMixin, models.Model):
+class IndirectCost(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the IndirectCost data"""
 
+    AUTOCOMPLETE_FIELDS = ('rate_schedule',)
+
     EAS_FIELD_ORDER = [
         'id',
         'rate_schedule',
@@ -416,11 +629,14 @@ class IndirectCost(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['rate_schedule']
+        index_together = [['active', 'rate_schedule']]
 
 
-class PrimeSponsor(EASUpdateMixin, models.Model):
+class PrimeSponsor(AutocompleteMixin, EASUpdateMixin, models.Model):
     """Model for the PrimeSponsor data"""
 
+    AUTOCOMPLETE_FIELDS = ('name',)
+
     EAS_FIELD_ORDER = [
         'name',
         'number',
@@ -438,6 +654,7 @@ class PrimeSponsor(EASUpdateMixin, models.Model):
 
     class Meta:
         ordering = ['name']
+        index_together = [['active', 'name']]
 
 
 class EASMapping(models.Model):
@@ -465,12 +682,12 @@ class EASMapping(models.Model):
                                          self.atp_pk)
 
     class Meta:
+        # A value maps to one ATP object; a second mapping for it would be ambiguous
         unique_together = (
             'interface',
             'field',
             'incoming_value',
-            'atp_model',
-            'atp_pk')
+            'atp_model')
 
 
 class EASMappingException(Exception):
@@ -485,18 +702,557 @@ class EASMappingException(Exception):
         self.atp_model = atp_model
 
 
+class EASMappingIndex(object):
+    """Process-level index of EASMapping rows.
+
+    Maps (interface, field, incoming_value, atp_model) straight to the mapped ATP primary key.
+    The whole table is loaded with one query on first use and cleared whenever an EASMapping
+    is saved or deleted. Changes made by other processes are noticed through the shared
+    eas_mapping_changes stamp, which is checked at most every CHECK_INTERVAL seconds.
+    Misses also fall back to the database.
+    """
+
+    CHECK_INTERVAL = 5
+
+    def __init__(self):
+        self._index = None
+        self._stamp = None
+        self._checked = 0
+
+    def _load(self):
+        rows = EASMapping.objects.values_list('interface', 'field', 'incoming_value', 'atp_model', 'atp_pk')
+        return dict(((interface, field, incoming_value, atp_model), atp_pk)
+                    for interface, field, incoming_value, atp_model, atp_pk in rows)
+
+    def get_atp_pk(self, interface, field, incoming_value, atp_model):
+        """Gets the primary key of the ATP object mapped to the given value, or None"""
+
+        index = self._get_index()
+
+        key = (interface, field, incoming_value, atp_model)
+        if key not in index:
+            atp_pk = EASMapping.objects.filter(
+                interface=interface,
+                field=field,
+                incoming_value=incoming_value,
+                atp_model=atp_model).values_list('atp_pk', flat=True).first()
+            if atp_pk is None:
+                return None
+            index[key] = atp_pk
+
+        return index[key]
+
+    def _get_index(self):
+        now = time.time()
+        if self._index is not None and now - self._checked < self.CHECK_INTERVAL:
+            return self._index
+
+        # Read the stamp before loading, so a change made during the load is seen next time
+        stamp = eas_mapping_changes.get()
+        if self._index is None or stamp != self._stamp:
+            self._index = self._load()
+            self._stamp = stamp
+        self._checked = now
+        return self._index
+
+    def clear(self):
+        self._index = None
+
+eas_mapping_index = EASMappingIndex()
+
+
+@receiver(post_delete, sender=EASMapping)
+@receiver(post_save, sender=EASMapping)
+def clear_eas_mapping_index(sender, instance, **kwargs):
+    """Use Django signals to drop the EASMapping index whenever a mapping changes,
+    here and (through the shared stamp) in every other process
+    """
+    eas_mapping_index.clear()
+    eas_mapping_changes.touch()
+
+
+class CachedChoices(object):
+    """Form field choices that are queried when they're first needed instead of when the module
+    is imported, then kept in the cache until something they depend on changes.
+
+    Calling it returns the choices, so it can be passed straight to a ChoiceField as a
+    callable. The cache is shared between processes if the CACHES backend is; with the
+    local-memory backend, other processes see a change after at most `timeout` seconds.
+    """
+
+    def __init__(self, cache_key, get_choices, timeout=60):
+        self.cache_key = cache_key
+        self.get_choices = get_choices
+        self.timeout = timeout
+
+    def __call__(self):
+        choices = cache.get(self.cache_key)
+        if choices is None:
+            choices = list(self.get_choices())
+            cache.set(self.cache_key, choices, self.timeout)
+        return choices
+
+    def clear(self):
+        cache.delete(self.cache_key)
+
+
+class ChangeStamp(object):
+    """Remembers when the data behind some views last changed, so they can answer conditional
+    GETs (ETag / Last-Modified) without building their response again.
+
+    The stamp is kept in the cache, so every process only sees the same one if the CACHES
+    backend is shared (see the production settings). A stamp that's gone from the cache is
+    replaced by a new one, which just costs clients a full response.
+    """
+
+    def __init__(self, cache_key, timeout=60 * 60 * 24):
+        self.cache_key = cache_key
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        """Gets the time of the last change"""
+
+        stamp = cache.get(self.cache_key)
+        if stamp is None:
+            stamp = self._set()
+        return stamp
+
+    def get_etag(self):
+        return self.get().strftime('%Y%m%d%H%M%S%f')
+
+    def touch(self):
+        """Records a change now, or at the end of the deferred() block"""
+
+        if getattr(self._local, 'deferred', None) is not None:
+            self._local.deferred = True
+        else:
+            self._set()
+
+    @contextmanager
+    def deferred(self):
+        """Records changes made while the block runs as one change at the end.
+        Use it around bulk imports.
+        """
+
+        if getattr(self._local, 'deferred', None) is not None:
+            yield
+            return
+
+        self._local.deferred = False
+        try:
+            yield
+        finally:
+            changed = self._local.deferred
+            self._local.deferred = None
+            if changed:
+                self._set()
+
+    def _set(self):
+        stamp = timezone.now()
+        cache.set(self.cache_key, stamp, self.timeout)
+        return stamp
+
+eas_mapping_changes = ChangeStamp('awards:eas_mapping_changes')
+
+
+class BackgroundJob(models.Model):
+    """A long-running task (like the Cayuse sync) executed outside of the request that started it.
+
+    The jobs table doubles as the queue, so no broker is needed. While a job is queued or
+    running its active_key holds the job type; the unique constraint on it makes concurrent
+    triggers of the same job collapse into the one that is already active.
+    """
+
+    CAYUSE_SYNC = 'cayuse_sync'
+    JOB_TYPE_CHOICES = (
+        (CAYUSE_SYNC, 'Cayuse proposal sync'),
+    )
+
+    QUEUED = 'Q'
+    RUNNING = 'R'
+    COMPLETE = 'C'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (COMPLETE, 'Complete'),
+        (FAILED, 'Failed'),
+    )
+
+    # Active jobs that haven't reported progress for this long are assumed to be dead
+    STALE_AFTER = timedelta(minutes=30)
+    # Running jobs call heartbeat() often; it writes to the database at most this often
+    HEARTBEAT_INTERVAL = timedelta(minutes=1)
+
+    job_type = models.CharField(choices=JOB_TYPE_CHOICES, max_length=50)
+    status = models.CharField(choices=STATUS_CHOICES, max_length=1, default=QUEUED)
+    active_key = models.CharField(max_length=50, unique=True, null=True, blank=True)
+    rows_seen = models.IntegerField(default=0)
+    rows_new = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_updated = models.DateTimeField(auto_now=True)
+    date_completed = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return u'%s #%s (%s)' % (self.get_job_type_display(), self.id, self.get_status_display())
+
+    @classmethod
+    def enqueue(cls, job_type, requested_by=None):
+        """Queues a new job of the given type, or returns the one that's already active.
+        The second value returned is True if a new job was queued.
+        """
+
+        cls.release_stale_jobs(job_type)
+
+        while True:
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(job_type=job_type, active_key=job_type, requested_by=requested_by), True
+            except IntegrityError:
+                # If the active job finished in the meantime, try queueing again
+                job = cls.objects.filter(active_key=job_type).first()
+                if job:
+                    return job, False
+
+    @classmethod
+    def release_stale_jobs(cls, job_type):
+        """Fails active jobs whose process stopped reporting progress, so they don't block new ones"""
+
+        cls.objects.filter(
+            active_key=job_type,
+            date_updated__lt=timezone.now() - cls.STALE_AFTER).update(
+            status=cls.FAILED,
+            active_key=None,
+            error='The job stopped responding',
+            date_completed=timezone.now())
+
+    def claim(self):
+        """Marks a queued job as running. Returns False if another worker got to it first."""
+
+        now = timezone.now()
+        claimed = BackgroundJob.objects.filter(pk=self.pk, status=self.QUEUED).update(
+            status=self.RUNNING, date_started=now, date_updated=now)
+        if claimed:
+            self.status = self.RUNNING
+            self.date_started = self.date_updated = now
+        return bool(claimed)
+
+    def heartbeat(self):
+        """Tells release_stale_jobs this job is still alive. Cheap enough to call for every row."""
+
+        now = timezone.now()
+        if self.date_updated and now - self.date_updated < self.HEARTBEAT_INTERVAL:
+            return
+
+        BackgroundJob.objects.filter(pk=self.pk).update(date_updated=now)
+        self.date_updated = now
+
+    def record_progress(self, seen=0, new=0, failed=0):
+        """Adds to the progress counters and saves them (which also serves as a heartbeat)"""
+
+        self.rows_seen += seen
+        self.rows_new += new
+        self.rows_failed += failed
+        self.save(update_fields=['rows_seen', 'rows_new', 'rows_failed', 'date_updated'])
+
+    def finish(self, error=''):
+        """Marks the job as complete (or failed, if an error is given) and releases its active_key"""
+
+        self.status = self.FAILED if error else self.COMPLETE
+        self.error = error
+        self.active_key = None
+        self.date_completed = timezone.now()
+        self.save(update_fields=['status', 'error', 'active_key', 'date_completed', 'date_updated'])
+
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def get_progress(self):
+        """Gets the job's state as a JSON-serializable dict for the status endpoint"""
+
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.get_status_display(),
+            'active': self.is_active(),
+            'rows_seen': self.rows_seen,
+            'rows_new': self.rows_new,
+            'rows_failed': self.rows_failed,
+            'error': self.error,
+            'date_started': self.date_started.isoformat() if self.date_started else None,
+            'date_completed': self.date_completed.isoformat() if self.date_completed else None,
+        }
+
+
+class OutboundEmail(models.Model):
+    """A notification email waiting to be sent by the send_queued_email command.
+
+    Emails are written in the same transaction as the change that triggered them, so a save
+    that gets rolled back never sends its email, and a slow or unreachable mail server never
+    holds up (or rolls back) a request. Emails that keep failing are left as FAILED for an
+    administrator to look at and retry.
+
+    When EMAIL_DIGEST_MINUTES is set, each recipient gets their own digest row, held back for
+    that many minutes. Everything queued for a recipient by then goes out as one message, so
+    bulk changes (like reassigning dozens of awards) don't send a separate email for each one.
+    """
+
+    PENDING = 'P'
+    SENDING = 'S'
+    SENT = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    # Emails are given up on after this many attempts. The wait between attempts starts at
+    # RETRY_DELAY and doubles after each one.
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = timedelta(minutes=5)
+
+    # Claimed emails that haven't been sent after this long were claimed by a worker that died
+    STALE_AFTER = timedelta(minutes=30)
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()
+    digest = models.BooleanField(default=False)
+    status = models.CharField(choices=STATUS_CHOICES, max_length=1, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claim_token = models.CharField(max_length=32, null=True, blank=True, db_index=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    date_claimed = models.DateTimeField(null=True, blank=True)
+    date_sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = [['status', 'next_attempt']]
+
+    def __unicode__(self):
+        return u'%s to %s (%s)' % (self.subject, self.recipients, self.get_status_display())
+
+    @classmethod
+    def enqueue(cls, subject, body, from_email, recipient_list):
+        """Queues an email to be sent by the worker and returns the queued rows. Takes the
+        same arguments as send_mail. If EMAIL_USE_OUTBOX is off, the email is sent right away.
+        """
+
+        if not settings.EMAIL_USE_OUTBOX:
+            send_mail(subject, body, from_email, recipient_list, fail_silently=False)
+            return []
+
+        if not settings.EMAIL_DIGEST_MINUTES:
+            return [cls.objects.create(
+                subject=subject,
+                body=body,
+                from_email=from_email,
+                recipients=', '.join(recipient_list))]
+
+        send_after = timezone.now() + timedelta(minutes=settings.EMAIL_DIGEST_MINUTES)
+        return [cls.objects.create(
+            subject=subject,
+            body=body,
+            from_email=from_email,
+            recipients=recipient,
+            digest=True,
+            next_attempt=send_after) for recipient in recipient_list]
+
+    @classmethod
+    def release_stale_claims(cls):
+        """Puts emails claimed by a worker that stopped responding back in the queue"""
+
+        cls.objects.filter(
+            status=cls.SENDING,
+            date_claimed__lt=timezone.now() - cls.STALE_AFTER).update(
+            status=cls.PENDING,
+            claim_token=None)
+
+    @classmethod
+    def claim_batch(cls, batch_size):
+        """Marks up to batch_size emails that are due as being sent and returns them.
+        Emails claimed by another worker in the meantime are left out.
+        """
+
+        cls.release_stale_claims()
+
+        now = timezone.now()
+        due_emails = list(cls.objects.filter(status=cls.PENDING, next_attempt__lte=now).order_by(
+            'id').values_list('id', 'digest', 'recipients')[:batch_size])
+        if not due_emails:
+            return []
+
+        # Once a recipient's digest is due, everything else queued for them goes out with it
+        email_ids = [email_id for email_id, digest, recipients in due_emails]
+        digest_recipients = set(recipients for email_id, digest, recipients in due_emails if digest)
+        if digest_recipients:
+            email_ids.extend(cls.objects.filter(
+                status=cls.PENDING,
+                digest=True,
+                recipients__in=digest_recipients).exclude(
+                id__in=email_ids).values_list('id', flat=True))
+
+        claim_token = uuid.uuid4().hex
+        cls.objects.filter(id__in=email_ids, status=cls.PENDING).update(
+            status=cls.SENDING,
+            claim_token=claim_token,
+            date_claimed=now)
+        return list(cls.objects.filter(claim_token=claim_token).order_by('id'))
+
+    @classmethod
+    def group_into_messages(cls, emails):
+        """Groups claimed emails by the message they'll be sent in. Digest emails to the same
+        recipient share a message; every other email is sent on its own.
+        """
+
+        messages = OrderedDict()
+        for email in emails:
+            key = (email.from_email, email.recipients) if email.digest else email.id
+            messages.setdefault(key, []).append(email)
+        return messages.values()
+
+    @classmethod
+    def get_message(cls, emails, connection):
+        """Gets the EmailMessage that sends a group of emails over the given connection"""
+
+        first_email = emails[0]
+        if len(emails) == 1:
+            subject, body = first_email.subject, first_email.body
+        else:
+            subject = first_email.subject
+            if any(email.subject != subject for email in emails):
+                subject = 'OVPR ATP Updates'
+            body = 'You have %s updates in ATP:\n\n%s' % (
+                len(emails), '\n\n'.join(email.body for email in emails))
+
+        return EmailMessage(subject, body, first_email.from_email, first_email.get_recipient_list(),
+                            connection=connection)
+
+    def get_recipient_list(self):
+        return [recipient.strip() for recipient in self.recipients.split(',') if recipient.strip()]
+
+    def mark_sent(self):
+        self.status = self.SENT
+        self.claim_token = None
+        self.date_sent = timezone.now()
+        self.save(update_fields=['status', 'claim_token', 'date_sent'])
+
+    def mark_failed(self, error):
+        """Records a failed attempt, scheduling a retry or giving up after MAX_ATTEMPTS"""
+
+        self.attempts += 1
+        self.last_error = error
+        self.claim_token = None
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            self.next_attempt = timezone.now() + self.RETRY_DELAY * 2 ** (self.attempts - 1)
+        self.save(update_fields=['status', 'attempts', 'last_error', 'claim_token', 'next_attempt'])
+
+    def retry(self):
+        """Puts a failed email back in the queue to be sent as soon as possible"""
+
+        self.status = self.PENDING
+        self.attempts = 0
+        self.next_attempt = timezone.now()
+        self.save(update_fields=['status', 'attempts', 'next_attempt'])
+
+
 class ATPAuditTrail(models.Model):
     """It is used internally to track each point of time when an award assinged and completed from a particular stage"""
-    award = models.IntegerField()
+    # The composite index below starts with award, so this doesn't need its own.
+    # The trail is kept as history when its award is deleted.
+    award = models.ForeignKey('Award', db_column='award', db_index=False, null=True, on_delete=models.SET_NULL)
     modification = models.CharField(max_length=100)
     workflow_step = models.CharField(max_length=100)
     date_created = models.DateTimeField(blank=True, null=True)
     date_completed = models.DateTimeField(blank=True, null=True)
     assigned_user = models.CharField(max_length=100)
 
+    class Meta:
+        index_together = [
+            ['award', 'modification', 'workflow_step', 'assigned_user'],
+        ]
+
+
+class ATPAuditTrailRecorder(object):
+    """Buffers the audit trail entries for one award and writes them together.
+
+    Recording a (modification, workflow step, user) that already has a trail entry marks it
+    completed; otherwise a new entry is started. flush() looks up all the buffered entries
+    with one query, then completes the existing ones with one UPDATE and creates the
+    rest with one bulk INSERT.
+    """
+
+    def __init__(self, award):
+        self.award = award
+        self._entries = OrderedDict()
 
-class Award(models.Model):
+    def record(self, modification, workflow_step, assigned_user, create_if_missing=True):
+        """Buffers an entry. With create_if_missing unset, only an existing entry is completed."""
+
+        key = (modification, workflow_step, assigned_user)
+        entry = self._entries.setdefault(key, {'count': 0, 'create_if_missing': False})
+        entry['count'] += 1
+        entry['create_if_missing'] = entry['create_if_missing'] or create_if_missing
+
+    def flush(self):
+        if not self._entries:
+            return
+
+        now = datetime.now()
+        entries, self._entries = self._entries, OrderedDict()
+
+        existing = ATPAuditTrail.objects.filter(
+            award=self.award,
+            modification__in=set(key[0] for key in entries),
+            workflow_step__in=set(key[1] for key in entries)).values_list(
+            'id', 'modification', 'workflow_step', 'assigned_user')
+
+        completed_ids = []
+        found_keys = set()
+        for trail_id, modification, workflow_step, assigned_user in existing:
+            key = (modification, workflow_step, assigned_user)
+            if key in entries:
+                completed_ids.append(trail_id)
+                found_keys.add(key)
+
+        if completed_ids:
+            ATPAuditTrail.objects.filter(id__in=completed_ids).update(date_completed=now)
+
+        new_entries = []
+        for key, entry in entries.items():
+            if key in found_keys or not entry['create_if_missing']:
+                continue
+            modification, workflow_step, assigned_user = key
+            # Recording the same step twice in one go both starts and completes it
+            new_entries.append(ATPAuditTrail(
+                award=self.award,
+                modification=modification,
+                workflow_step=workflow_step,
+                assigned_user=assigned_user,
+                date_created=now,
+                date_completed=now if entry['count'] > 1 else None))
+
+        if new_entries:
+            ATPAuditTrail.objects.bulk_create(new_entries)
+
+
+class Award(DirtyFieldsMixin, models.Model):
     """The primary model"""
+
+    SAVE_DIRTY_FIELDS_ONLY = True
+
     WAIT_FOR = {'RB': 'Revised Budget', 'PA': 'PI Access', 'CA': 'Cost Share Approval', 'FC': 'FCOI',
                 'PS': 'Proposal Submission', 'SC': 'Sponsor Clarity', 'NO': 'New Org needed',
                 'IC': 'Internal Clarification', 'DC': 'Documents not in GW Docs'
@@ -587,6 +1343,17 @@ class Award(models.Model):
     AWARD_SETUP_STATUS = 3
     AWARD_ACCEPTANCE_STATUS = 1
 
+    # The user fields that assignments can be moved between users on
+    ASSIGNMENT_USER_FIELDS = [
+        'award_acceptance_user',
+        'award_negotiation_user',
+        'award_setup_user',
+        'award_modification_user',
+        'subaward_user',
+        'award_management_user',
+        'award_closeout_user',
+    ]
+
     status = models.IntegerField(choices=STATUS_CHOICES, default=0)
     creation_date = models.DateField(auto_now_add=True)
     extracted_to_eas = models.BooleanField(default=False)
@@ -653,6 +1420,10 @@ class Award(models.Model):
     award_dual_modification = models.BooleanField(default=False)
     award_text = models.CharField(max_length=50, blank=True, null=True)
 
+    # How many modifications have been made to this award (i.e. AwardAcceptances after the
+    # first one). Maintained by create_modification so the workflow doesn't have to count them.
+    modification_count = models.PositiveIntegerField(default=0, editable=False)
+
     # If an award has a proposal, use that to determine its name. Otherwise,
     # use its internal ID
     def __unicode__(self):
@@ -753,6 +1524,87 @@ class Award(models.Model):
 
         return assignment_list
 
+    @classmethod
+    def get_open_assignments(cls, user_id, department=None):
+        """Gets the awards that aren't complete yet and are assigned to the user in any section.
+        If a department name is given, only awards whose first proposal is in that department
+        (or has no department) are included.
+        """
+
+        assigned = Q()
+        for user_field in cls.ASSIGNMENT_USER_FIELDS:
+            assigned |= Q(**{user_field + '_id': user_id})
+        awards = cls.objects.filter(assigned, status__lt=cls.END_STATUS)
+
+        if department:
+            awards = awards.filter(
+                Q(proposal__is_first_proposal=True) &
+                (Q(proposal__department_name__isnull=True) | Q(proposal__department_name__name=department)))
+
+        return awards
+
+    @classmethod
+    def get_open_assignment_rows(cls, user_id, department=None):
+        """Gets (award id, status, department name) for each of the user's open assignments in one
+        query. The department is the first proposal's, or None if the award doesn't have one.
+        """
+
+        awards = cls.get_open_assignments(user_id, department)
+        if not department:
+            awards = awards.filter(Q(proposal__is_first_proposal=True) | Q(proposal__isnull=True))
+
+        return awards.values_list('id', 'status', 'proposal__department_name__name').order_by('id')
+
+    @classmethod
+    def get_open_assignment_departments(cls, user_id):
+        """Counts the user's open assignments in each first proposal department, in one query"""
+
+        return cls.get_open_assignments(user_id).filter(
+            proposal__is_first_proposal=True,
+            proposal__department_name__isnull=False,
+        ).values_list('proposal__department_name__name').annotate(
+            award_count=Count('id', distinct=True)).order_by('proposal__department_name__name')
+
+    @classmethod
+    def reassign(cls, old_user_id, new_user_id, department=None):
+        """Moves every open assignment from one user to another with one UPDATE per user field,
+        rather than saving each award. Returns the ids of the awards that were reassigned.
+        """
+
+        with transaction.atomic():
+            award_ids = list(cls.get_open_assignments(old_user_id, department).values_list(
+                'id', flat=True).distinct())
+            if not award_ids:
+                return []
+
+            for user_field in cls.ASSIGNMENT_USER_FIELDS:
+                cls.objects.filter(
+                    id__in=award_ids,
+                    status__lt=cls.END_STATUS,
+                    **{user_field + '_id': old_user_id}).update(**{user_field + '_id': new_user_id})
+
+        # update() doesn't send post_save, so clear the cached choices and mark the feeds changed ourselves
+        open_assignment_user_choices.clear()
+        feed_changes.touch()
+        return award_ids
+
+    @classmethod
+    def send_reassignment_notification(cls, user, award_ids):
+        """Sends one email to a user listing all of the awards that were just reassigned to them"""
+
+        if not user.email:
+            return
+
+        award_links = ['Award #%s: %s%s' % (award_id, settings.EMAIL_URL_HOSTNAME,
+                                            reverse('award_detail', kwargs={'award_pk': award_id}))
+                       for award_id in sorted(award_ids)]
+
+        OutboundEmail.enqueue(
+            'OVPR ATP Update',
+            '%s award(s) have been reassigned to you in ATP:\n\n%s' % (len(award_ids), '\n'.join(award_links)),
+            'reply@email.gwu.edu',
+            [user.email])
+
     def get_absolute_url(self):
         """Gets the URL used to navigate to this object"""
 
@@ -762,7 +1614,7 @@ class Award(models.Model):
         # On initial save, create a dummy proposal and blank sections
         if not self.pk:
             super(Award, self).save(*args, **kwargs)
-            Proposal.objects.create(award=self, dummy=True)
+            Proposal.objects.create(award=self, dummy=True, is_first_proposal=True)
             AwardAcceptance.objects.create(award=self)
             AwardNegotiation.objects.create(award=self)
             AwardSetup.objects.create(award=self)
@@ -770,27 +1622,99 @@ class Award(models.Model):
             AwardCloseout.objects.create(award=self)
         else:
             check_status = kwargs.pop('check_status', True)
-            try:
-                old_object = Award.objects.get(pk=self.pk)
-            except Award.DoesNotExist:
+            old_values = self.get_saved_values()
+            if old_values is None:
                 super(Award, self).save(*args, **kwargs)
                 return
 
-            if any([self.award_acceptance_user != old_object.award_acceptance_user, self.award_closeout_user != old_object.award_closeout_user,
-                    self.award_management_user != old_object.award_management_user, self.award_modification_user != old_object.award_modification_user,
-                    self.award_negotiation_user != old_object.award_negotiation_user, self.award_setup_user != old_object.award_setup_user]):
-                self.send_to_setup = old_object.send_to_setup
-                self.send_to_modification = old_object.send_to_modification
-                self.common_modification = old_object.common_modification
-                self.award_dual_modification = old_object.award_dual_modification
-                self.award_dual_setup = old_object.award_dual_setup
-                self.award_dual_negotiation = old_object.award_dual_negotiation
+            # Compare the ids so we don't have to load the users
+            if any(getattr(self, user_field) != old_values[user_field] for user_field in [
+                    'award_acceptance_user_id',
+                    'award_closeout_user_id',
+                    'award_management_user_id',
+                    'award_modification_user_id',
+                    'award_negotiation_user_id',
+                    'award_setup_user_id']):
+                self.send_to_setup = old_values['send_to_setup']
+                self.send_to_modification = old_values['send_to_modification']
+                self.common_modification = old_values['common_modification']
+                self.award_dual_modification = old_values['award_dual_modification']
+                self.award_dual_setup = old_values['award_dual_setup']
+                self.award_dual_negotiation = old_values['award_dual_negotiation']
 
             super(Award, self).save(*args, **kwargs)
 
-            if check_status and old_object.status > 1 and self.status == 1 and self.get_current_award_acceptance().phs_funded:
+            if check_status and old_values['status'] > 1 and self.status == 1 and self.get_current_award_acceptance().phs_funded:
                 self.send_phs_funded_notification()
 
+    # Related objects loaded along with the award itself by the views that show its page
+    GRAPH_SELECT_RELATED = [
+        'award_acceptance_user',
+        'award_negotiation_user',
+        'award_setup_user',
+        'award_modification_user',
+        'subaward_user',
+        'award_management_user',
+        'award_closeout_user',
+        'proposalintake',
+        'awardsetup',
+        'awardmanagement',
+        'awardcloseout',
+    ]
+
+    @classmethod
+    def get_graph_prefetches(cls):
+        """Gets the prefetch plan for everything else an award's page shows (see load_graph).
+        The filtered querysets match the ones the get_* methods below would run.
+        """
+
+        return [
+            Prefetch('proposal_set', to_attr='_graph_real_proposals',
+                     queryset=Proposal.objects.filter(dummy=False).select_related(
+                         'principal_investigator').order_by('id')),
+            '_graph_real_proposals__keypersonnel_set',
+            '_graph_real_proposals__performancesite_set',
+            Prefetch('awardacceptance_set', to_attr='_graph_current_award_acceptances',
+                     queryset=AwardAcceptance.objects.filter(current_modification=True).order_by('-creation_date')),
+            Prefetch('awardacceptance_set', to_attr='_graph_previous_award_acceptances',
+                     queryset=AwardAcceptance.objects.filter(current_modification=False)),
+            Prefetch('awardnegotiation_set', to_attr='_graph_current_award_negotiations',
+                     queryset=AwardNegotiation.objects.filter(current_modification=True).order_by('-date_assigned')),
+            Prefetch('awardnegotiation_set', to_attr='_graph_previous_award_negotiations',
+                     queryset=AwardNegotiation.objects.filter(current_modification=False)),
+            Prefetch('awardmodification_set', to_attr='_graph_modifications',
+                     queryset=AwardModification.objects.order_by('-id')),
+            'ptanumber_set',
+            'subaward_set',
+            'priorapproval_set',
+            'reportsubmission_set',
+            'finalreport_set',
+        ]
+
+    @classmethod
+    def get_graph(cls, pk):
+        """Gets an award with everything its page shows loaded, in a fixed number of queries"""
+
+        award = cls.objects.select_related(*cls.GRAPH_SELECT_RELATED).get(pk=pk)
+        award.load_graph()
+        return award
+
+    def load_graph(self):
+        """Prefetches everything the award's page shows onto this award (once)"""
+
+        if not self.is_graph_loaded():
+            prefetch_related_objects([self], self.get_graph_prefetches())
+
+    def is_graph_loaded(self):
+        return hasattr(self, '_graph_real_proposals')
+
+    def get_modifications(self):
+        """Gets the award's AwardModifications, newest first"""
+
+        if self.is_graph_loaded():
+            return self._graph_modifications
+        return self.awardmodification_set.order_by('-id')
+
     def get_proposals(self):
         """Gets all Proposals associated with this Award"""
 
@@ -806,6 +1730,11 @@ class Award(models.Model):
     def get_first_real_proposal(self):
         """Gets the first non-dummy Proposal associated with this Award"""
 
+        if self.is_graph_loaded():
+            return next((proposal for proposal in self._graph_real_proposals if proposal.is_first_proposal), None)
+        if hasattr(self, '_admin_first_proposals'):
+            return self._admin_first_proposals[0] if self._admin_first_proposals else None
+
         try:
             first_proposal = self.proposal_set.get(
                 is_first_proposal=True,
@@ -821,7 +1750,10 @@ class Award(models.Model):
         first_proposal = self.get_first_real_proposal()
         supplemental_proposals = None
 
-        if first_proposal:
+        if first_proposal and self.is_graph_loaded():
+            supplemental_proposals = [
+                proposal for proposal in self._graph_real_proposals if proposal.id != first_proposal.id]
+        elif first_proposal:
             supplemental_proposals = self.proposal_set.filter(dummy=False).exclude(id=first_proposal.id).order_by('id')
 
         return supplemental_proposals
@@ -831,44 +1763,95 @@ class Award(models.Model):
         return self.proposal_set.filter(dummy=False).order_by('id').last()
 
     def get_current_award_acceptance(self, acceptance_flag=False):
+        if self.is_graph_loaded():
+            award_acceptance = self._graph_current_award_acceptances
+        elif acceptance_flag:
+            award_acceptance = self.awardacceptance_set.filter(current_modification=True)
+        else:
+            award_acceptance = self.awardacceptance_set.filter(current_modification=True).order_by('-creation_date')
+
         if acceptance_flag:
-            acceptance_object = self.awardacceptance_set.filter(current_modification=True)
-            if acceptance_object:
-                return acceptance_object[0]
+            if award_acceptance:
+                return award_acceptance[0]
             else:
                 acceptance_object = AwardAcceptance()
                 return acceptance_object
-        award_acceptance = self.awardacceptance_set.filter(current_modification=True).order_by('-creation_date')
         if len(award_acceptance) > 1:
             for award in award_acceptance[1:]:
                 award.current_modification = False
                 award.save()
+            if self.is_graph_loaded():
+                self._graph_current_award_acceptances = award_acceptance[:1]
+            return award_acceptance[0]
+        elif award_acceptance:
             return award_acceptance[0]
         else:
-            return self.awardacceptance_set.get(current_modification=True)
+            raise AwardAcceptance.DoesNotExist('Award has no current AwardAcceptance')
+
+    def get_modification_label(self, modification_only=False):
+        """Gets the label used in the audit trail for the award's current modification"""
+
+        if self.modification_count == 0 and not modification_only:
+            return 'Original Award'
+        return 'Modification #%s' % self.modification_count
+
+    def increment_modification_count(self):
+        """Atomically adds one to the award's modification count"""
+
+        Award.objects.filter(pk=self.pk).update(modification_count=F('modification_count') + 1)
+        self.modification_count = Award.objects.filter(pk=self.pk).values_list(
+            'modification_count', flat=True).get()
+        # The database already has this value, so later saves shouldn't write it back over
+        # another request's increment
+        self.snapshot_fields(['modification_count'])
 
     def get_previous_award_acceptances(self):
+        if self.is_graph_loaded():
+            return self._graph_previous_award_acceptances
         return self.awardacceptance_set.filter(current_modification=False)
 
     def get_current_award_negotiation(self):
-        try:
-            negotiation_obj = self.awardnegotiation_set.get(current_modification=True)
-        except:
-            negotiation_obj = None
-        award_negotiation = self.awardnegotiation_set.filter(current_modification=True).order_by('-date_assigned')
+        if self.is_graph_loaded():
+            award_negotiation = self._graph_current_award_negotiations
+        else:
+            award_negotiation = self.awardnegotiation_set.filter(current_modification=True).order_by('-date_assigned')
         if len(award_negotiation) > 1:
             for award in award_negotiation[1:]:
                 award.current_modification = False
                 award.save()
+            if self.is_graph_loaded():
+                self._graph_current_award_negotiations = award_negotiation[:1]
+            return award_negotiation[0]
+        elif award_negotiation:
             return award_negotiation[0]
-        elif negotiation_obj:
-            return self.awardnegotiation_set.get(current_modification=True)
         else:
             return AwardNegotiation()
 
     def get_previous_award_negotiations(self):
+        if self.is_graph_loaded():
+            return self._graph_previous_award_negotiations
         return self.awardnegotiation_set.filter(current_modification=False)
 
+    def get_latest_revisions(self):
+        """Gets the most recent revision of every section shown on the award's page, in a fixed
+        number of queries (one per section model, plus two). Templates look the results up with
+        the latest_revision filter.
+        """
+
+        return get_latest_revisions([
+            model.objects.filter(award=self) for model in [
+                ProposalIntake,
+                Proposal,
+                AwardAcceptance,
+                AwardNegotiation,
+                AwardSetup,
+                AwardModification,
+                PTANumber,
+                Subaward,
+                AwardManagement,
+                AwardCloseout,
+            ]])
+
     def get_first_pta_number(self):
         pta_number = self.ptanumber_set.all().order_by('id')[:1]
         if pta_number:
@@ -1047,7 +2030,7 @@ class Award(models.Model):
         if most_recent_proposal:
             pi_name = ' (PI: {0})'.format(most_recent_proposal.principal_investigator)
 
-        send_mail(
+        OutboundEmail.enqueue(
             'OVPR ATP Update',
             'Award for proposal #%s%s has been assigned to Award Setup in ATP. Go to %s%s to review it.' %
             (self.id,
@@ -1055,21 +2038,13 @@ class Award(models.Model):
              settings.EMAIL_URL_HOSTNAME,
              self.get_absolute_url()),
             'reply@email.gwu.edu',
-            recipients,
-            fail_silently=False)
+            recipients)
 
 
     def send_email_update(self, modification_flag=False):
         """Sends an email update to a user when they've been assigned an active section"""
         if self.status == 1:
-            origional_text = 'Original Award'
-            workflow = 'AwardAcceptance'
-            acceptance_count = AwardAcceptance.objects.filter(award=self).count()
-            if acceptance_count < 2:
-                self.record_current_state_to_atptrail(origional_text, workflow)
-            else:
-                modification = "Modification #%s" % (acceptance_count - 1)
-                self.record_current_state_to_atptrail(modification, workflow)
+            self.record_current_state_to_atptrail(self.get_modification_label(), 'AwardAcceptance')
 
         if modification_flag:
             recipients = [self.get_user_for_section('AwardSetup', modification_flag).email]
@@ -1086,7 +2061,7 @@ class Award(models.Model):
         if most_recent_proposal:
             pi_name = ' (PI: {0})'.format(most_recent_proposal.principal_investigator)
 
-        send_mail(
+        OutboundEmail.enqueue(
             'OVPR ATP Update',
             '%s%s has been assigned to you in ATP. Go to %s%s to review it.' %
             (self,
@@ -1094,15 +2069,14 @@ class Award(models.Model):
              settings.EMAIL_URL_HOSTNAME,
              self.get_absolute_url()),
             'reply@email.gwu.edu',
-            recipients,
-            fail_silently=False)
+            recipients)
 
     def send_award_setup_notification(self):
         """Sends an email to the AwardAcceptance user to let them know the award is in Award Setup"""
 
         recipients = [self.get_user_for_section('AwardAcceptance').email]
 
-        send_mail(
+        OutboundEmail.enqueue(
             'OVPR ATP Update',
             '%s has been sent to the Award Setup step. This email is simply a notification \
 - you are not assigned to perform Award Setup for this award. \
@@ -1111,30 +2085,29 @@ You can view it here: %s%s' %
              settings.EMAIL_URL_HOSTNAME,
              self.get_absolute_url()),
             'reply@email.gwu.edu',
-            recipients,
-            fail_silently=False)
+            recipients)
 
     def send_fcoi_cleared_notification(self, fcoi_cleared_date):
         """Sends an email to the AwardSetup user when the Award's fcoi_cleared_date is set"""
 
         recipients = [self.get_user_for_section('AwardSetup').email]
 
-        send_mail('OVPR ATP Update',
-                  'The FCOI cleared date has been entered on %s - it is %s. \
+        OutboundEmail.enqueue('OVPR ATP Update',
+                              'The FCOI cleared date has been entered on %s - it is %s. \
 You can view it here: %s%s' % (self, fcoi_cleared_date, settings.EMAIL_URL_HOSTNAME, self.get_absolute_url()),
-                  'reply@email.gwu.edu',
-                  recipients, fail_silently=False)
+                              'reply@email.gwu.edu',
+                              recipients)
 
     def send_phs_funded_notification(self):
         """Sends an email to the PHS_FUNDED_RECIPIENTS when the Award has been marked as PHS funded"""
 
         recipients = settings.PHS_FUNDED_RECIPIENTS
 
-        send_mail('OVPR ATP Update',
-                  'PHS funded for %s has been received and requires FCOI verification. \
+        OutboundEmail.enqueue('OVPR ATP Update',
+                              'PHS funded for %s has been received and requires FCOI verification. \
 Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_absolute_url()),
-                  'reply@email.gwu.edu',
-                  recipients, fail_silently=False)
+                              'reply@email.gwu.edu',
+                              recipients)
 
     def send_phs_funded_notification_with_modification(self):
         """Sends an email to the PHS_FUNDED_RECIPIENTS when and Award Modification is created 
@@ -1143,83 +2116,35 @@ Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_
 
         recipients = settings.PHS_FUNDED_RECIPIENTS
 
-        send_mail('OVPR ATP Update',
-                  'PHS funded for %s (Modification) has been received and may require FCOI verification. \
+        OutboundEmail.enqueue('OVPR ATP Update',
+                              'PHS funded for %s (Modification) has been received and may require FCOI verification. \
 Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_absolute_url()),
-                  'reply@email.gwu.edu',
-                  recipients, fail_silently=False)
+                              'reply@email.gwu.edu',
+                              recipients)
 
     def set_date_assigned_for_active_sections(self):
         """Sets the date_assigned, if appliccable, for the currently active section(s)"""
 
-        for section in self.get_active_sections():
-            if section in self.SECTION_FIELD_MAPPING:
-                current_mod = Q()
-                if section in ['AwardNegotiation', 'AwardAcceptance']:
-                    current_mod = Q(current_modification=True)
-
-                for instance in eval(section).objects.filter(current_mod, award=self):
-                    try:
-                        instance.set_date_assigned()
-                    except AttributeError:
-                        pass
+        transition = AwardTransition(self)
+        transition.assign_active_sections()
+        transition.flush()
 
     def record_wait_for_reason(self, workflow_old, workflow_new, model_name):
-        WAIT_FOR = {'RB': 'Revised Budget', 'PA': 'PI Access', 'CA': 'Cost Share Approval', 'FC': 'FCOI',
-                     'PS': 'Proposal Submission', 'SC': 'Sponsor Clarity', 'NO': 'New Org needed',
-                     'IC': 'Internal Clarification', 'DC': 'Documents not in GW Docs'
-                     }
-
-        count_value = AwardAcceptance.objects.filter(award=self).count()
-        if count_value < 2:
-            origional_text = 'Original Award'
-        else:
-            origional_text = "Modification #%s" % (count_value - 1)
+        origional_text = self.get_modification_label()
         user_name = self.get_user_full_name(model_name)
-        if workflow_new:
-            try:
-                trail_object = ATPAuditTrail.objects.get(award=self.id, modification=origional_text,
-                                                         workflow_step=WAIT_FOR[workflow_new], assigned_user=user_name)
-            except:
-                trail_object = None
-
-            if trail_object:
-                trail_object.date_completed = datetime.now()
-            else:
-                trail_object = ATPAuditTrail(award=self.id, modification=origional_text, workflow_step=WAIT_FOR[workflow_new],
-                                             date_created=datetime.now(), assigned_user=user_name)
-            trail_object.save()
 
+        recorder = ATPAuditTrailRecorder(self)
+        if workflow_new:
+            recorder.record(origional_text, self.WAIT_FOR[workflow_new], user_name)
         if workflow_old:
-            try:
-                trail_object = ATPAuditTrail.objects.get(award=self.id, modification=origional_text,
-                                                         workflow_step=WAIT_FOR[workflow_old], assigned_user=user_name)
-            except:
-                trail_object = None
-
-            if trail_object:
-                trail_object.date_completed = datetime.now()
-                trail_object.save()
-            elif 'Modification' in origional_text:
-                pass
-            else:
-                trail_object = ATPAuditTrail(award=self.id, modification=origional_text, workflow_step=WAIT_FOR[workflow_old],
-                                             date_created=datetime.now(), assigned_user=user_name)
-                trail_object.save()
+            recorder.record(origional_text, self.WAIT_FOR[workflow_old], user_name,
+                            create_if_missing='Modification' not in origional_text)
+        recorder.flush()
 
     def record_current_state_to_atptrail(self, modification, workflow):
-        user_name = self.get_user_full_name(workflow)
-        try:
-            trail_object = ATPAuditTrail.objects.get(award=self.id, modification=modification, workflow_step=workflow,
-                                                     assigned_user=user_name)
-        except:
-            trail_object = None
-        if trail_object:
-            trail_object.date_completed = datetime.now()
-        else:
-            trail_object = ATPAuditTrail(award=self.id, modification=modification, workflow_step=workflow,
-                                         date_created=datetime.now(), assigned_user=user_name)
-        trail_object.save()
+        recorder = ATPAuditTrailRecorder(self)
+        recorder.record(modification, workflow, self.get_user_full_name(workflow))
+        recorder.flush()
 
     def get_user_full_name(self, section):
         user = self.get_user_for_section(section)
@@ -1229,352 +2154,52 @@ Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_
             return None
 
     def update_completion_date_in_atp_award(self):
-        origional_text = 'Original Award'
-        acceptance_workflow = 'AwardAcceptance'
-        negotiation_workflow = 'AwardNegotiation'
-        setup_workflow = 'AwardSetup'
-        modification_workflow = 'AwardModification'
-        subaward_workflow = 'Subaward'
-        management_workflow = 'AwardManagement'
-        closeout_workflow = 'AwardCloseout'
-        count_value = AwardAcceptance.objects.filter(award=self).count()
-        modification = "Modification #%s" % (count_value - 1)
-
-        if all([self.status == 2, self.award_dual_modification]):
-            acceptance_object = self.get_current_award_acceptance()
-            acceptance_object.acceptance_completion_date = timezone.localtime(timezone.now())
-            acceptance_object.save()
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, acceptance_workflow)
-                self.record_current_state_to_atptrail(origional_text, negotiation_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, acceptance_workflow)
-                self.record_current_state_to_atptrail(modification, negotiation_workflow)
-            self.record_current_state_to_atptrail(modification, modification_workflow)
-
-        elif all([self.status == 2, self.award_dual_setup, self.award_dual_negotiation]):
-            acceptance_object = self.get_current_award_acceptance()
-            acceptance_object.acceptance_completion_date = timezone.localtime(timezone.now())
-            acceptance_object.save()
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, acceptance_workflow)
-                self.record_current_state_to_atptrail(origional_text, negotiation_workflow)
-                self.record_current_state_to_atptrail(origional_text, setup_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, acceptance_workflow)
-                self.record_current_state_to_atptrail(modification, negotiation_workflow)
-                self.record_current_state_to_atptrail(modification, setup_workflow)
-
-        elif self.status == 2:
-            acceptance_object = self.get_current_award_acceptance()
-            acceptance_object.acceptance_completion_date = timezone.localtime(timezone.now())
-            acceptance_object.save()
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, acceptance_workflow)
-                self.record_current_state_to_atptrail(origional_text, negotiation_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, acceptance_workflow)
-                self.record_current_state_to_atptrail(modification, negotiation_workflow)
-
-        elif self.status == 3:
-            negotiation_user = self.get_user_for_section(negotiation_workflow)
-            if negotiation_user:
-                negotiation_object = self.get_current_award_negotiation()
-                negotiation_object.negotiation_completion_date = timezone.localtime(timezone.now())
-                negotiation_object.save()
-                if count_value < 2:
-                    self.record_current_state_to_atptrail(origional_text, negotiation_workflow)
-                else:
-                    self.record_current_state_to_atptrail(modification, negotiation_workflow)
-            else:
-                acceptance_object = self.get_current_award_acceptance()
-                acceptance_object.acceptance_completion_date = timezone.localtime(timezone.now())
-                acceptance_object.save()
-                if count_value < 2:
-                    self.record_current_state_to_atptrail(origional_text, acceptance_workflow)
-                else:
-                    self.record_current_state_to_atptrail(modification, acceptance_workflow)
-            if all([not self.award_dual_modification, not self.send_to_modification, not self.award_dual_setup]):
-                if count_value < 2:
-                    self.record_current_state_to_atptrail(origional_text, setup_workflow)
-                else:
-                    self.record_current_state_to_atptrail(modification, setup_workflow)
-            elif self.send_to_modification and not self.send_to_setup:
-                self.record_current_state_to_atptrail(modification, modification_workflow)
-
-        elif self.status == 4:
-            if all([not self.award_dual_modification, not self.send_to_modification, not self.award_dual_setup]):
-                setup_object = AwardSetup.objects.get(award=self)
-                if setup_object.setup_completion_date and count_value == 1:
-                    pass
-                else:
-                    setup_object.setup_completion_date = timezone.localtime(timezone.now())
-                    setup_object.save()
-                    if count_value < 2:
-                        self.record_current_state_to_atptrail(origional_text, setup_workflow)
-                    else:
-                        self.record_current_state_to_atptrail(modification, setup_workflow)
-            elif all([not self.send_to_modification, self.award_dual_setup, self.award_dual_negotiation]):
-                pass
-            elif all([self.award_dual_modification, self.common_modification]):
-                pass
-            elif self.award_dual_modification or self.send_to_modification:
-                modification_object = AwardModification.objects.all().filter(award=self, is_edited=True).order_by('-id')
-                if modification_object:
-                    modification_obj = modification_object[0]
-                    modification_obj.modification_completion_date = timezone.localtime(timezone.now())
-                    modification_obj.save()
-                self.record_current_state_to_atptrail(modification, modification_workflow)
-
-            if self.subaward_user:
-                if count_value < 2:
-                    self.record_current_state_to_atptrail(origional_text, subaward_workflow)
-                else:
-                    self.record_current_state_to_atptrail(modification, subaward_workflow)
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, management_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, management_workflow)
+        """Sets the completion date on the section(s) just finished and records them in the audit trail"""
 
-        elif self.status == 5:
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, closeout_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, closeout_workflow)
-
-        elif self.status == 6:
-            closeout = AwardCloseout.objects.get(award=self)
-            closeout.closeout_completion_date = timezone.localtime(timezone.now())
-            closeout.save()
-            if count_value < 2:
-                self.record_current_state_to_atptrail(origional_text, closeout_workflow)
-            else:
-                self.record_current_state_to_atptrail(modification, closeout_workflow)
+        transition = AwardTransition(self)
+        transition.record_completion()
+        transition.flush()
 
     def move_to_next_step(self, section=None):
         """Moves this Award to the next step in the process"""
 
-        # A while loop because we want to advance the status until we find the next
-        # section with an assigned user
-        while True:
-            # We have to do extra work to make sure both Subawards and Award Management
-            # are complete before we move to the next status
-            if section in ['Subaward', 'AwardManagement']:
-                origional_text = 'Original Award'
-                subaward_workflow = 'Subaward'
-                management_workflow = 'AwardManagement'
-                count_value = AwardAcceptance.objects.filter(award=self).count()
-                modification = "Modification #%s" % (count_value - 1)
-                if section == 'Subaward' or self.get_user_for_section(
-                        'Subaward') is None:
-                    self.subaward_done = True
-                    if self.subaward_user:
-                        if count_value < 2:
-                            self.record_current_state_to_atptrail(origional_text, subaward_workflow)
-                        else:
-                            self.record_current_state_to_atptrail(modification, subaward_workflow)
-                        try:
-                            correct_instance = Subaward.objects.filter(award=self).latest('creation_date')
-                            if correct_instance:
-                                correct_instance.subaward_completion_date = timezone.localtime(timezone.now())
-                                correct_instance.save()
-                        except:
-                            pass
-                if section == 'AwardManagement' or self.get_user_for_section(
-                        'AwardManagement') is None:
-                    self.award_management_done = True
-                    if count_value < 2:
-                        self.record_current_state_to_atptrail(origional_text, management_workflow)
-                    else:
-                        self.record_current_state_to_atptrail(modification, management_workflow)
-                    management_object = AwardManagement.objects.get(award=self)
-                    management_object.management_completion_date = timezone.localtime(timezone.now())
-                    management_object.save()
-
-                if not (self.subaward_done and self.award_management_done):
-                    self.save()
-                    return False
-
-            if self.status == 2 and self.award_dual_negotiation:
-                self.award_dual_negotiation = False
-                self.save()
-
-            if self.status == 3 and self.award_dual_setup:
-                self.award_dual_setup = False
-                self.save()
-
-            if self.status == 4 and self.award_dual_modification:
-                self.award_dual_modification = False
-                self.save()
-
-            if self.status == 2 and self.send_to_modification:
-                modification_object = AwardModification.objects.all().filter(award=self, is_edited=False).order_by('-id')
-                if modification_object:
-                    section_object = modification_object[0]
-                    section_object.date_assigned = timezone.localtime(timezone.now())
-                    section_object.save()
-
-            self.status += 1
-
-            if self.status == self.END_STATUS:
-                self.save()
-                break
-            elif not all(user is None for user in self.get_users_for_active_sections()):
-                self.set_date_assigned_for_active_sections()
-                self.save()
-                break
-
-        if self.status not in (self.START_STATUS, self.END_STATUS) and not self.award_dual_setup:
-            self.send_email_update()
-
-        # Send an additional notification when we reach Award Setup
-        if self.status == 3:
-            self.awardsetup.copy_from_proposal(self.get_most_recent_proposal())
-
-            self.send_award_setup_notification()
-        if all([self.status == 3, self.subaward_user, not self.send_to_modification, not self.award_dual_setup]):
-            self.send_email_update_if_subaward_user()
-        self.update_completion_date_in_atp_award()
-        return True
+        return AwardTransition(self).move_to_next_step(section)
 
     def move_award_to_multiple_steps(self, dual_mode):
         """ Move award to multiple steps so that multiple teams can work parallel """
-        if self.award_negotiation_user:
-            self.status += 1
-        else:
-            if self.status == 1:
-                self.status += 2
-            try:
-                setup_obj = AwardSetup.objects.get(award=self)
-            except AwardSetup.DoesNotExist:
-                setup_obj = None
-            if setup_obj:
-                setup_obj.date_assigned = timezone.localtime(timezone.now())
-                setup_obj.save()
-
-        if dual_mode:
-            try:
-                setup_object = AwardSetup.objects.get(award=self)
-            except AwardSetup.DoesNotExist:
-                setup_object = None
-            try:
-                negotiation_object = AwardNegotiation.objects.get(award=self, current_modification=True)
-            except AwardNegotiation.DoesNotExist:
-                negotiation_object = None
-
-            if negotiation_object:
-                negotiation_object.date_assigned = timezone.localtime(timezone.now())
-                negotiation_object.save()
 
-            if setup_object:
-                setup_object.date_assigned = timezone.localtime(timezone.now())
-                setup_object.save()
-
-            self.award_dual_negotiation = True
-            self.award_dual_setup = True
-
-        self.save()
-        if self.status not in (self.START_STATUS, self.END_STATUS):
-            self.send_email_update()
-        if all([self.status == 2, self.subaward_user, self.award_dual_setup]):
-            self.send_email_update_if_subaward_user()
-        self.update_completion_date_in_atp_award()
-        return True
+        return AwardTransition(self).move_to_multiple_steps(dual_mode)
 
     def move_award_to_negotiation_and_modification(self, dual_modification):
         """ Move award to award negotiation and modification steps so that these two teams can work parallel """
-        if self.award_negotiation_user:
-            self.status += 1
-            try:
-                negotiation_object = AwardNegotiation.objects.get(award=self, current_modification=True)
-            except AwardNegotiation.DoesNotExists:
-                negotiation_object = None
-            if negotiation_object:
-                if not negotiation_object.date_assigned:
-                    negotiation_object.date_assigned = timezone.localtime(timezone.now())
-                    negotiation_object.save()
-        else:
-            if self.status == 1:
-                self.status += 2
-            try:
-                setup_obj = AwardSetup.objects.get(award=self)
-            except AwardSetup.DoesNotExist:
-                setup_obj = None
-            if setup_obj:
-                setup_obj.date_assigned = timezone.localtime(timezone.now())
-                setup_obj.save()
-
-        modification_object = AwardModification.objects.all().filter(award=self).order_by('-id')
-        if modification_object:
-            section_object = modification_object[0]
-            section_object.date_assigned = timezone.localtime(timezone.now())
-            section_object.save()
 
-        if dual_modification:
-            self.common_modification = True
-            self.award_dual_modification = True
-        self.save()
-        if self.status not in (self.START_STATUS, self.END_STATUS):
-            self.send_email_update()
-        self.update_completion_date_in_atp_award()
-        return True
+        return AwardTransition(self).move_to_negotiation_and_modification(dual_modification)
 
     def move_setup_or_modification_step(self, modification_flag=False, setup_flag=False):
-        if self.award_negotiation_user:
-            self.status += 1
-            try:
-                negotiation_object = AwardNegotiation.objects.get(award=self, current_modification=True)
-            except AwardNegotiation.DoesNotExists:
-                negotiation_object = None
-            if negotiation_object:
-                if not negotiation_object.date_assigned:
-                    negotiation_object.date_assigned = timezone.localtime(timezone.now())
-                    negotiation_object.save()
-        else:
-            if self.status == 1:
-                self.status += 2
-            try:
-                setup_obj = AwardSetup.objects.get(award=self)
-            except AwardSetup.DoesNotExist:
-                setup_obj = None
-            if setup_obj:
-                setup_obj.date_assigned = timezone.localtime(timezone.now())
-                setup_obj.save()
+        return AwardTransition(self).move_to_setup_or_modification(modification_flag, setup_flag)
 
-        if modification_flag:
-            self.send_to_modification = True
+    # Django admin helper methods
 
-        self.save()
+    # Sections the AwardAdmin changelist links to, by their related query name
+    ADMIN_FOREIGNKEY_SECTIONS = ('awardacceptance', 'awardnegotiation', 'subaward')
+    ADMIN_ONETOONE_SECTIONS = ('proposalintake', 'awardsetup', 'awardmanagement', 'awardcloseout')
 
-        if setup_flag:
-            self.send_email_update()
-        if self.status == self.AWARD_SETUP_STATUS and modification_flag:
-            self.send_email_update()
+    @classmethod
+    def with_admin_links(cls, queryset):
+        """Annotates a queryset with the section counts and ids the *_admin methods below need,
+        and prefetches the first proposals, so an admin changelist makes no queries per row.
+        """
 
-        # Send an additional notification when we reach Award Setup
-        if self.status == 3:
-            self.awardsetup.copy_from_proposal(self.get_most_recent_proposal())
+        annotations = {}
+        for name in cls.ADMIN_FOREIGNKEY_SECTIONS:
+            annotations['_admin_%s_count' % name] = Count(name, distinct=True)
+        for name in cls.ADMIN_FOREIGNKEY_SECTIONS + cls.ADMIN_ONETOONE_SECTIONS:
+            annotations['_admin_%s_id' % name] = Min('%s__id' % name)
 
-        if modification_flag:
-            try:
-                modification = AwardModification.objects.get(award_id=self.id, is_edited=False)
-            except AwardModification.DoesNotExist:
-                modification = None
+        return queryset.annotate(**annotations).prefetch_related(
+            Prefetch('proposal_set', to_attr='_admin_first_proposals',
+                     queryset=Proposal.objects.filter(is_first_proposal=True, dummy=False)))
 
-            if modification:
-                modification.is_edited = True,
-                modification.save()
-            award_setup_object = AwardSetup.objects.filter(award=self).values()
-            for setup in award_setup_object:
-                del(setup['id'], setup['is_edited'], setup['setup_completion_date'], setup['wait_for_reson'])
-                award_modification_object = AwardModification.objects.create(**setup)
-            self.send_to_modification = True
-            award_modification_object.save()
-            self.save()
-        self.update_completion_date_in_atp_award()
-        return True
-
-    # Django admin helper methods
     def get_section_admin_link(self, section):
         """Gets the link to the Django Admin site for the given section"""
 
@@ -1592,11 +2217,20 @@ Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_
         """Gets the link to the Django Admin site for the given section that has a 
         foreign key to this Award
         """
-        section_objects = section_class.objects.filter(award=self)
-        if len(section_objects) == 0:
+        name = section_class.__name__.lower()
+        if hasattr(self, '_admin_%s_count' % name):
+            # Loaded by with_admin_links. The link text only needs the section's id.
+            section_count = getattr(self, '_admin_%s_count' % name)
+            section = section_class(id=getattr(self, '_admin_%s_id' % name))
+        else:
+            section_objects = section_class.objects.filter(award=self)
+            section_count = len(section_objects)
+            section = section_objects[0] if section_count else None
+
+        if section_count == 0:
             return '(None)'
-        elif len(section_objects) == 1:
-            return self.get_section_admin_link(section_objects[0])
+        elif section_count == 1:
+            return self.get_section_admin_link(section)
         else:
             return format_html(
                 '<a href="{0}?award__id__exact={1}">{2}s</a>',
@@ -1606,11 +2240,24 @@ Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_
                 self.id,
                 section_class._meta.verbose_name.capitalize())
 
+    def get_onetoone_admin_link(self, section_class):
+        """Gets the link to the Django Admin site for the given section that has a
+        one-to-one relationship with this Award
+        """
+        name = section_class.__name__.lower()
+        if not hasattr(self, '_admin_%s_id' % name):
+            return self.get_section_admin_link(getattr(self, name))
+
+        section_id = getattr(self, '_admin_%s_id' % name)
+        if section_id is None:
+            return '(None)'
+        return self.get_section_admin_link(section_class(id=section_id))
+
     # The following methods are referenced in the list_display section of the AwardAdmin class.
     # They return the Django Admin links to their respective sections
 
     def proposalintake_admin(self):
-        return self.get_section_admin_link(self.proposalintake)
+        return self.get_onetoone_admin_link(ProposalIntake)
 
     def proposal_admin(self):
         return format_html('<a href="{0}?award__id__exact={1}">{2}</a>',
@@ -1625,21 +2272,419 @@ Please go to %s%s to review it.' % (self, settings.EMAIL_URL_HOSTNAME, self.get_
         return self.get_foreignkey_admin_link(AwardNegotiation)
 
     def awardsetup_admin(self):
-        return self.get_section_admin_link(self.awardsetup)
+        return self.get_onetoone_admin_link(AwardSetup)
 
     def subaward_admin(self):
         return self.get_foreignkey_admin_link(Subaward)
 
     def awardmanagement_admin(self):
-        return self.get_section_admin_link(self.awardmanagement)
+        return self.get_onetoone_admin_link(AwardManagement)
 
     def awardcloseout_admin(self):
-        return self.get_section_admin_link(self.awardcloseout)
+        return self.get_onetoone_admin_link(AwardCloseout)
+
+
+class AwardTransition(object):
+    """Moves an Award through one workflow transition.
 
+    Each section row is loaded at most once, field changes are collected as the transition
+    runs, and flush() writes them in one transaction, with one UPDATE per changed row
+    covering only the columns that changed. Emails go out after the flush.
+    """
+
+    # The field holding each section's completion date
+    COMPLETION_DATE_FIELDS = {
+        'AwardAcceptance': 'acceptance_completion_date',
+        'AwardNegotiation': 'negotiation_completion_date',
+        'AwardSetup': 'setup_completion_date',
+        'AwardModification': 'modification_completion_date',
+        'Subaward': 'subaward_completion_date',
+        'AwardManagement': 'management_completion_date',
+        'AwardCloseout': 'closeout_completion_date',
+    }
 
-class AwardSection(FieldIteratorMixin, models.Model):
+    # Sections with a date_assigned field
+    ASSIGNABLE_SECTIONS = ['AwardNegotiation', 'AwardSetup', 'AwardModification', 'AwardManagement', 'AwardCloseout']
+
+    # Flags that put an award in a parallel step, and the status in which they're cleared
+    # when the award moves on
+    PARALLEL_FLAGS = [
+        (2, 'award_dual_negotiation'),
+        (3, 'award_dual_setup'),
+        (4, 'award_dual_modification'),
+    ]
+
+    # What to complete and record in the audit trail once an award reaches a status.
+    # Each status has a list of rule chains; in each chain the first rule whose conditions
+    # match the award is applied. Conditions map award attributes to whether they must be
+    # truthy. Actions are:
+    #   complete - sets the section's completion date
+    #   complete_once - same, but an original award's existing completion date is kept
+    #                   (and nothing is recorded)
+    #   record - records the section in the audit trail
+    #   record_modification - same, always labelled with the modification number
+    COMPLETION_RULES = {
+        2: [
+            [({'award_dual_modification': True},
+              [('complete', 'AwardAcceptance'), ('record', 'AwardAcceptance'), ('record', 'AwardNegotiation'),
+               ('record_modification', 'AwardModification')]),
+             ({'award_dual_setup': True, 'award_dual_negotiation': True},
+              [('complete', 'AwardAcceptance'), ('record', 'AwardAcceptance'), ('record', 'AwardNegotiation'),
+               ('record', 'AwardSetup')]),
+             ({},
+              [('complete', 'AwardAcceptance'), ('record', 'AwardAcceptance'), ('record', 'AwardNegotiation')])],
+        ],
+        3: [
+            [({'award_negotiation_user_id': True},
+              [('complete', 'AwardNegotiation'), ('record', 'AwardNegotiation')]),
+             ({},
+              [('complete', 'AwardAcceptance'), ('record', 'AwardAcceptance')])],
+            [({'award_dual_modification': False, 'send_to_modification': False, 'award_dual_setup': False},
+              [('record', 'AwardSetup')]),
+             ({'send_to_modification': True, 'send_to_setup': False},
+              [('record_modification', 'AwardModification')])],
+        ],
+        4: [
+            [({'award_dual_modification': False, 'send_to_modification': False, 'award_dual_setup': False},
+              [('complete_once', 'AwardSetup')]),
+             ({'send_to_modification': False, 'award_dual_setup': True, 'award_dual_negotiation': True},
+              []),
+             ({'award_dual_modification': True, 'common_modification': True},
+              []),
+             ({'award_dual_modification': True},
+              [('complete', 'AwardModification'), ('record_modification', 'AwardModification')]),
+             ({'send_to_modification': True},
+              [('complete', 'AwardModification'), ('record_modification', 'AwardModification')])],
+            [({'subaward_user_id': True},
+              [('record', 'Subaward')])],
+            [({},
+              [('record', 'AwardManagement')])],
+        ],
+        5: [
+            [({}, [('record', 'AwardCloseout')])],
+        ],
+        6: [
+            [({}, [('complete', 'AwardCloseout'), ('record', 'AwardCloseout')])],
+        ],
+    }
+
+    def __init__(self, award):
+        self.award = award
+        self.now = timezone.localtime(timezone.now())
+        self._rows = {}
+        self._modifications = None
+        self._changes = []
+        self._new_rows = []
+        self._trail = []
+        self._notifications = []
+
+    # Loading
+
+    def get_modifications(self):
+        """Gets all of the award's AwardModifications, newest first"""
+
+        if self._modifications is None:
+            self._modifications = list(AwardModification.objects.filter(award=self.award).order_by('-id'))
+        return self._modifications
+
+    def get_latest_modification(self, is_edited=None):
+        """Gets the newest AwardModification, optionally only an edited or unedited one"""
+
+        for modification in self.get_modifications():
+            if is_edited is None or modification.is_edited == is_edited:
+                return modification
+        return None
+
+    def get_row(self, section):
+        """Gets the award's current row for the given section, or None if it doesn't have one"""
+
+        if section == 'AwardModification':
+            return self.get_latest_modification(is_edited=True)
+
+        if section not in self._rows:
+            if section == 'AwardAcceptance':
+                row = self.award.get_current_award_acceptance()
+            elif section == 'AwardNegotiation':
+                row = AwardNegotiation.objects.filter(award=self.award, current_modification=True).first()
+            elif section == 'Subaward':
+                row = Subaward.objects.filter(award=self.award).order_by('-creation_date').first()
+            else:
+                try:
+                    row = getattr(self.award, section.lower())
+                except ObjectDoesNotExist:
+                    row = None
+            self._rows[section] = row
+        return self._rows[section]
+
+    # Changes
+
+    def set(self, instance, **values):
+        """Sets field values on the award or one of its rows, to be saved by flush()"""
+
+        for field, value in values.items():
+            setattr(instance, field, value)
+
+        for changed_instance, fields in self._changes:
+            if changed_instance is instance:
+                fields.update(values.keys())
+                return
+        self._changes.append((instance, set(values.keys())))
+
+    def complete(self, section):
+        """Sets the section's completion date"""
+
+        row = self.get_row(section)
+        if row:
+            self.set(row, **{self.COMPLETION_DATE_FIELDS[section]: self.now})
+
+    def record(self, section, modification_only=False):
+        """Records the section in the audit trail when the transition is flushed"""
+
+        self._trail.append((self.award.get_modification_label(modification_only), section))
+
+    def notify(self, method_name):
+        """Calls the given Award email method once the transition is flushed"""
+
+        self._notifications.append(method_name)
+
+    def flush(self):
+        """Writes every change in one transaction, then sends any emails"""
+
+        with transaction.atomic():
+            for instance, fields in self._changes:
+                if instance.pk:
+                    instance.save(update_fields=sorted(fields))
+            for instance in self._new_rows:
+                instance.save()
+            recorder = ATPAuditTrailRecorder(self.award)
+            for label, section in self._trail:
+                recorder.record(label, section, self.award.get_user_full_name(section))
+            recorder.flush()
+
+        # The saves above marked the feeds changed before the transaction committed, so a feed
+        # request in between got the new stamp with the old data. Mark them changed again now.
+        feed_changes.touch()
+
+        self._changes = []
+        self._new_rows = []
+        self._trail = []
+
+        notifications, self._notifications = self._notifications, []
+        for method_name in notifications:
+            getattr(self.award, method_name)()
+
+    # Steps
+
+    def matches(self, conditions):
+        return all(bool(getattr(self.award, attribute)) == value for attribute, value in conditions.items())
+
+    def record_completion(self):
+        """Applies the COMPLETION_RULES for the award's current status"""
+
+        for rule_chain in self.COMPLETION_RULES.get(self.award.status, []):
+            for conditions, actions in rule_chain:
+                if self.matches(conditions):
+                    for action, section in actions:
+                        if action == 'complete':
+                            self.complete(section)
+                        elif action == 'complete_once':
+                            row = self.get_row(section)
+                            field = self.COMPLETION_DATE_FIELDS[section]
+                            if row and not (getattr(row, field) and self.award.modification_count == 0):
+                                self.set(row, **{field: self.now})
+                                self.record(section)
+                        elif action == 'record':
+                            self.record(section)
+                        elif action == 'record_modification':
+                            self.record(section, modification_only=True)
+                    break
+
+    def assign_active_sections(self):
+        """Sets the date_assigned on the currently active section(s)"""
+
+        for section in self.award.get_active_sections():
+            if section not in self.ASSIGNABLE_SECTIONS:
+                continue
+
+            if section == 'AwardModification':
+                rows = self.get_modifications()
+            else:
+                rows = [row for row in [self.get_row(section)] if row]
+
+            for row in rows:
+                self.set(row, date_assigned=datetime.now())
+
+    def assign(self, section, only_if_unassigned=False):
+        """Sets the date_assigned on the given section"""
+
+        row = self.get_row(section)
+        if row and not (only_if_unassigned and row.date_assigned):
+            self.set(row, date_assigned=self.now)
+
+    def advance_past_intake(self, assign_negotiation):
+        """Moves the award on to Award Negotiation, or straight to Award Setup if
+        there's no negotiation user
+        """
+
+        award = self.award
+        if award.award_negotiation_user_id:
+            self.set(award, status=award.status + 1)
+            if assign_negotiation:
+                self.assign('AwardNegotiation', only_if_unassigned=True)
+        else:
+            if award.status == 1:
+                self.set(award, status=award.status + 2)
+            self.assign('AwardSetup')
+
+    def copy_proposal_to_setup(self):
+        """Copies the most recent Proposal's dates to the AwardSetup"""
+
+        setup = self.get_row('AwardSetup')
+        proposal = self.award.get_most_recent_proposal()
+        if setup and proposal:
+            self.set(setup, start_date=proposal.project_start_date, end_date=proposal.project_end_date)
+
+    def finish(self):
+        self.record_completion()
+        self.flush()
+        return True
+
+    # Transitions
+
+    def move_to_next_step(self, section=None):
+        """Moves the award to the next status that has a user assigned"""
+
+        award = self.award
+
+        # A while loop because we want to advance the status until we find the next
+        # section with an assigned user
+        while True:
+            # We have to do extra work to make sure both Subawards and Award Management
+            # are complete before we move to the next status
+            if section in ['Subaward', 'AwardManagement']:
+                if section == 'Subaward' or award.get_user_for_section('Subaward') is None:
+                    self.set(award, subaward_done=True)
+                    if award.subaward_user_id:
+                        self.record('Subaward')
+                        self.complete('Subaward')
+                if section == 'AwardManagement' or award.get_user_for_section('AwardManagement') is None:
+                    self.set(award, award_management_done=True)
+                    self.record('AwardManagement')
+                    self.complete('AwardManagement')
+
+                if not (award.subaward_done and award.award_management_done):
+                    self.flush()
+                    return False
+
+            for status, flag in self.PARALLEL_FLAGS:
+                if award.status == status and getattr(award, flag):
+                    self.set(award, **{flag: False})
+
+            if award.status == 2 and award.send_to_modification:
+                modification = self.get_latest_modification(is_edited=False)
+                if modification:
+                    self.set(modification, date_assigned=self.now)
+
+            self.set(award, status=award.status + 1)
+
+            if award.status == award.END_STATUS:
+                break
+            elif not all(user is None for user in award.get_users_for_active_sections()):
+                self.assign_active_sections()
+                break
+
+        if award.status not in (award.START_STATUS, award.END_STATUS) and not award.award_dual_setup:
+            self.notify('send_email_update')
+
+        # Send an additional notification when we reach Award Setup
+        if award.status == 3:
+            self.copy_proposal_to_setup()
+            self.notify('send_award_setup_notification')
+        if all([award.status == 3, award.subaward_user_id, not award.send_to_modification, not award.award_dual_setup]):
+            self.notify('send_email_update_if_subaward_user')
+
+        return self.finish()
+
+    def move_to_multiple_steps(self, dual_mode):
+        """Moves the award on, into Award Negotiation and Award Setup at the same time if dual_mode is set"""
+
+        award = self.award
+        self.advance_past_intake(assign_negotiation=False)
+
+        if dual_mode:
+            self.assign('AwardNegotiation')
+            self.assign('AwardSetup')
+            self.set(award, award_dual_negotiation=True, award_dual_setup=True)
+
+        if award.status not in (award.START_STATUS, award.END_STATUS):
+            self.notify('send_email_update')
+        if all([award.status == 2, award.subaward_user_id, award.award_dual_setup]):
+            self.notify('send_email_update_if_subaward_user')
+
+        return self.finish()
+
+    def move_to_negotiation_and_modification(self, dual_modification):
+        """Moves the award on, into Award Negotiation and Award Modification at the same time if
+        dual_modification is set
+        """
+
+        award = self.award
+        self.advance_past_intake(assign_negotiation=True)
+
+        modification = self.get_latest_modification()
+        if modification:
+            self.set(modification, date_assigned=self.now)
+
+        if dual_modification:
+            self.set(award, common_modification=True, award_dual_modification=True)
+
+        if award.status not in (award.START_STATUS, award.END_STATUS):
+            self.notify('send_email_update')
+
+        return self.finish()
+
+    def move_to_setup_or_modification(self, modification_flag=False, setup_flag=False):
+        """Moves the award on to Award Setup, or to Award Modification if modification_flag is set"""
+
+        award = self.award
+        self.advance_past_intake(assign_negotiation=True)
+
+        if modification_flag:
+            self.set(award, send_to_modification=True)
+
+        if setup_flag:
+            self.notify('send_email_update')
+        if award.status == award.AWARD_SETUP_STATUS and modification_flag:
+            self.notify('send_email_update')
+
+        if award.status == 3:
+            self.copy_proposal_to_setup()
+
+        if modification_flag:
+            modification = self.get_latest_modification(is_edited=False)
+            if modification:
+                self.set(modification, is_edited=True)
+
+            # Start the new modification from the current AwardSetup values
+            setup = self.get_row('AwardSetup')
+            if setup:
+                excluded_fields = ['id', 'is_edited', 'setup_completion_date', 'wait_for_reson']
+                new_modification = AwardModification(**dict(
+                    (field.attname, getattr(setup, field.attname)) for field in AwardSetup._meta.concrete_fields
+                    if field.attname not in excluded_fields))
+                self._new_rows.append(new_modification)
+                self.get_modifications().insert(0, new_modification)
+
+        return self.finish()
+
+
+class SectionVersionConflict(Exception):
+    """Raised when a section is saved against a version that someone else has since replaced"""
+
+
+class AwardSection(DirtyFieldsMixin, FieldIteratorMixin, models.Model):
     """Abstract base class for all award sections"""
-    HIDDEN_FIELDS = ['award', 'comments', 'is_edited']
+    HIDDEN_FIELDS = ['award', 'comments', 'is_edited', 'version']
 
     HIDDEN_SEARCH_FIELDS = []
 
@@ -1647,10 +2692,60 @@ class AwardSection(FieldIteratorMixin, models.Model):
 
     comments = models.TextField(blank=True, verbose_name='Comments')
     is_edited = models.BooleanField(default=False)
+    # Bumped on every save; cached renderings of the section are keyed on it
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    # Set to the version an edit started from, to only save over that version
+    expected_version = None
 
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        """Saves the section and bumps its version, so renderings cached for the old version stop
+        being used. If expected_version is set, the row is only updated while it still has that
+        version, and SectionVersionConflict is raised instead of saving over someone else's changes.
+        """
+
+        try:
+            if self.expected_version is None:
+                super(AwardSection, self).save(*args, **kwargs)
+            else:
+                # A conflict only rolls back to here, not any transaction the save is part of
+                with transaction.atomic():
+                    super(AwardSection, self).save(*args, **kwargs)
+        finally:
+            self.expected_version = None
+        # _do_update sets the new version, which update_fields may not have listed
+        self.snapshot_fields(['version'])
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """Bumps the version in the UPDATE itself, so two saves of the same loaded row can't
+        both write the same new version. With expected_version set, it's also added to the
+        WHERE clause, making the save a compare-and-swap that needs no row lock.
+        """
+
+        version_field = self._meta.get_field('version')
+        values = [value for value in values if value[0] is not version_field]
+        values.append((version_field, None, F('version') + 1))
+
+        if self.expected_version is not None:
+            base_qs = base_qs.filter(version=self.expected_version)
+
+        if not super(AwardSection, self)._do_update(
+                base_qs, using, pk_val, values, update_fields, forced_update):
+            if self.expected_version is not None:
+                raise SectionVersionConflict()
+            return False
+
+        if self.expected_version is not None:
+            self.version = self.expected_version + 1
+        else:
+            # The UPDATE holds the row lock until the save's transaction ends, so this reads
+            # our own bump
+            self.version = base_qs.filter(pk=pk_val).values_list('version', flat=True).get()
+        return True
+
     def get_class_name(self):
         """Gets the Python class name"""
 
@@ -1660,16 +2755,7 @@ class AwardSection(FieldIteratorMixin, models.Model):
         return self._meta.verbose_name
 
     def get_most_recent_revision(self):
-        latest_revision = reversion.get_for_object(self)
-        if latest_revision:
-            latest_revision = latest_revision[0].revision
-            user = latest_revision.user.get_full_name()
-        else:
-            user = 'ATP'
-        if latest_revision:
-            return (user, latest_revision.date_created)
-        else:
-            return (user, None)
+        return get_latest_revision(self)
 
 
 class AssignableAwardSection(AwardSection):
@@ -1687,8 +2773,6 @@ class AssignableAwardSection(AwardSection):
 
 class ProposalIntake(AwardSection):
     """Model for the ProposalIntake data"""
-    user_list = User.objects.filter(is_active=True).order_by('first_name')
-    users = [(user.first_name + ' ' + user.last_name, user.first_name + ' ' + user.last_name) for user in user_list]
     PROPOSAL_STATUS_CHOICES = (
         ('NS', 'Cancelled - not submitted'),
         ('PE', 'Planned'),
@@ -1700,10 +2784,6 @@ class ProposalIntake(AwardSection):
         ('AW', 'Awarded'),
         ('UN', 'Unfunded'),
     )
-    SPA1_CHOICES = (
-        ('', ''),
-    )
-    SPA1_CHOICES = tuple(users) if users else SPA1_CHOICES
     HIDDEN_SEARCH_FIELDS = AwardSection.HIDDEN_SEARCH_FIELDS + [
         'principal_investigator',
         'agency',
@@ -1759,7 +2839,8 @@ class ProposalIntake(AwardSection):
         null=True,
         blank=True,
         verbose_name='Proposal due to AOR')
-    spa1 = models.CharField(blank=False, verbose_name='SPA I*', max_length=150, choices=SPA1_CHOICES, null=True)
+    # The choices (Proposal Intake users) are provided by the forms; see proposal_intake_user_choices
+    spa1 = models.CharField(blank=False, verbose_name='SPA I*', max_length=150, null=True)
     school = models.CharField(max_length=150, blank=True)
     department = models.ForeignKey(
         AwardOrganization,
@@ -2382,44 +3463,127 @@ class Proposal(AwardSection):
             super(Proposal, self).delete(*args, **kwargs)
 
 
-def set_first_proposal(award, proposals):
-    """Set the is_first_proposal flag on the appropriate proposal"""
-    proposals.update(is_first_proposal=False)
-    first_proposal = proposals.order_by('id').first()
+class FirstProposalMaintainer(object):
+    """Keeps exactly one Proposal on each Award flagged as the first proposal, and gives Awards
+    without any Proposals a dummy one (which is removed again once a real one is added).
+
+    Saving a Proposal only triggers a check when it could change that: when the Proposal is
+    new, moved to another Award or became (or stopped being) a dummy. A check is one aggregate
+    query, and only writes when something actually needs fixing.
+    """
 
-    first_proposal.is_first_proposal = True
-    first_proposal.save()
+    # Number of awards checked per aggregate query
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextmanager
+    def suspended(self):
+        """Skips the checks while the block runs, then fixes every Award whose Proposals
+        changed in one pass at the end. Use it around bulk imports.
+        """
+
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+
+        self._local.pending = set()
+        try:
+            yield
+            award_ids = self._local.pending
+        finally:
+            self._local.pending = None
+
+        self.fix_awards(award_ids)
+
+    def awards_changed(self, *award_ids):
+        """Checks the given Awards now, or at the end of the suspended() block"""
+
+        award_ids = set(award_id for award_id in award_ids if award_id)
+        if not award_ids or getattr(self._local, 'fixing', False):
+            return
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.update(award_ids)
+        else:
+            self.fix_awards(award_ids)
+
+    def fix_awards(self, award_ids):
+        """Fixes the dummy and first Proposals of the given Awards"""
+
+        award_ids = list(award_ids)
+        for i in range(0, len(award_ids), self.CHUNK_SIZE):
+            self._fix_chunk(award_ids[i:i + self.CHUNK_SIZE])
+
+    def _fix_chunk(self, award_ids):
+        def count_where(**conditions):
+            return Sum(Case(When(then=Value(1), **conditions), default=Value(0), output_field=IntegerField()))
+
+        stats = Proposal.objects.filter(award_id__in=award_ids).values('award_id').annotate(
+            proposal_count=Count('id'),
+            first_count=count_where(is_first_proposal=True),
+            dummy_first_count=count_where(is_first_proposal=True, dummy=True),
+            dummy_id=Min(Case(When(dummy=True, then='id'))),
+            min_id=Min('id'),
+            min_real_id=Min(Case(When(dummy=False, then='id'))),
+        ).order_by()
+
+        missing_award_ids = set(award_ids)
+        dummy_ids = []
+        reset_award_ids = []
+        first_ids = []
+        for row in stats:
+            missing_award_ids.discard(row['award_id'])
+            first_count, first_id = row['first_count'], row['min_id']
+
+            if row['proposal_count'] > 1 and row['dummy_id']:
+                dummy_ids.append(row['dummy_id'])
+                first_count -= row['dummy_first_count']
+                first_id = row['min_real_id']
+
+            if first_count != 1:
+                reset_award_ids.append(row['award_id'])
+                first_ids.append(first_id)
+
+        self._local.fixing = True
+        try:
+            if dummy_ids:
+                Proposal.objects.filter(id__in=dummy_ids).delete()
+
+            if reset_award_ids:
+                Proposal.objects.filter(award_id__in=reset_award_ids).update(is_first_proposal=Case(
+                    When(id__in=first_ids, then=Value(True)), default=Value(False), output_field=BooleanField()))
+
+            if missing_award_ids:
+                Proposal.objects.bulk_create([
+                    Proposal(award_id=award_id, dummy=True, is_first_proposal=True)
+                    for award_id in missing_award_ids])
+        finally:
+            self._local.fixing = False
+
+        # Neither update() nor bulk_create() send post_save
+        if reset_award_ids or missing_award_ids:
+            feed_changes.touch()
+
+first_proposal_maintainer = FirstProposalMaintainer()
 
 
-@receiver(post_delete, sender=Proposal)
 @receiver(post_save, sender=Proposal)
-def check_first_proposal(sender, instance, **kwargs):
+def check_first_proposal(sender, instance, created, **kwargs):
     """Use Django signals to keep the is_first_proposal flag up to date"""
-    try:
-        award = instance.award
-    except Award.DoesNotExist:
-        award = None
 
-    if not award:
-        return
+    # Runs before DirtyFieldsMixin.save takes the new snapshot
+    dirty_fields = instance.get_dirty_fields()
+    if created or 'award_id' in dirty_fields or 'dummy' in dirty_fields:
+        first_proposal_maintainer.awards_changed(instance.award_id, dirty_fields.get('award_id'))
 
-    proposals = Proposal.objects.filter(award=award)
-    try:
-        dummy_proposal = Proposal.objects.get(award=award, dummy=True)
-    except Proposal.DoesNotExist:
-        dummy_proposal = None
 
-    if len(proposals) == 0:
-        Proposal.objects.create(award=award, dummy=True)
-        return
-    elif len(proposals) > 1 and dummy_proposal:
-        dummy_proposal.delete()
-
-    first_proposals = Proposal.objects.filter(
-        award=award,
-        is_first_proposal=True)
-    if len(first_proposals) != 1:
-        set_first_proposal(award, proposals)
+@receiver(post_delete, sender=Proposal)
+def check_first_proposal_on_delete(sender, instance, **kwargs):
+    """Use Django signals to keep the is_first_proposal flag up to date"""
+    first_proposal_maintainer.awards_changed(instance.award_id)
 
 
 class KeyPersonnel(FieldIteratorMixin, models.Model):
@@ -2569,6 +3733,8 @@ class AwardModificationMixin(object):
 class AwardAcceptance(AwardModificationMixin, AwardSection):
     """Model for the AwardAcceptance data"""
 
+    SAVE_DIRTY_FIELDS_ONLY = True
+
     EAS_STATUS_CHOICES = (
         ('A', 'Active'),
         ('OH', 'On hold'),
@@ -2974,19 +4140,18 @@ class AwardAcceptance(AwardModificationMixin, AwardSection):
         emails need to be sent.
         """
 
-        try:
-            old_object = AwardAcceptance.objects.get(pk=self.pk)
-        except AwardAcceptance.DoesNotExist:
+        old_values = self.get_saved_values() if self.pk else None
+        if old_values is None:
             super(AwardAcceptance, self).save(*args, **kwargs)
             return
 
         super(AwardAcceptance, self).save(*args, **kwargs)
 
         # Send email to Award Setup user when FCOI cleared date is populated
-        if not old_object.fcoi_cleared_date and self.fcoi_cleared_date:
+        if not old_values['fcoi_cleared_date'] and self.fcoi_cleared_date:
             self.award.send_fcoi_cleared_notification(self.fcoi_cleared_date)
 
-        if not old_object.phs_funded and self.phs_funded:
+        if not old_values['phs_funded'] and self.phs_funded:
             self.award.send_phs_funded_notification()
 
 
@@ -4063,37 +5228,28 @@ class PTANumber(FieldIteratorMixin, models.Model):
         super(PTANumber, self).save(*args, **kwargs)
 
         if self == self.award.get_first_pta_number():
+            # Each object is saved at most once, with only the fields that differ
             proposal = self.award.get_most_recent_proposal()
-            if proposal and self.agency_name != proposal.agency_name:
-                proposal.agency_name = self.agency_name
-                proposal.save()
-            if proposal and self.who_is_prime != proposal.who_is_prime:
-                proposal.who_is_prime = self.who_is_prime
-                proposal.save()
-            if proposal and self.project_title != proposal.project_title:
-                proposal.project_title = self.project_title
-                proposal.save()
-            if proposal and self.start_date != proposal.project_start_date:
-                proposal.project_start_date = self.start_date
-                proposal.save()
-            if proposal and self.end_date != proposal.project_end_date:
-                proposal.project_end_date = self.end_date
-                proposal.save()
+            if proposal:
+                changed_fields = proposal.set_field_values({
+                    'agency_name_id': self.agency_name_id,
+                    'who_is_prime_id': self.who_is_prime_id,
+                    'project_title': self.project_title,
+                    'project_start_date': self.start_date,
+                    'project_end_date': self.end_date,
+                })
+                if changed_fields:
+                    proposal.save(update_fields=changed_fields)
 
             award_acceptance = self.award.get_current_award_acceptance()
-
-            if self.agency_award_number != award_acceptance.agency_award_number:
-                award_acceptance.agency_award_number = self.agency_award_number
-                award_acceptance.save()
-            if self.sponsor_award_number != award_acceptance.sponsor_award_number:
-                award_acceptance.sponsor_award_number = self.sponsor_award_number
-                award_acceptance.save()
-            if self.eas_status != award_acceptance.eas_status:
-                award_acceptance.eas_status = self.eas_status
-                award_acceptance.save()
-            if self.project_title != award_acceptance.project_title:
-                award_acceptance.project_title = self.project_title
-                award_acceptance.save()
+            changed_fields = award_acceptance.set_field_values({
+                'agency_award_number': self.agency_award_number,
+                'sponsor_award_number': self.sponsor_award_number,
+                'eas_status': self.eas_status,
+                'project_title': self.project_title,
+            })
+            if changed_fields:
+                award_acceptance.save(update_fields=changed_fields)
 
     def get_absolute_url(self):
         """Gets the URL used to navigate to this object"""
@@ -4115,12 +5271,7 @@ class PTANumber(FieldIteratorMixin, models.Model):
 
     def get_recent_ptanumber_revision(self):
         """Gets the most recent revision of the model, using django-reversion"""
-        latest_revision = reversion.get_for_object(self)[0].revision
-        if latest_revision.user:
-            user = latest_revision.user.get_full_name()
-        else:
-            user = 'ATP'
-        return (user, latest_revision.date_created)
+        return get_latest_revision(self)
 
 
 class Subaward(AwardSection):
@@ -4532,3 +5683,91 @@ class FinalReport(FieldIteratorMixin, models.Model):
             kwargs={
                 'award_pk': self.award.pk,
                 'final_report_pk': self.id})
+
+
+def _get_user_choices(users):
+    return [(user_id, first_name + ' ' + last_name)
+            for user_id, first_name, last_name in users.values_list('id', 'first_name', 'last_name')]
+
+
+def _get_open_assignment_user_choices():
+    """Users that have any open award assigned to them, in one query"""
+
+    open_awards = Award.objects.filter(status__lt=Award.END_STATUS)
+    assigned = Q()
+    for user_field in Award.ASSIGNMENT_USER_FIELDS:
+        assigned |= Q(id__in=open_awards.values(user_field))
+    return _get_user_choices(User.objects.filter(assigned).order_by('first_name'))
+
+
+def _get_assignment_user_choices():
+    """Active users that belong to one of the workflow groups"""
+
+    users = User.objects.filter(is_active=True, groups__name__in=[
+        'Administrative',
+        'Award Acceptance',
+        'Award Closeout',
+        'Award Management',
+        'Award Modification',
+        'Award Negotiation',
+        'Award Setup',
+        'Proposal Intake',
+        'Subaward Management',
+    ]).order_by('first_name').distinct()
+    return _get_user_choices(users)
+
+
+def _get_proposal_intake_user_choices():
+    """Active Proposal Intake users, by full name (which is what ProposalIntake.spa1 stores)"""
+
+    users = User.objects.filter(is_active=True, groups__name='Proposal Intake').order_by('first_name')
+    return [(full_name, full_name) for full_name in
+            (first_name + ' ' + last_name for first_name, last_name in users.values_list('first_name', 'last_name'))]
+
+open_assignment_user_choices = CachedChoices('awards:open_assignment_user_choices', _get_open_assignment_user_choices)
+assignment_user_choices = CachedChoices('awards:assignment_user_choices', _get_assignment_user_choices)
+proposal_intake_user_choices = CachedChoices('awards:proposal_intake_user_choices', _get_proposal_intake_user_choices)
+
+
+@receiver(post_delete, sender=Award)
+@receiver(post_save, sender=Award)
+def clear_open_assignment_user_choices(sender, instance, **kwargs):
+    """Use Django signals to drop the cached reassignment choices whenever an award changes"""
+    open_assignment_user_choices.clear()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=User)
+def clear_user_choices(sender, instance, **kwargs):
+    """Use Django signals to drop the cached user choices whenever a user or their groups change"""
+    open_assignment_user_choices.clear()
+    assignment_user_choices.clear()
+    proposal_intake_user_choices.clear()
+
+
+# When anything shown by the award lists' and searches' JSON feeds last changed
+feed_changes = ChangeStamp('awards:feed_changes')
+
+# Bookkeeping models, which never show up in the feeds
+NON_FEED_MODELS = (ATPAuditTrail, BackgroundJob, EASMapping, OutboundEmail)
+
+
+@receiver(post_delete)
+@receiver(post_save)
+def touch_feed_changes(sender, **kwargs):
+    """Use Django signals to mark the JSON feeds as changed whenever the data they show changes"""
+    if sender is User or (sender._meta.app_label == 'awards' and sender not in NON_FEED_MODELS):
+        feed_changes.touch()
+
+
+# When the EAS reference data (shown by name in the sections' cached details) last changed
+reference_data_changes = ChangeStamp('awards:reference_data_changes')
+
+
+@receiver(post_delete)
+@receiver(post_save)
+def touch_reference_data_changes(sender, **kwargs):
+    """Use Django signals to mark the cached section details as stale whenever EAS reference data changes"""
+    if issubclass(sender, EASUpdateMixin):
+        reference_data_changes.touch()
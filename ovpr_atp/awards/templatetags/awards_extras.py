@@ -3,8 +3,11 @@
 # See Django documentation at https://docs.djangoproject.com/en/1.6/howto/custom-template-tags/
 
 from django import template
+from django.db import models
 from django.forms import Textarea
 
+from awards.models import get_latest_revision, reference_data_changes
+
 register = template.Library()
 
 
@@ -17,3 +20,28 @@ def is_textarea(field):
 def classname(class_object):
     """Returns the class name of the given object"""
     return class_object.__class__.__name__
+
+
+@register.filter
+def latest_revision(instance, latest_revisions):
+    """Gets the instance's most recent revision from the map built by Award.get_latest_revisions.
+    Views that don't provide the map fall back to looking it up for this instance alone.
+    """
+    if not isinstance(instance, models.Model):
+        return None
+    if not isinstance(latest_revisions, dict):
+        latest_revisions = None
+    return get_latest_revision(instance, latest_revisions)
+
+
+@register.assignment_tag(takes_context=True)
+def reference_data_stamp(context):
+    """Gets a stamp of the last EAS reference data change, for the section details' cache key.
+    It's looked up once per request.
+    """
+    request = context.get('request')
+    if request is None:
+        return reference_data_changes.get_etag()
+    if not hasattr(request, '_reference_data_stamp'):
+        request._reference_data_stamp = reference_data_changes.get_etag()
+    return request._reference_data_stamp
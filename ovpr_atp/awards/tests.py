@@ -1,11 +1,68 @@
 # Basic unit tests for the Awards pages
-from django.test import TestCase
+from django.apps import apps
+from django.core import mail
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, IntegrityError
+from django.db.models.signals import post_save
+from django.test import TestCase, RequestFactory
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.http.request import QueryDict
+from django.template.loader import render_to_string
 
 from core.setup import setup_project
-from .views import CreatePTANumberView, EditSectionView, home, AwardDetailView
+from smtplib import SMTPException
+import json
+import reversion
+
+from .jobs import _save_cayuse_chunk, send_queued_emails
+from .views import CreatePTANumberView, EditSectionView, home, AwardDetailView, get_stashed_cayuse_proposal, \
+    CAYUSE_PROPOSAL_SESSION_KEY, CAYUSE_PROPOSAL_REUSE_TIME
 from .models import *
+from .utils import EASMappingResolver, cast_cayuse_row, iter_audit_trail_chunks
+
+
+# Each user field of an award, and the group its users come from
+AWARD_USER_GROUPS = [
+    ('award_acceptance_user', 'Award Acceptance'),
+    ('award_negotiation_user', 'Award Negotiation'),
+    ('award_setup_user', 'Award Setup'),
+    ('award_modification_user', 'Award Modification'),
+    ('subaward_user', 'Subaward Management'),
+    ('award_management_user', 'Award Management'),
+    ('award_closeout_user', 'Award Closeout'),
+]
+
+
+def get_group_user(group):
+    return User.objects.filter(groups__name=group).first()
+
+
+def create_award(user, **users):
+    """Creates an award with user in each of its required user fields, apart from any given in users"""
+
+    fields = dict(award_acceptance_user=user, award_setup_user=user, award_management_user=user,
+                  award_closeout_user=user)
+    fields.update(users)
+    return Award.objects.create(**fields)
+
+
+def create_group_award(**users):
+    """Creates an award with the first user of each group in its user fields, apart from any given in users"""
+
+    fields = dict((field, get_group_user(group)) for field, group in AWARD_USER_GROUPS)
+    fields.update(users)
+    return Award.objects.create(**fields)
+
+
+def create_award_through_view(client):
+    """Creates an award from the create award page, assigned to the first user in each group"""
+
+    client.post('/awards/create-award/', data=dict(
+        (field, get_group_user(group).id) for field, group in AWARD_USER_GROUPS))
+    return Award.objects.last()
 
 
 class DatabaseTestCase(TestCase):
@@ -15,18 +72,6 @@ class DatabaseTestCase(TestCase):
         self.c = Client()
         self.c.login(username='admin', password='password')
 
-    def _create_award(self):
-        self.c.post('/awards/create-award/', data={
-            'award_acceptance_user': User.objects.filter(groups__name='Award Acceptance').first().id,
-            'award_negotiation_user': User.objects.filter(groups__name='Award Negotiation').first().id,
-            'award_setup_user': User.objects.filter(groups__name='Award Setup').first().id,
-            'subaward_user': User.objects.filter(groups__name='Subaward Management').first().id,
-            'award_management_user': User.objects.filter(groups__name='Award Management').first().id,
-            'award_closeout_user': User.objects.filter(groups__name='Award Closeout').first().id,
-        })
-
-        return Award.objects.last()
-
     def test_home_page(self):
         # Act
         response = self.c.get('/', follow=True)
@@ -37,14 +82,14 @@ class DatabaseTestCase(TestCase):
 
     def test_award_unicode(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Assert
         self.assertEqual(str(award), 'Award #%s' % award.id)
 
     def test_award_detail(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Act
         response = self.c.get(award.get_absolute_url())
@@ -55,7 +100,7 @@ class DatabaseTestCase(TestCase):
 
     def test_edit_award_section(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Act
         response = self.c.get(award.get_current_award_acceptance().get_absolute_url())
@@ -66,7 +111,7 @@ class DatabaseTestCase(TestCase):
 
     def test_fail_minimum_fields_check(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Act
         response = self.c.post(award.get_current_award_acceptance().get_absolute_url(),
@@ -79,7 +124,7 @@ class DatabaseTestCase(TestCase):
 
     def test_pass_minimum_fields_check(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Act
         response = self.c.post(award.get_current_award_acceptance().get_absolute_url(),
@@ -93,7 +138,7 @@ class DatabaseTestCase(TestCase):
 
     def test_modification_creation(self):
         # Arrange
-        award = self._create_award()
+        award = create_award_through_view(self.c)
 
         # Act
         response = self.c.post('/awards/%s/create-modification/' % award.id)
@@ -107,6 +152,22 @@ class DatabaseTestCase(TestCase):
         self.assertIsInstance(award.get_current_award_negotiation(), AwardNegotiation)
         self.assertEqual(len(award.get_previous_award_negotiations()), 1)
 
+        award = Award.objects.get(pk=award.id)
+        self.assertEqual(award.modification_count, 1)
+        self.assertEqual(award.get_modification_label(), 'Modification #1')
+
+    def test_increment_modification_count_survives_later_saves(self):
+        """ Saving an award after incrementing its count doesn't undo a concurrent increment. """
+        award = create_award_through_view(self.c)
+        other_copy = Award.objects.get(pk=award.id)
+
+        award.increment_modification_count()
+        other_copy.increment_modification_count()
+        award.status = award.AWARD_ACCEPTANCE_STATUS
+        award.save(check_status=False)
+
+        self.assertEqual(Award.objects.get(pk=award.id).modification_count, 2)
+
 
 class CreatePTANumberViewTest(TestCase):
     def setUp(self):
@@ -117,25 +178,13 @@ class CreatePTANumberViewTest(TestCase):
 
         self.kwargs = {}
 
-    def _create_award(self):
-        self.c.post('/awards/create-award/', data={
-            'award_acceptance_user': User.objects.filter(groups__name='Award Acceptance').first().id,
-            'award_negotiation_user': User.objects.filter(groups__name='Award Negotiation').first().id,
-            'award_setup_user': User.objects.filter(groups__name='Award Setup').first().id,
-            'subaward_user': User.objects.filter(groups__name='Subaward Management').first().id,
-            'award_management_user': User.objects.filter(groups__name='Award Management').first().id,
-            'award_closeout_user': User.objects.filter(groups__name='Award Closeout').first().id,
-        })
-
-        return Award.objects.last()
-
     def test_first_pta_number_with_get_initail_values(self):
         """
         This test case is to verify the get initial values form the first pta number.
         It returns dictionary of initial values which are auto populated in the 2nd, 3rd ...etc pta numbers.
         :return: returns dictionary of initial values.
         """
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         create_pta = CreatePTANumberView()
         create_pta.kwargs = {'award_pk': award.id}
         pta_number = PTANumber.objects.create(award_id=award.id, project_number="Sample project", sp_type=1,
@@ -155,6 +204,23 @@ class CreatePTANumberViewTest(TestCase):
         self.assertEqual(final_reports_due_date, pta_number.final_reports_due_date)
         self.assertEqual(int(response['sp_type']), pta_number.sp_type)
 
+    def test_first_pta_number_writes_back_once(self):
+        """ The first PTA number copies its fields back with one UPDATE per object. """
+        award = create_award_through_view(self.c)
+        proposal = Proposal.objects.create(award=award, project_title='Old title')
+
+        with CaptureQueriesContext(connection) as queries:
+            PTANumber.objects.create(award=award, project_title='New title', start_date=date(2016, 4, 30),
+                                     end_date=date(2017, 4, 30), eas_status='A')
+        updates = [query['sql'] for query in queries.captured_queries if 'UPDATE' in query['sql']]
+        self.assertEqual(len([sql for sql in updates if 'UPDATE "awards_proposal"' in sql]), 1)
+        self.assertEqual(len([sql for sql in updates if 'UPDATE "awards_awardacceptance"' in sql]), 1)
+
+        proposal = Proposal.objects.get(pk=proposal.pk)
+        self.assertEqual((proposal.project_title, proposal.project_start_date), ('New title', date(2016, 4, 30)))
+        award_acceptance = award.get_current_award_acceptance()
+        self.assertEqual((award_acceptance.project_title, award_acceptance.eas_status), ('New title', 'A'))
+
     def test_first_pta_with_no_initial(self):
         """
         This test case is to verify the get initial values as empty when we create a first pta number.
@@ -166,7 +232,7 @@ class CreatePTANumberViewTest(TestCase):
                          'federal_negotiated_rate': None, 'agency_name': None, 'agency_award_number': u'',
                          'project_number': u'', 'eas_status': u'', 'final_reports_due_date': None, 'start_date': None,
                          'allowed_cost_schedule': None}
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         create_pta = CreatePTANumberView()
         create_pta.kwargs = {'award_pk': award.id}
         response = create_pta.get_initial()
@@ -181,22 +247,9 @@ class EditSectionViewTest(TestCase):
         self.c = Client()
         self.c.login(username='admin', password='password')
 
-    def _create_award(self):
-        self.c.post('/awards/create-award/', data={
-            'award_acceptance_user': User.objects.filter(groups__name='Award Acceptance').first().id,
-            'award_negotiation_user': User.objects.filter(groups__name='Award Negotiation').first().id,
-            'award_setup_user': User.objects.filter(groups__name='Award Setup').first().id,
-            'award_modification_user': User.objects.filter(groups__name='Award Modification').first().id,
-            'subaward_user': User.objects.filter(groups__name='Subaward Management').first().id,
-            'award_management_user': User.objects.filter(groups__name='Award Management').first().id,
-            'award_closeout_user': User.objects.filter(groups__name='Award Closeout').first().id,
-        })
-
-        return Award.objects.last()
-
     def test_get_object(self):
         """ This test case is to verify the object when a award assign to modification."""
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         _modifiction = AwardModification.objects.create(award=award, is_edited=False)
         _modifiction.save()
         self.c.user = award.award_modification_user
@@ -213,14 +266,14 @@ class EditSectionViewTest(TestCase):
         self.assertEqual(response, award_modification)
 
     def test_move_setup_or_modification_step(self):
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         award.move_setup_or_modification_step(modification_flag=True)
         award_moidification = AwardModification.objects.filter(award=award)
         self.assertEqual(len(award_moidification), 1)
 
     def test_upcoming_proposals_filter(self):
         """ This test is for the upcoming proposal filter"""
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         request = self.c
         dict = {'upcoming_proposals': 1}
         qdict = QueryDict('', mutable=True)
@@ -239,7 +292,7 @@ class EditSectionViewTest(TestCase):
 
     def test_all_proposals_filter(self):
         """ This test is for the all proposal filter"""
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         request = self.c
         dict = {'all_proposals': 1}
         qdict = QueryDict('', mutable=True)
@@ -258,7 +311,7 @@ class EditSectionViewTest(TestCase):
 
     def test_editable_sections_in_dual_model(self):
         """ This is to test when multiple teams working on same award. Multiple steps must be editable. """
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         award.award_dual_setup = True
         award.award_dual_negotiation = True
         award.status = 2
@@ -268,7 +321,7 @@ class EditSectionViewTest(TestCase):
 
     def test_get_active_sections(self):
         """ This test case is to identify the active sections when multiple teams are working parallel. """
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         expected_response = ['AwardNegotiation', 'AwardSetup']
         dual_mode = True
         response = award.get_active_sections(dual_mode)
@@ -278,7 +331,7 @@ class EditSectionViewTest(TestCase):
         """
          This test case is to validate the context data when mupltiple teams working on same award parallel.
         """
-        award = self._create_award()
+        award = create_award_through_view(self.c)
         award.status = 2
         award.award_dual_negotiation = True
         award.award_dual_setup = True
@@ -288,3 +341,963 @@ class EditSectionViewTest(TestCase):
         view.object = award
         context_data = view.get_context_data()
         self.assertEqual(expected_result, context_data['editable_sections'])
+
+
+class CayuseCasterTest(TestCase):
+
+    def test_cast_cayuse_row(self):
+        """ Cayuse values are converted by field type and unknown columns are dropped. """
+        row = {'project_title': 'Sample project', 'project_start_date': '2016-04-30',
+               'project_end_date': '2017-04-30 00:00:00.0', 'total_costs': '', 'not_a_field': 'x'}
+        response = cast_cayuse_row(Proposal, row, EASMappingResolver('C'))
+        self.assertEqual(response['project_title'], 'Sample project')
+        self.assertEqual(response['project_start_date'], datetime(2016, 4, 30))
+        self.assertEqual(response['project_end_date'], date(2017, 4, 30))
+        self.assertIsNone(response['total_costs'])
+        self.assertNotIn('not_a_field', response)
+
+    def test_resolver_memoizes_mappings(self):
+        """ Repeated values only hit the EASMapping table once per resolver. """
+        organization = AwardOrganization.objects.create(id=1, name='Physics', org_info1_meaning='',
+                                                        org_info2_meaning='', active=True)
+        EASMapping.objects.create(interface='C', field='department_name', incoming_value='PHYS',
+                                  atp_model='AwardOrganization', atp_pk=organization.id)
+        resolver = EASMappingResolver('C')
+        resolver.resolve('department_name', 'PHYS', AwardOrganization)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve('department_name', 'PHYS', AwardOrganization), organization)
+        self.assertRaises(EASMappingException, resolver.resolve, 'department_name', 'CHEM', AwardOrganization)
+
+    def test_mapping_index_invalidation(self):
+        """ The mapping index is loaded once and dropped when a mapping changes. """
+        physics = AwardOrganization.objects.create(id=1, name='Physics', org_info1_meaning='',
+                                                   org_info2_meaning='', active=True)
+        chemistry = AwardOrganization.objects.create(id=2, name='Chemistry', org_info1_meaning='',
+                                                     org_info2_meaning='', active=True)
+        mapping = EASMapping.objects.create(interface='C', field='department_name', incoming_value='PHYS',
+                                            atp_model='AwardOrganization', atp_pk=physics.id)
+        eas_mapping_index.get_atp_pk('C', 'department_name', 'PHYS', 'AwardOrganization')
+        with self.assertNumQueries(0):
+            self.assertEqual(eas_mapping_index.get_atp_pk('C', 'department_name', 'PHYS', 'AwardOrganization'),
+                             physics.id)
+
+        mapping.atp_pk = chemistry.id
+        mapping.save()
+        resolver = EASMappingResolver('C')
+        self.assertEqual(resolver.resolve('department_name', 'PHYS', AwardOrganization), chemistry)
+
+    def test_mapping_index_sees_other_processes_changes(self):
+        """ A mapping changed by another process replaces the indexed one after the check interval. """
+        mapping = EASMapping.objects.create(interface='C', field='department_name', incoming_value='PHYS',
+                                            atp_model='AwardOrganization', atp_pk=1)
+        eas_mapping_index.get_atp_pk('C', 'department_name', 'PHYS', 'AwardOrganization')
+
+        # What another process's save does: update the row and touch the shared stamp
+        EASMapping.objects.filter(pk=mapping.pk).update(atp_pk=2)
+        eas_mapping_changes.touch()
+        self.assertEqual(eas_mapping_index.get_atp_pk('C', 'department_name', 'PHYS', 'AwardOrganization'), 1)
+
+        eas_mapping_index._checked = 0
+        self.assertEqual(eas_mapping_index.get_atp_pk('C', 'department_name', 'PHYS', 'AwardOrganization'), 2)
+
+    def test_value_is_mapped_once(self):
+        """ A second mapping for the same value is rejected instead of competing with the first. """
+        EASMapping.objects.create(interface='C', field='department_name', incoming_value='PHYS',
+                                  atp_model='AwardOrganization', atp_pk=1)
+        self.assertRaises(IntegrityError, EASMapping.objects.create, interface='C', field='department_name',
+                          incoming_value='PHYS', atp_model='AwardOrganization', atp_pk=2)
+
+    def test_resolver_collects_missing_mappings(self):
+        """ A dry-run resolver records every unmapped value once instead of raising. """
+        resolver = EASMappingResolver('C', collect_missing=True)
+        self.assertIsNone(resolver.resolve('department_name', 'CHEM', AwardOrganization))
+        self.assertIsNone(resolver.resolve('department_name', 'CHEM', AwardOrganization))
+        self.assertIsNone(resolver.resolve('department_name', 'BIO', AwardOrganization))
+        self.assertEqual([missing['incoming_value'] for missing in resolver.missing], ['CHEM', 'BIO'])
+
+    def test_stashed_cayuse_proposal_expires(self):
+        """ Cayuse data kept during reconciliation is only reused for the same proposal, while it's fresh. """
+        request = RequestFactory().get('/')
+        request.session = {CAYUSE_PROPOSAL_SESSION_KEY: {
+            'proposal_id': '12', 'fetched': timezone.now().isoformat(), 'rows': {'proposal': []}}}
+        self.assertEqual(get_stashed_cayuse_proposal(request, '12')['rows'], {'proposal': []})
+        self.assertIsNone(get_stashed_cayuse_proposal(request, '13'))
+
+        fetched = timezone.now() - CAYUSE_PROPOSAL_REUSE_TIME - timedelta(minutes=1)
+        request.session[CAYUSE_PROPOSAL_SESSION_KEY]['fetched'] = fetched.isoformat()
+        self.assertIsNone(get_stashed_cayuse_proposal(request, '12'))
+
+
+class BackgroundJobTest(TestCase):
+
+    def test_enqueue_collapses_active_jobs(self):
+        """ Triggering a job that's already active returns it instead of queueing another. """
+        job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        self.assertTrue(created)
+        same_job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        self.assertFalse(created)
+        self.assertEqual(same_job, job)
+
+        self.assertTrue(job.claim())
+        self.assertFalse(job.claim())
+        job.record_progress(seen=3, new=2, failed=1)
+        job.finish()
+        self.assertEqual(job.get_progress()['rows_new'], 2)
+
+        new_job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        self.assertTrue(created)
+        self.assertNotEqual(new_job, job)
+
+    def test_sync_skips_proposals_saved_since_it_started(self):
+        """ A submission imported while a sync is running isn't saved a second time. """
+        job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        job.claim()
+        Proposal.objects.create(proposal_id=1001, project_title='Imported')
+
+        _save_cayuse_chunk(job, [None, {'proposal_id': '1001', 'project_title': 'Imported'},
+                                 {'proposal_id': '1002', 'project_title': 'New'}])
+        self.assertEqual(Proposal.objects.filter(proposal_id=1001).count(), 1)
+        self.assertEqual(Proposal.objects.filter(proposal_id=1002).count(), 1)
+        self.assertEqual(job.get_progress()['rows_new'], 1)
+
+    def test_heartbeat_keeps_long_running_job_alive(self):
+        """ A running job that keeps calling heartbeat() isn't released as stale. """
+        job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        job.claim()
+        long_ago = timezone.now() - BackgroundJob.STALE_AFTER
+        BackgroundJob.objects.filter(pk=job.pk).update(date_updated=long_ago)
+        job.date_updated = long_ago
+
+        job.heartbeat()
+        BackgroundJob.release_stale_jobs(BackgroundJob.CAYUSE_SYNC)
+        same_job, created = BackgroundJob.enqueue(BackgroundJob.CAYUSE_SYNC)
+        self.assertFalse(created)
+        self.assertEqual(same_job, job)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException('Mail server unavailable')
+
+
+class OutboundEmailTest(TestCase):
+
+    @override_settings(EMAIL_DIGEST_MINUTES=0)
+    def test_queued_emails_are_sent_in_batches(self):
+        """ Queued emails are only sent by the worker, and failures are retried then given up on. """
+        OutboundEmail.enqueue('OVPR ATP Update', 'First', 'reply@email.gwu.edu', ['a@gwu.edu', 'b@gwu.edu'])
+        OutboundEmail.enqueue('OVPR ATP Update', 'Second', 'reply@email.gwu.edu', ['c@gwu.edu'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_queued_emails(), (2, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['a@gwu.edu', 'b@gwu.edu'], ['c@gwu.edu']])
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 2)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        email, = OutboundEmail.enqueue('OVPR ATP Update', 'Third', 'reply@email.gwu.edu', ['d@gwu.edu'])
+        with self.settings(EMAIL_BACKEND='awards.tests.FailingEmailBackend'):
+            for attempt in range(OutboundEmail.MAX_ATTEMPTS):
+                OutboundEmail.objects.filter(pk=email.pk).update(next_attempt=timezone.now())
+                self.assertEqual(send_queued_emails(), (0, 1))
+
+        email = OutboundEmail.objects.get(pk=email.pk)
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+        self.assertIn('Mail server unavailable', email.last_error)
+
+        email.retry()
+        self.assertEqual(send_queued_emails(), (1, 0))
+
+    @override_settings(EMAIL_DIGEST_MINUTES=5)
+    def test_digest_combines_emails_to_each_recipient(self):
+        """ Emails queued for the same person within the digest window go out as one message. """
+        for award_id in range(3):
+            OutboundEmail.enqueue('OVPR ATP Update', 'Award #%s has been assigned to you' % award_id,
+                                  'reply@email.gwu.edu', ['a@gwu.edu'])
+        OutboundEmail.enqueue('OVPR ATP Update', 'Award #3 has been assigned to you', 'reply@email.gwu.edu',
+                              ['a@gwu.edu', 'b@gwu.edu'])
+
+        # Nothing is sent until the window is over
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        first_email = OutboundEmail.objects.filter(recipients='a@gwu.edu').order_by('id')[0]
+        OutboundEmail.objects.filter(pk=first_email.pk).update(next_attempt=timezone.now())
+        self.assertEqual(send_queued_emails(), (4, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['a@gwu.edu'])
+        self.assertIn('You have 4 updates in ATP', mail.outbox[0].body)
+        self.assertIn('Award #3 has been assigned to you', mail.outbox[0].body)
+
+        self.assertEqual(OutboundEmail.objects.get(recipients='b@gwu.edu').status, OutboundEmail.PENDING)
+
+
+class AwardTransitionTest(TestCase):
+
+    def setUp(self):
+        setup_project()
+
+    def test_transition_updates_award_once(self):
+        """ A transition writes the award once, with only the columns that changed. """
+        award = create_group_award()
+        award.move_to_next_step()
+
+        award = Award.objects.get(pk=award.pk)
+        with CaptureQueriesContext(connection) as queries:
+            award.move_to_next_step('AwardAcceptance')
+
+        award_updates = [query['sql'] for query in queries.captured_queries
+                         if 'UPDATE "awards_award" ' in query['sql']]
+        self.assertEqual(len(award_updates), 1)
+        self.assertIn('SET "status" = ', award_updates[0])
+        self.assertEqual(Award.objects.get(pk=award.pk).status, 2)
+        self.assertIsNotNone(award.get_current_award_acceptance().acceptance_completion_date)
+
+    # The group whose user each section is assigned to
+    SECTION_GROUPS = [
+        ('AwardAcceptance', 'Award Acceptance'),
+        ('AwardNegotiation', 'Award Negotiation'),
+        ('AwardSetup', 'Award Setup'),
+        ('AwardModification', 'Award Modification'),
+        ('Subaward', 'Subaward Management'),
+        ('AwardManagement', 'Award Management'),
+        ('AwardCloseout', 'Award Closeout'),
+    ]
+
+    WORKFLOW_FLAGS = ['subaward_done', 'award_management_done', 'send_to_modification', 'common_modification',
+                      'award_dual_negotiation', 'award_dual_setup', 'award_dual_modification']
+
+    def create_workflow_award(self, negotiation=True):
+        """Creates an award with a user for every section (but Award Negotiation, optionally)"""
+
+        if negotiation:
+            return create_group_award()
+        return create_group_award(award_negotiation_user=None)
+
+    def move(self, award, *sections):
+        """Moves a freshly loaded copy of the award to the next step once for each section given"""
+
+        for section in sections:
+            award = Award.objects.get(pk=award.pk)
+            award.move_to_next_step(section)
+        return Award.objects.get(pk=award.pk)
+
+    def assertWorkflowState(self, award, status, flags, completed_sections, modifications, trail):
+        """Checks the award's status and workflow flags, which section rows have a completion date,
+        its AwardModifications as (is_edited, assigned), and its audit trail as (modification,
+        section, completed) with the user checked against the section's group
+        """
+
+        award = Award.objects.get(pk=award.pk)
+        self.assertEqual(award.status, status)
+        self.assertEqual([flag for flag in self.WORKFLOW_FLAGS if getattr(award, flag)], flags)
+
+        completed = []
+        for section, _ in self.SECTION_GROUPS:
+            model = apps.get_model('awards', section)
+            field = AwardTransition.COMPLETION_DATE_FIELDS[section]
+            completed.extend(section for _ in model.objects.filter(award=award).exclude(**{field: None}))
+        self.assertEqual(completed, completed_sections)
+
+        self.assertEqual([(modification.is_edited, modification.date_assigned is not None)
+                          for modification in AwardModification.objects.filter(award=award).order_by('id')],
+                         modifications)
+
+        groups = dict(self.SECTION_GROUPS)
+        expected_trail = []
+        for modification, section, is_completed in trail:
+            user = get_group_user(groups[section])
+            expected_trail.append((modification, section, '%s %s' % (user.first_name, user.last_name), is_completed))
+        self.assertEqual(sorted((entry.modification, entry.workflow_step, entry.assigned_user,
+                                 entry.date_completed is not None)
+                                for entry in ATPAuditTrail.objects.filter(award=award)),
+                         sorted(expected_trail))
+
+    def test_award_without_negotiation_user_skips_negotiation(self):
+        """ Completing Award Intake goes straight to Award Setup when no one is negotiating. """
+        award = self.move(self.create_workflow_award(negotiation=False), None, 'AwardAcceptance')
+
+        self.assertWorkflowState(award, 3, [], ['AwardAcceptance'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardSetup', False),
+        ])
+        self.assertIsNone(award.get_current_award_negotiation().date_assigned)
+        self.assertIsNotNone(award.awardsetup.date_assigned)
+
+    def test_dual_negotiation_and_setup(self):
+        """ Negotiation and Setup run side by side, and the award moves on once both are done. """
+        award = self.move(self.create_workflow_award(), None)
+        award.move_award_to_multiple_steps(True)
+        self.assertWorkflowState(award, 2, ['award_dual_negotiation', 'award_dual_setup'], ['AwardAcceptance'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', False),
+            ('Original Award', 'AwardSetup', False),
+        ])
+
+        award = self.move(award, 'AwardNegotiation')
+        self.assertWorkflowState(award, 3, ['award_dual_setup'], ['AwardAcceptance', 'AwardNegotiation'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', True),
+            ('Original Award', 'AwardSetup', False),
+        ])
+
+        award = self.move(award, 'AwardSetup')
+        self.assertWorkflowState(award, 4, [], ['AwardAcceptance', 'AwardNegotiation', 'AwardSetup'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', True),
+            ('Original Award', 'AwardSetup', True),
+            ('Original Award', 'Subaward', False),
+            ('Original Award', 'AwardManagement', False),
+        ])
+
+    def create_modified_award(self):
+        """Takes an award through Award Setup, then starts a modification of it"""
+
+        award = self.move(self.create_workflow_award(), None, 'AwardAcceptance', 'AwardNegotiation', 'AwardSetup')
+        client = Client()
+        client.login(username='admin', password='password')
+        client.post(reverse('create_modification', kwargs={'award_pk': award.pk}))
+        return Award.objects.get(pk=award.pk)
+
+    # The original award's trail, as a modification leaves it
+    ORIGINAL_AWARD_TRAIL = [
+        ('Original Award', 'AwardAcceptance', True),
+        ('Original Award', 'AwardNegotiation', True),
+        ('Original Award', 'AwardSetup', True),
+        ('Original Award', 'Subaward', True),
+        ('Original Award', 'AwardManagement', True),
+    ]
+
+    def test_modification_in_negotiation_and_modification(self):
+        """ A modification can be negotiated and set up in Award Modification side by side. """
+        award = self.create_modified_award()
+        award.move_award_to_negotiation_and_modification(True)
+        self.assertWorkflowState(
+            award, 2, ['common_modification', 'award_dual_modification'],
+            ['AwardAcceptance', 'AwardAcceptance', 'AwardNegotiation', 'AwardSetup'],
+            [(False, True)],
+            self.ORIGINAL_AWARD_TRAIL + [
+                ('Modification #1', 'AwardAcceptance', True),
+                ('Modification #1', 'AwardNegotiation', False),
+                ('Modification #1', 'AwardModification', False),
+            ])
+
+        award = self.move(award, 'AwardNegotiation')
+        self.assertWorkflowState(
+            award, 3, ['common_modification', 'award_dual_modification'],
+            ['AwardAcceptance', 'AwardAcceptance', 'AwardNegotiation', 'AwardNegotiation', 'AwardSetup'],
+            [(False, True)],
+            self.ORIGINAL_AWARD_TRAIL + [
+                ('Modification #1', 'AwardAcceptance', True),
+                ('Modification #1', 'AwardNegotiation', True),
+                ('Modification #1', 'AwardModification', False),
+            ])
+
+    def test_modification_sent_to_award_modification(self):
+        """ Sending a modification on to Award Modification starts a new one from the Award Setup values. """
+        award = self.create_modified_award()
+        award.move_setup_or_modification_step(modification_flag=True)
+        self.assertWorkflowState(
+            award, 2, ['send_to_modification'],
+            ['AwardAcceptance', 'AwardAcceptance', 'AwardNegotiation', 'AwardSetup'],
+            # The modification created with the award's modification is done with; a new one is assigned
+            [(True, False), (False, True)],
+            self.ORIGINAL_AWARD_TRAIL + [
+                ('Modification #1', 'AwardAcceptance', True),
+                ('Modification #1', 'AwardNegotiation', False),
+            ])
+
+        award = self.move(award, 'AwardNegotiation')
+        self.assertWorkflowState(
+            award, 3, ['send_to_modification'],
+            ['AwardAcceptance', 'AwardAcceptance', 'AwardNegotiation', 'AwardNegotiation', 'AwardSetup'],
+            [(True, False), (False, True)],
+            self.ORIGINAL_AWARD_TRAIL + [
+                ('Modification #1', 'AwardAcceptance', True),
+                ('Modification #1', 'AwardNegotiation', True),
+                ('Modification #1', 'AwardModification', False),
+            ])
+
+    def test_subaward_and_management_then_closeout(self):
+        """ Closeout waits for both Subawards and Award Management; completing it ends the award. """
+        award = self.move(self.create_workflow_award(), None, 'AwardAcceptance', 'AwardNegotiation', 'AwardSetup')
+        Subaward.objects.create(award=award)
+
+        award = self.move(award, 'Subaward')
+        self.assertWorkflowState(award, 4, ['subaward_done'],
+                                 ['AwardAcceptance', 'AwardNegotiation', 'AwardSetup', 'Subaward'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', True),
+            ('Original Award', 'AwardSetup', True),
+            ('Original Award', 'Subaward', True),
+            ('Original Award', 'AwardManagement', False),
+        ])
+
+        award = self.move(award, 'AwardManagement')
+        self.assertWorkflowState(award, 5, ['subaward_done', 'award_management_done'],
+                                 ['AwardAcceptance', 'AwardNegotiation', 'AwardSetup', 'Subaward', 'AwardManagement'],
+                                 [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', True),
+            ('Original Award', 'AwardSetup', True),
+            ('Original Award', 'Subaward', True),
+            ('Original Award', 'AwardManagement', True),
+            ('Original Award', 'AwardCloseout', False),
+        ])
+
+        award = self.move(award, 'AwardCloseout')
+        self.assertWorkflowState(award, Award.END_STATUS, ['subaward_done', 'award_management_done'],
+                                 ['AwardAcceptance', 'AwardNegotiation', 'AwardSetup', 'Subaward', 'AwardManagement',
+                                  'AwardCloseout'], [], [
+            ('Original Award', 'AwardAcceptance', True),
+            ('Original Award', 'AwardNegotiation', True),
+            ('Original Award', 'AwardSetup', True),
+            ('Original Award', 'Subaward', True),
+            ('Original Award', 'AwardManagement', True),
+            ('Original Award', 'AwardCloseout', True),
+        ])
+
+    def test_audit_trail_recorder(self):
+        """ Buffered trail entries are completed or created in one pass. """
+        award = create_group_award()
+        ATPAuditTrail.objects.create(award=award, modification='Original Award', workflow_step='AwardSetup',
+                                     assigned_user='Jane Doe', date_created=datetime.now())
+
+        recorder = ATPAuditTrailRecorder(award)
+        recorder.record('Original Award', 'AwardSetup', 'Jane Doe')
+        recorder.record('Original Award', 'AwardManagement', 'John Doe')
+        recorder.record('Original Award', 'AwardCloseout', 'John Doe')
+        recorder.record('Original Award', 'AwardCloseout', 'John Doe')
+        recorder.record('Modification #1', 'FCOI', 'John Doe', create_if_missing=False)
+        with self.assertNumQueries(3):
+            recorder.flush()
+
+        trail = dict((entry.workflow_step, entry) for entry in ATPAuditTrail.objects.filter(award=award))
+        self.assertEqual(sorted(trail.keys()), ['AwardCloseout', 'AwardManagement', 'AwardSetup'])
+        self.assertIsNotNone(trail['AwardSetup'].date_completed)
+        self.assertIsNone(trail['AwardManagement'].date_completed)
+        self.assertIsNotNone(trail['AwardCloseout'].date_completed)
+
+        award.delete()
+        self.assertEqual(ATPAuditTrail.objects.filter(award=None).count(), 3)
+
+
+class AuditTrailExportTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+        self.c = Client()
+        self.c.login(username='admin', password='password')
+
+    def test_export_streams_filtered_rows_in_chunks(self):
+        """ The export reads the trail a chunk at a time and only includes the filtered award. """
+        awards = [create_group_award() for _ in range(2)]
+        for award in awards:
+            for workflow_step in ['AwardAcceptance', 'AwardSetup', 'AwardManagement']:
+                ATPAuditTrail.objects.create(award=award, modification='Original Award', workflow_step=workflow_step,
+                                             assigned_user='Jane Doe',
+                                             date_created=timezone.make_aware(datetime(2018, 7, 1, 16, 30),
+                                                                              timezone.utc))
+
+        chunks = list(iter_audit_trail_chunks(ATPAuditTrail.objects.filter(award=awards[0]), chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(chunks[0][0][3], '07/01/2018 12:30:00')
+        self.assertIsNone(chunks[0][0][4])
+
+        response = self.c.post('/awards/audit-trail-activity/', data={'award': awards[1].id, 'file_format': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(lines[0], 'Award,Modification,Workflow Step,Date Created,Date Completed,Assigned User')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(line.startswith('%s,' % awards[1].id) for line in lines[1:]))
+
+        response = self.c.post('/awards/audit-trail-activity/', data={'file_format': 'xlsx'})
+        self.assertEqual(response['Content-Type'],
+                         'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertTrue(''.join(response.streaming_content).startswith('PK'))
+
+
+class FirstProposalTest(TestCase):
+    def setUp(self):
+        setup_project()
+        user = User.objects.filter(groups__name='Award Acceptance').first()
+        self.award = create_award(user)
+
+    def get_first_proposals(self):
+        return list(self.award.proposal_set.filter(is_first_proposal=True).values_list('id', 'dummy'))
+
+    def test_dummy_proposal_is_replaced(self):
+        """ A new award gets a dummy first proposal, which the first real proposal replaces. """
+        dummy = self.award.proposal_set.get()
+        self.assertEqual(self.get_first_proposals(), [(dummy.id, True)])
+
+        proposal = Proposal.objects.create(award=self.award)
+        self.assertEqual(self.get_first_proposals(), [(proposal.id, False)])
+        self.assertEqual(self.award.proposal_set.count(), 1)
+
+        # Saves that can't change the first proposal don't check it; they only read back the version
+        proposal = Proposal.objects.get(pk=proposal.pk)
+        with self.assertNumQueries(2):
+            proposal.save()
+
+        proposal.delete()
+        self.assertEqual([dummy for _, dummy in self.get_first_proposals()], [True])
+
+    def test_suspended_checks_run_once(self):
+        """ Proposals saved while the checks are suspended are fixed up together afterwards. """
+        with first_proposal_maintainer.suspended():
+            proposals = [Proposal.objects.create(award=self.award) for _ in range(3)]
+            self.assertEqual(self.award.proposal_set.count(), 4)
+
+        self.assertEqual(self.award.proposal_set.count(), 3)
+        self.assertEqual(self.get_first_proposals(), [(proposals[0].id, False)])
+
+
+class AwardSaveTest(TestCase):
+    def setUp(self):
+        setup_project()
+        user = User.objects.filter(groups__name='Award Acceptance').first()
+        self.award = create_award(user)
+
+    def test_save_writes_changed_fields_only(self):
+        """ Saving a loaded award compares against its snapshot and only updates what changed. """
+        award = Award.objects.get(pk=self.award.pk)
+        award.extracted_to_eas = True
+        with CaptureQueriesContext(connection) as queries:
+            award.save()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('SET "extracted_to_eas"', queries[0]['sql'])
+        self.assertNotIn('"status"', queries[0]['sql'])
+
+    def test_acceptance_notifications_use_snapshot(self):
+        """ Populating the FCOI cleared date still sends its notification. """
+        award_acceptance = AwardAcceptance.objects.get(award=self.award)
+        award_acceptance.fcoi_cleared_date = date(2016, 4, 30)
+        award_acceptance.save()
+        self.assertEqual(OutboundEmail.objects.filter(body__contains='FCOI cleared date').count(), 1)
+
+        award_acceptance.save()
+        self.assertEqual(OutboundEmail.objects.filter(body__contains='FCOI cleared date').count(), 1)
+
+
+class LatestRevisionTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+    def test_latest_revisions_for_award(self):
+        """ The latest revision of every section comes back in a fixed number of queries, without subqueries. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposals = [Proposal.objects.create(award=award) for _ in range(3)]
+
+        for proposal in proposals[:2]:
+            with reversion.create_revision():
+                proposal.save()
+        with reversion.create_revision():
+            reversion.set_user(user)
+            proposals[0].save()
+            award.awardsetup.save()
+
+        # Once the content types are cached
+        award.get_latest_revisions()
+        # One query for the pks of each of the ten section models, and two for the revisions
+        with CaptureQueriesContext(connection) as queries:
+            latest_revisions = award.get_latest_revisions()
+        self.assertEqual(len(queries), 12)
+        self.assertFalse(any(query['sql'].count('SELECT') > 1 for query in queries))
+
+        self.assertEqual(latest_revisions[(Proposal, proposals[0].id)][0], user.get_full_name())
+        self.assertEqual(latest_revisions[(Proposal, proposals[1].id)][0], 'ATP')
+        self.assertEqual(latest_revisions[(AwardSetup, award.awardsetup.id)][0], user.get_full_name())
+        self.assertEqual(get_latest_revision(proposals[2], latest_revisions), ('ATP', None))
+        self.assertEqual(proposals[0].get_most_recent_revision(), latest_revisions[(Proposal, proposals[0].id)])
+
+
+class SectionFragmentCacheTest(TestCase):
+    def setUp(self):
+        setup_project()
+        cache.clear()
+
+    def test_section_detail_cached_until_saved(self):
+        """ A section's rendered details are reused until the section is saved again. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposal = Proposal.objects.create(award=award, project_title='Original title')
+        version = proposal.version
+
+        self.assertIn('Original title', render_to_string('awards/_section_detail.html', {'instance': proposal}))
+
+        # Writes that skip save() don't change the version, so the cached rendering is used
+        Proposal.objects.filter(pk=proposal.pk).update(project_title='Updated title')
+        proposal = Proposal.objects.get(pk=proposal.pk)
+        self.assertIn('Original title', render_to_string('awards/_section_detail.html', {'instance': proposal}))
+
+        proposal.save()
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).version, version + 1)
+        self.assertIn('Updated title', render_to_string('awards/_section_detail.html', {'instance': proposal}))
+
+    def test_saves_from_same_row_get_their_own_versions(self):
+        """ Two saves that started from the same loaded row never share a version (or cached rendering). """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposal = Proposal.objects.create(award=award, project_title='Original title')
+        first_copy = Proposal.objects.get(pk=proposal.pk)
+        second_copy = Proposal.objects.get(pk=proposal.pk)
+
+        first_copy.project_title = 'First title'
+        first_copy.save()
+        self.assertIn('First title', render_to_string('awards/_section_detail.html', {'instance': first_copy}))
+
+        second_copy.project_title = 'Second title'
+        second_copy.save()
+        self.assertEqual(second_copy.version, first_copy.version + 1)
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).version, second_copy.version)
+        self.assertIn('Second title', render_to_string('awards/_section_detail.html', {
+            'instance': Proposal.objects.get(pk=proposal.pk)}))
+
+    def test_section_detail_refreshed_when_reference_data_changes(self):
+        """ Renamed EAS reference data shows up in cached section details without saving the section. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        funding_source = FundingSource.objects.create(id=1, name='Old agency', number='1', active=True)
+        proposal = Proposal.objects.create(award=award, agency_name=funding_source)
+        self.assertIn('Old agency', render_to_string('awards/_section_detail.html', {'instance': proposal}))
+
+        funding_source.name = 'New agency'
+        funding_source.save()
+        proposal = Proposal.objects.get(pk=proposal.pk)
+        self.assertIn('New agency', render_to_string('awards/_section_detail.html', {'instance': proposal}))
+
+
+class FeedConditionalGetTest(TestCase):
+    def setUp(self):
+        setup_project()
+        cache.clear()
+
+        self.c = Client()
+        self.c.login(username='admin', password='password')
+
+    def test_unchanged_feed_not_modified(self):
+        """ The JSON feeds answer 304 until something they show changes. """
+        url = reverse('get_awards_ajax')
+        response = self.c.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('no-store', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(str(award.id), response.content)
+
+        # Reassignment writes with update(), which doesn't send post_save
+        new_user = User.objects.create(username='new_feed_user')
+        etag = self.c.get(url)['ETag']
+        Award.reassign(user.id, new_user.id)
+        self.assertEqual(self.c.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_transition_marks_feeds_changed_after_commit(self):
+        """ A feed read while a transition's transaction is still open doesn't keep its stale ETag. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+
+        etags = []
+
+        def read_etag(sender, **kwargs):
+            etags.append(feed_changes.get_etag())
+
+        post_save.connect(read_etag, sender=Award)
+        try:
+            award.move_to_next_step()
+        finally:
+            post_save.disconnect(read_etag, sender=Award)
+
+        self.assertTrue(etags)
+        self.assertNotEqual(feed_changes.get_etag(), etags[-1])
+
+
+class JSONAutosaveTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+        self.c = Client()
+        self.c.login(username='admin', password='password')
+
+    def test_autosave_saves_changed_fields_only(self):
+        """ A JSON autosave validates and saves only the fields it lists, and answers without HTML. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposal = Proposal.objects.create(award=award, project_title='Original title', sponsor_deadline=date(2015, 1, 2))
+        url = reverse('edit_proposal', kwargs={'award_pk': award.pk, 'proposal_pk': proposal.pk})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.c.post(url, {'project_start_date': '3/4/2015', 'autosave_fields': 'project_start_date'},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = json.loads(response.content)
+        self.assertTrue(data['saved'])
+        self.assertEqual(data['errors'], {})
+        self.assertEqual(data['values'], {'project_start_date': '2015-03-04'})
+
+        proposal = Proposal.objects.get(pk=proposal.pk)
+        self.assertEqual(data['version'], proposal.version)
+        self.assertEqual(proposal.project_start_date, date(2015, 3, 4))
+        self.assertEqual(proposal.project_title, 'Original title')
+        self.assertEqual(proposal.sponsor_deadline, date(2015, 1, 2))
+        self.assertTrue(proposal.is_edited)
+        updates = [query['sql'] for query in queries.captured_queries if 'UPDATE "awards_proposal"' in query['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"project_title"', updates[0])
+
+        response = self.c.post(url, {'sponsor_deadline': 'not a date', 'autosave_fields': 'sponsor_deadline'},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = json.loads(response.content)
+        self.assertFalse(data['saved'])
+        self.assertEqual(list(data['errors']), ['sponsor_deadline'])
+        self.assertEqual(data['version'], proposal.version)
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).sponsor_deadline, date(2015, 1, 2))
+
+    def test_autosave_over_stale_version_conflicts(self):
+        """ An autosave from an outdated version saves nothing and gets back the current values. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposal = Proposal.objects.create(award=award, project_title='Original title')
+        url = reverse('edit_proposal', kwargs={'award_pk': award.pk, 'proposal_pk': proposal.pk})
+        page_version = proposal.version
+
+        proposal.project_title = 'Their title'
+        proposal.save()
+
+        response = self.c.post(url, {'project_title': 'My title', 'autosave_fields': 'project_title',
+                                     'version': page_version},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = json.loads(response.content)
+        self.assertFalse(data['saved'])
+        self.assertTrue(data['conflict'])
+        self.assertEqual(data['values'], {'project_title': 'Their title'})
+        self.assertEqual(data['version'], proposal.version)
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).project_title, 'Their title')
+
+        response = self.c.post(url, {'project_title': 'My title', 'autosave_fields': 'project_title',
+                                     'version': data['version']},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = json.loads(response.content)
+        self.assertTrue(data['saved'])
+        self.assertFalse(data['conflict'])
+        self.assertEqual(Proposal.objects.get(pk=proposal.pk).project_title, 'My title')
+
+    def test_autosave_records_negotiation_status(self):
+        """ Autosaving a new negotiation status adds it to the award's status history, like a full save. """
+        user = User.objects.get(username='admin')
+        award = create_award(user, award_negotiation_user=user)
+        Award.objects.filter(pk=award.pk).update(status=2)
+        url = reverse('edit_award_negotiation', kwargs={'award_pk': award.pk})
+
+        response = self.c.post(url, {'negotiation_status': 'IP', 'negotiation_notes': 'Sent to sponsor',
+                                     'autosave_fields': 'negotiation_status,negotiation_notes'},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(json.loads(response.content)['saved'])
+        history = NegotiationStatus.objects.get(award=award)
+        self.assertEqual(history.negotiation_status, 'In progress')
+        self.assertEqual(history.negotiation_notes, 'Sent to sponsor')
+
+        # Only a change of status is recorded
+        self.c.post(url, {'negotiation_notes': 'Still with sponsor', 'autosave_fields': 'negotiation_notes'},
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(NegotiationStatus.objects.filter(award=award).count(), 1)
+
+
+class AwardGraphTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+    def test_graph_loads_in_fixed_queries(self):
+        """ The award page graph takes the same number of queries however many proposals there are. """
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        Proposal.objects.create(award=award, dummy=False)
+
+        with CaptureQueriesContext(connection) as queries:
+            Award.get_graph(award.pk)
+        query_count = len(queries)
+
+        for _ in range(2):
+            Proposal.objects.create(award=award, dummy=False)
+        with self.assertNumQueries(query_count):
+            graph = Award.get_graph(award.pk)
+
+        with self.assertNumQueries(0):
+            first_proposal = graph.get_first_real_proposal()
+            supplemental_proposals = graph.get_supplemental_proposals()
+            graph.get_current_award_acceptance()
+            graph.get_current_award_negotiation()
+            graph.get_modifications()
+        self.assertEqual(len(supplemental_proposals), 2)
+        self.assertNotIn(first_proposal, supplemental_proposals)
+
+
+class AwardAdminTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+        self.c = Client()
+        self.c.login(username='admin', password='password')
+
+    def create_award(self, user):
+        award = create_award(user)
+        Proposal.objects.create(award=award, dummy=False, proposal_number='P%s' % award.pk)
+        return award
+
+    def test_changelist_queries_dont_grow_with_rows(self):
+        """ A 100 row page of the Award changelist takes as many queries as a 2 row page. """
+        user = User.objects.get(username='admin')
+        award = self.create_award(user)
+        self.create_award(user)
+        Subaward.objects.create(award=award)
+        Subaward.objects.create(award=award)
+        url = reverse('admin:awards_award_changelist')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.c.get(url)
+        query_count = len(queries)
+        self.assertContains(response, 'Award for proposal #P%s' % award.pk)
+        self.assertContains(response, '%s?award__id__exact=%s' % (reverse('admin:awards_subaward_changelist'),
+                                                                  award.pk))
+
+        for _ in range(98):
+            self.create_award(user)
+        with self.assertNumQueries(query_count):
+            response = self.c.get(url)
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+        self.c = Client()
+        self.c.login(username='admin', password='password')
+
+    def create_manager(self, pk, full_name, gwid=None, active=True):
+        return AwardManager.objects.create(id=pk, full_name=full_name, gwid=gwid, system_user=False, active=active)
+
+    def test_autocomplete_pages_through_prefix_matches(self):
+        """ Autocomplete finds active objects by prefix, a page at a time. """
+        for pk in range(1, 26):
+            self.create_manager(pk, 'Zyzzyva, Person %02d' % pk)
+        self.create_manager(26, 'Aardvark, Person', gwid='G0026')
+        self.create_manager(27, 'Zyzzyva, Retired', active=False)
+        url = reverse('get_autocomplete_options', kwargs={'model_name': 'AwardManager'})
+
+        data = json.loads(self.c.get(url, {'term': 'zyz'}).content)
+        self.assertEqual(len(data['results']), AwardManager.AUTOCOMPLETE_PAGE_SIZE)
+        self.assertEqual(data['results'][0], {'id': 1, 'text': 'Zyzzyva, Person 01'})
+        self.assertTrue(data['more'])
+
+        data = json.loads(self.c.get(url, {'term': 'zyz', 'page': 2}).content)
+        self.assertEqual([result['id'] for result in data['results']], range(21, 26))
+        self.assertFalse(data['more'])
+
+        data = json.loads(self.c.get(url, {'term': 'G00'}).content)
+        self.assertEqual([result['id'] for result in data['results']], [26])
+
+        self.assertEqual(self.c.get(reverse('get_autocomplete_options', kwargs={'model_name': 'Award'})).status_code,
+                         404)
+
+    def test_section_form_renders_selected_object_only(self):
+        """ Section forms render the chosen reference object instead of every option. """
+        chosen = self.create_manager(1, 'Zyzzyva, Chosen')
+        self.create_manager(2, 'Zyzzyva, Other')
+        user = User.objects.get(username='admin')
+        award = create_award(user)
+        proposal = Proposal.objects.create(award=award, principal_investigator=chosen)
+
+        response = self.c.get(reverse('edit_proposal', kwargs={'award_pk': award.pk, 'proposal_pk': proposal.pk}))
+        self.assertContains(response, 'data-text="Zyzzyva, Chosen"')
+        self.assertNotContains(response, 'Zyzzyva, Other')
+
+
+class AwardReassignmentTest(TestCase):
+    def setUp(self):
+        setup_project()
+
+    def test_reassign_moves_open_assignments(self):
+        """ Reassignment only touches open awards, and only the user fields that matched. """
+        old_user = User.objects.create(username='old_setup_user')
+        new_user = User.objects.create(username='new_setup_user')
+        other_user = User.objects.filter(groups__name='Award Acceptance').first()
+
+        def create_award_in_status(status=0):
+            award = create_award(other_user, award_setup_user=old_user, award_management_user=old_user)
+            Award.objects.filter(pk=award.pk).update(status=status)
+            return award
+
+        chemistry = AwardOrganization.objects.create(id=1, name='Chemistry', org_info1_meaning='',
+                                                     org_info2_meaning='', active=True)
+        biology = AwardOrganization.objects.create(id=2, name='Biology', org_info1_meaning='',
+                                                   org_info2_meaning='', active=True)
+        chemistry_award, biology_award, complete_award = (create_award_in_status(), create_award_in_status(),
+                                                          create_award_in_status(status=6))
+        Proposal.objects.filter(award=chemistry_award).update(department_name=chemistry)
+        Proposal.objects.filter(award=biology_award).update(department_name=biology)
+
+        self.assertEqual(Award.reassign(old_user.id, new_user.id, department='Chemistry'), [chemistry_award.id])
+        chemistry_award = Award.objects.get(pk=chemistry_award.pk)
+        self.assertEqual(chemistry_award.award_setup_user_id, new_user.id)
+        self.assertEqual(chemistry_award.award_management_user_id, new_user.id)
+        self.assertEqual(chemistry_award.award_acceptance_user_id, other_user.id)
+
+        self.assertEqual(Award.reassign(old_user.id, new_user.id), [biology_award.id])
+        self.assertEqual(Award.objects.get(pk=complete_award.pk).award_setup_user_id, old_user.id)
+
+    def test_assignment_preview_json(self):
+        """ The reassignment preview lists every open assignment and its department in a fixed number of queries. """
+        user = User.objects.create(username='preview_user')
+        other_user = User.objects.filter(groups__name='Award Acceptance').first()
+        chemistry = AwardOrganization.objects.create(id=1, name='Chemistry', org_info1_meaning='',
+                                                     org_info2_meaning='', active=True)
+
+        awards = [create_award(other_user, award_setup_user=user) for _ in range(3)]
+        Proposal.objects.filter(award__in=awards[:2]).update(department_name=chemistry)
+
+        client = Client()
+        url = reverse('get_re_assignment_awards', kwargs={'atp_user': user.id})
+        self.assertEqual(client.get(url).status_code, 302)
+        client.login(username='jack.cooper', password='password')
+        self.assertEqual(client.get(url).status_code, 403)
+
+        client.login(username='admin', password='password')
+        # The extra queries load the session and the user
+        with self.assertNumQueries(4):
+            response = client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual([(award['id'], award['department']) for award in data['awards']],
+                         [(awards[0].id, 'Chemistry'), (awards[1].id, 'Chemistry'), (awards[2].id, None)])
+        self.assertEqual(data['departments'], [{'name': 'Chemistry', 'award_count': 2}])
+
+        with self.assertNumQueries(3):
+            response = client.get(reverse('get_department_awards', kwargs={'atp_user': user.id,
+                                                                           'user_dept': 'Chemistry'}))
+        # Awards with no department are moved along with any department
+        self.assertEqual([award['id'] for award in json.loads(response.content)['awards']],
+                         [award.id for award in awards])
+
+    def test_reassignment_choices_follow_assignments(self):
+        """ The cached ATP User choices pick up new assignments and reassignments. """
+        old_user = User.objects.create(username='old_choices_user', first_name='Old', last_name='User')
+        new_user = User.objects.create(username='new_choices_user', first_name='New', last_name='User')
+
+        self.assertNotIn((old_user.id, 'Old User'), open_assignment_user_choices())
+        other_user = User.objects.filter(groups__name='Award Acceptance').first()
+        create_award(other_user, award_setup_user=old_user)
+        self.assertIn((old_user.id, 'Old User'), open_assignment_user_choices())
+
+        Award.reassign(old_user.id, new_user.id)
+        with self.assertNumQueries(1):
+            choices = open_assignment_user_choices()
+        with self.assertNumQueries(0):
+            open_assignment_user_choices()
+        self.assertNotIn((old_user.id, 'Old User'), choices)
+        self.assertIn((new_user.id, 'New User'), choices)
@@ -44,6 +44,7 @@ from .views import (
     EditFinalReportView,
     DeleteFinalReportView,
     ProposalStatisticsReportView,
+    AuditTrailExportView,
     AwardREAssaignmentView)
 
 urlpatterns = patterns('awards.views',
@@ -58,10 +59,12 @@ urlpatterns = patterns('awards.views',
    url(r'^get-search-awards-ajax/$', 'get_search_awards_ajax', name='get_search_awards_ajax'),
    url(r'^get-search-subawards-ajax/$', 'get_search_subawards_ajax', name='get_search_subawards_ajax'),
    url(r'^get-search-pta-numbers-ajax/$', 'get_search_pta_numbers_ajax', name='get_search_pta_numbers_ajax'),
+   url(r'^get-autocomplete-options/(?P<model_name>\w+)/$', 'get_autocomplete_options', name='get_autocomplete_options'),
 
+   url(r'^reconcile-eas-mappings/$', 'reconcile_eas_mappings', name='reconcile_eas_mappings'),
    url(r'^create-eas-mapping/(?P<interface>.*)/(?P<field>.*)/(?P<incoming_value>.*)/(?P<atp_model>.*)/$', 'create_eas_mapping', name='create_eas_mapping'),
    url(r'^import-eas-data/(?P<endpoint>.*)/$', 'import_eas_data', name='import_eas_data'),
-   url(r'^audit-trail-activity/$', 'audittrail_activity_history', name='audittrail_activity_history'),
+   url(r'^audit-trail-activity/$', login_required(AuditTrailExportView.as_view()), name='audittrail_activity_history'),
    url(r'^create-proposal-intake/$', login_required(CreateProposalIntakeView.as_view()), name='create_proposal_intake'),
    url(r'^edit-proposal-intake/(?P<proposalintake_pk>\d+)/$', login_required(EditProposalIntakeView.as_view()), name='edit_standalone_proposal_intake'),
    url(r'^delete-proposal-intake/(?P<proposalintake_pk>\d+)/$', login_required(DeleteProposalIntakeView.as_view()), name='delete_proposal_intake'),
@@ -126,5 +129,6 @@ urlpatterns = patterns('awards.views',
 
    url(r'^get-proposal-statistics-report/$', login_required(ProposalStatisticsReportView.as_view()), name='get_proposal_statistics_report'),
    url(r'^get-cayuse-proposals/$', 'get_cayuse_proposals', name='get_cayuse_proposals'),
+   url(r'^background-jobs/(?P<job_pk>\d+)/status/$', 'get_background_job_status', name='get_background_job_status'),
 
    )
@@ -2,11 +2,16 @@
 
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzlocal
 from django.conf import settings
 from django.db.models import DateField, DateTimeField, DecimalField, BigIntegerField, IntegerField, ForeignKey
 from urlparse import urljoin
 from decimal import Decimal
-from .models import AwardManager, Proposal, KeyPersonnel, PerformanceSite, EASMapping, EASMappingException, AwardAcceptance
+from openpyxl import Workbook
+from openpyxl.styles import Font
+from openpyxl.writer.dump_worksheet import WriteOnlyCell
+from .models import AwardManager, Proposal, KeyPersonnel, PerformanceSite, EASMapping, EASMappingException, AwardAcceptance, \
+    eas_mapping_index
 
 import csv
 import requests
@@ -53,6 +58,16 @@ def get_cayuse_submissions(get_all_submissions=False):
     Defaults to the most recent six months of proposals, can be overriden to show all.
     """
 
+    return [proposal for proposal in iter_cayuse_submissions(get_all_submissions) if proposal is not None]
+
+
+def iter_cayuse_submissions(get_all_submissions=False):
+    """Yields the Proposal data for each Cayuse submission, one row at a time,
+    so long-running syncs can commit and report progress as they go.
+
+    Yields None for submissions that already exist in ATP.
+    """
+
     options = {}
     if not get_all_submissions:
         six_months_ago = date.today() - relativedelta(months=6)
@@ -65,86 +80,196 @@ def get_cayuse_submissions(get_all_submissions=False):
     reader = csv.reader(f, delimiter=',')
 
     header = reader.next()
+    rows = [dict(zip(header, row)) for row in reader]
+    f.close()
 
-    proposals = []
+    # One query for the whole batch instead of one per row
+    existing_proposal_ids = set(
+        str(proposal_id) for proposal_id in Proposal.objects.filter(
+            proposal_id__in=[row['proposal_id'] for row in rows]).values_list('proposal_id', flat=True))
+
+    resolver = EASMappingResolver('C')
     entries = ['department_name', 'first_name', 'last_name', 'middle_name', 'submit_title', 'submit_date',
                'division_code', 'submitterusername', 'department_code', 'result_code', 'duns_id']
-    for row in reader:
-        proposal = dict(zip(header, row))
+    for proposal in rows:
+        if proposal['proposal_id'] in existing_proposal_ids:
+            yield None
+            continue
+
         try:
-            prop = Proposal.objects.get(proposal_id=proposal['proposal_id'])
+            cayuse_data = get_cayuse_summary(proposal['proposal_id'], resolver)
+            pi = get_cayuse_pi(
+                cayuse_data['principal_investigator'],
+                cayuse_data['proposal']['employee_id'],
+                resolver)
+            proposal['principal_investigator_id'] = pi.id if pi.id else None
         except:
-            prop = None
-        if not prop:
-            try:
-                cayuse_data = get_cayuse_summary(proposal['proposal_id'])
-                pi = get_cayuse_pi(
-                    cayuse_data['principal_investigator'],
-                    cayuse_data['proposal']['employee_id'])
-                proposal['principal_investigator_id'] = pi.id if pi.id else None
-            except:
-                pass
-            if not proposal['total_indirect_costs']:
-                del proposal['total_indirect_costs']
-            else:
-                proposal['total_indirect_costs'] = Decimal(proposal['total_indirect_costs'])
-            if not proposal['total_direct_costs']:
-                del proposal['total_direct_costs']
-            else:
-                proposal['total_direct_costs'] = Decimal(proposal['total_direct_costs'])
-            proposal['proposal_number'] = '{0}-{1}'.format(proposal["submit_date"][2:4], proposal['proposal_id'])
-            proposal['submission_date'] = proposal['submit_date'][0:10]
-            for key in entries:
-                if key in proposal:
-                    del proposal[key]
-            proposals.append(proposal)
+            pass
+        if not proposal['total_indirect_costs']:
+            del proposal['total_indirect_costs']
+        else:
+            proposal['total_indirect_costs'] = Decimal(proposal['total_indirect_costs'])
+        if not proposal['total_direct_costs']:
+            del proposal['total_direct_costs']
+        else:
+            proposal['total_direct_costs'] = Decimal(proposal['total_direct_costs'])
+        proposal['proposal_number'] = '{0}-{1}'.format(proposal["submit_date"][2:4], proposal['proposal_id'])
+        proposal['submission_date'] = proposal['submit_date'][0:10]
+        for key in entries:
+            if key in proposal:
+                del proposal[key]
+        yield proposal
 
-    return proposals
 
+# Cayuse sends empty strings for missing values; these field types need None instead
+NULLABLE_CAYUSE_FIELD_TYPES = (DecimalField, IntegerField, BigIntegerField,
+                               DateField, DateTimeField, ForeignKey)
 
-def cast_field_value(field, value):
-    """Parses Cayuse data into Python values.
-    If the data doesn't exist in the ATP database, raises an EASMappingException to force
-    the user to create a new mapping with that data.
-    """
+CAYUSE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+CAYUSE_DATE_FORMAT = "%Y-%m-%d"
 
-    if type(field) in [DecimalField, IntegerField, BigIntegerField,
-                       DateField, DateTimeField, ForeignKey] and value == '':
-        return None
-    elif isinstance(field, DateTimeField):
-        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
-    elif isinstance(field, DateField):
-        try:
-            return datetime.strptime(value, "%Y-%m-%d")
-        except:
-            value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
-            return value.date()
-    elif isinstance(field, ForeignKey):
-        fk_model = field.related_field.model
 
-        # Try to associate the Cayuse value for the ForeignKey field with the
-        # appropriate EAS value
-        try:
-            mapping = EASMapping.objects.get(
-                interface='C',
-                field=field.name,
-                incoming_value=value,
-                atp_model=fk_model.__name__)
-        except EASMapping.DoesNotExist:
+class EASMappingResolver(object):
+    """Resolves incoming Cayuse/Lotus values to ATP objects through EASMapping.
+
+    Mappings come from the process-level EASMapping index. Target objects are memoized on
+    the instance, so sharing one resolver across an import batch fetches each repeated
+    value (agency, department, sponsor...) only once, while every batch still gets fresh rows.
+
+    With collect_missing set, unmapped values resolve to None and are recorded in
+    self.missing instead of raising, so a dry run can find every mapping an import needs.
+    """
+
+    def __init__(self, interface='C', collect_missing=False):
+        self.interface = interface
+        self.collect_missing = collect_missing
+        self.missing = []
+        self._resolved = {}
+
+    def resolve(self, field_name, value, atp_model):
+        """Gets the ATP object mapped to the given value.
+        If no mapping exists, raises an EASMappingException to force the user to create one.
+        """
+
+        key = (field_name, value, atp_model.__name__)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        atp_pk = eas_mapping_index.get_atp_pk(self.interface, field_name, value, atp_model.__name__)
+        if atp_pk is None and self.collect_missing:
+            unmapped_value = {
+                'interface': self.interface,
+                'field': field_name,
+                'incoming_value': value,
+                'atp_model': atp_model.__name__}
+            if unmapped_value not in self.missing:
+                self.missing.append(unmapped_value)
+            return None
+        elif atp_pk is None:
             raise EASMappingException(
                 message='Mapping not available',
-                interface='C',
-                field=field.name,
+                interface=self.interface,
+                field=field_name,
                 incoming_value=value,
-                atp_model=fk_model)
+                atp_model=atp_model)
+
+        atp_object = atp_model.objects.get(pk=atp_pk)
+        self._resolved[key] = atp_object
+        return atp_object
+
+
+def _parse_cayuse_datetime(value, resolver):
+    return datetime.strptime(value, CAYUSE_DATETIME_FORMAT)
+
+
+def _parse_cayuse_date(value, resolver):
+    # Cayuse sends dates either as plain dates or as full timestamps
+    if len(value) == 10:
+        return datetime.strptime(value, CAYUSE_DATE_FORMAT)
+    return datetime.strptime(value, CAYUSE_DATETIME_FORMAT).date()
+
+
+def _passthrough(value, resolver):
+    return value
+
+
+def _make_foreignkey_caster(field):
+    fk_model = field.related_field.model
+    field_name = field.name
+
+    def cast(value, resolver):
+        return resolver.resolve(field_name, value, fk_model)
+
+    return cast
+
+
+def _make_nullable_caster(caster):
+    def cast(value, resolver):
+        if value == '':
+            return None
+        return caster(value, resolver)
 
-        return fk_model.objects.get(pk=mapping.atp_pk)
+    return cast
 
+
+def _build_caster(field):
+    """Picks the converter for a single model field"""
+
+    if isinstance(field, DateTimeField):
+        caster = _parse_cayuse_datetime
+    elif isinstance(field, DateField):
+        caster = _parse_cayuse_date
+    elif isinstance(field, ForeignKey):
+        caster = _make_foreignkey_caster(field)
     else:
-        return value
+        caster = _passthrough
+
+    if type(field) in NULLABLE_CAYUSE_FIELD_TYPES:
+        caster = _make_nullable_caster(caster)
+
+    return caster
+
+
+_cayuse_casters = {}
+
+
+def get_cayuse_casters(model):
+    """Gets the table mapping Cayuse column names to converter callables for the given model.
+    The table is built once per model and reused by every import.
+    """
+
+    casters = _cayuse_casters.get(model)
+    if casters is None:
+        casters = dict((field.name, _build_caster(field)) for field in model._meta.fields)
+        _cayuse_casters[model] = casters
+    return casters
+
 
+def cast_cayuse_row(model, row, resolver, exclude=()):
+    """Parses a row of Cayuse data into Python values for the given model.
+    Columns that aren't fields on the model (or are excluded) are dropped.
+    """
+
+    casters = get_cayuse_casters(model)
+
+    return dict((key, casters[key](value, resolver))
+                for key, value in row.items()
+                if key in casters and key not in exclude)
+
+
+def cast_field_value(field, value, resolver=None):
+    """Parses Cayuse data into Python values.
+    If the data doesn't exist in the ATP database, raises an EASMappingException to force
+    the user to create a new mapping with that data.
+    """
+
+    if resolver is None:
+        resolver = EASMappingResolver('C')
 
-def cast_lotus_value(field, value):
+    return get_cayuse_casters(field.model)[field.name](value, resolver)
+
+
+def cast_lotus_value(field, value, resolver=None):
     """Tries to get the local AwardManager from the info that came from Lotus.
     If it doesn't exist in the database, raises an EASMappingException to force
     the user to create a new mapping with that data.
@@ -160,151 +285,145 @@ def cast_lotus_value(field, value):
         except AwardManager.DoesNotExist:
             pass
 
-    try:
-        mapping = EASMapping.objects.get(
-            interface='L',
-            field=field.name,
-            incoming_value=value,
-            atp_model=fk_model.__name__)
-    except EASMapping.DoesNotExist:
-        raise EASMappingException(
-            message='Mapping not available',
-            interface='L',
-            field=field.name,
-            incoming_value=value,
-            atp_model=fk_model)
-
-    return fk_model.objects.get(pk=mapping.atp_pk)
-
-
-def get_cayuse_summary(proposal_id):
-    """Get all the data about a proposal from Cayuse"""
+    if resolver is None:
+        resolver = EASMappingResolver('L')
+
+    return resolver.resolve(field.name, value, fk_model)
 
-    response = _make_cayuse_request('custom/summary?id=%s' % proposal_id)
+
+def _read_cayuse_rows(endpoint):
+    """Reads a Cayuse CSV report into a list of dicts keyed by column name"""
+
+    response = _make_cayuse_request(endpoint)
 
     f = StringIO.StringIO(response.content)
     reader = csv.reader(f, delimiter=',')
 
     header = reader.next()
-    proposal = reader.next()
+    rows = [dict(zip(header, row)) for row in reader]
     f.close()
 
-    summary = dict(zip(header, proposal))
+    return rows
 
-    pi_fields = AwardManager.CAYUSE_FIELDS
-    proposal_fields = Proposal._meta.get_all_field_names()
 
-    pi_info = {}
+def fetch_cayuse_proposal(proposal_id):
+    """Fetches the raw Cayuse data needed to import a proposal.
+    The result only holds strings, so it can be cached in the session and cast again
+    after missing EAS mappings are created, without calling Cayuse a second time.
+    """
 
-    for key in summary.keys():
-        if key in pi_fields:
-            pi_info[key] = cast_field_value(
-                AwardManager._meta.get_field(key),
-                summary.pop(key))
-        elif key not in proposal_fields:
-            del summary[key]
-        else:
-            summary[key] = cast_field_value(
-                Proposal._meta.get_field(key),
-                summary[key])
+    return {
+        'summary': _read_cayuse_rows('custom/summary?id=%s' % proposal_id)[0],
+        'key_personnel': _read_cayuse_rows('view/keypersons?id=%s' % proposal_id),
+        'performance_sites': fetch_cayuse_proposal_performance_sites(proposal_id)}
 
-    return {'principal_investigator': pi_info, 'proposal': summary}
 
+def fetch_cayuse_proposal_performance_sites(proposal_id):
+    """Gets the raw PerformanceSite rows for a proposal from Cayuse"""
 
-def get_cayuse_pi(pi_info, employee_id):
-    """Tries to get the local AwardManager from the info that came from Cayuse.
-    If it doesn't exist in the database, raises an EASMappingException to force
-    the user to create a new mapping with that data.
-    """
-    try:
-        award_manager = AwardManager.objects.get(gwid=employee_id)
-    except AwardManager.DoesNotExist:
-        try:
-            full_name = '%s, %s %s' % (
-                pi_info['last_name'], pi_info['first_name'], pi_info['middle_name'])
-            mapping = EASMapping.objects.get(
-                interface='C',
-                field='principal_investigator',
-                incoming_value=full_name,
-                atp_model=AwardManager.__name__)
-            award_manager = AwardManager.objects.get(pk=mapping.atp_pk)
-        except EASMapping.DoesNotExist:
-            raise EASMappingException(
-                message='Mapping not available',
-                interface='C',
-                field='principal_investigator',
-                incoming_value=full_name,
-                atp_model=AwardManager)
+    # Unfortunately, the performance site endpoint doesn't let us filter on proposal_id
+    # so we have to filter manually
+    return [site for site in _read_cayuse_rows('custom/PerformanceSites')
+            if site['Proposal_id'] == str(proposal_id)]
 
-    return award_manager
 
+def cast_cayuse_summary(summary, resolver):
+    """Splits a Cayuse summary row into PI and Proposal data and parses it into Python values"""
 
-def get_key_personnel(proposal_id):
-    """Gets the KeyPersonnel from Cayuse"""
+    pi_info = cast_cayuse_row(
+        AwardManager,
+        dict((key, value) for key, value in summary.items() if key in AwardManager.CAYUSE_FIELDS),
+        resolver)
+    proposal_data = cast_cayuse_row(Proposal, summary, resolver, exclude=AwardManager.CAYUSE_FIELDS)
 
-    response = _make_cayuse_request('view/keypersons?id=%s' % proposal_id)
+    return {'principal_investigator': pi_info, 'proposal': proposal_data}
 
-    f = StringIO.StringIO(response.content)
-    reader = csv.reader(f, delimiter=',')
 
-    header = reader.next()
+def cast_cayuse_proposal(cayuse_rows, resolver):
+    """Parses the output of fetch_cayuse_proposal into Python values"""
 
-    key_personnel = []
+    cayuse_data = cast_cayuse_summary(cayuse_rows['summary'], resolver)
+    cayuse_data['key_personnel'] = [cast_cayuse_row(KeyPersonnel, person, resolver)
+                                    for person in cayuse_rows['key_personnel']]
+    cayuse_data['performance_sites'] = [cast_cayuse_row(PerformanceSite, site, resolver)
+                                        for site in cayuse_rows['performance_sites']]
 
-    for row in reader:
-        key_personnel.append(dict(zip(header, row)))
+    return cayuse_data
 
-    f.close()
 
-    key_personnel_fields = KeyPersonnel._meta.get_all_field_names()
+def find_unmapped_cayuse_values(cayuse_rows_list):
+    """Dry-runs the import of one or more proposals fetched with fetch_cayuse_proposal.
+    Returns every (field, value) pair that doesn't have an EAS mapping yet, so they can
+    all be reconciled on one screen.
+    """
 
-    for person in key_personnel:
-        for key in person.keys():
-            if key == 'proposal_id':
-                del person[key]
-            elif key in key_personnel_fields:
-                person[key] = cast_field_value(
-                    KeyPersonnel._meta.get_field(key),
-                    person[key])
-            else:
-                del person[key]
+    resolver = EASMappingResolver('C', collect_missing=True)
+    for cayuse_rows in cayuse_rows_list:
+        cayuse_data = cast_cayuse_proposal(cayuse_rows, resolver)
+        get_cayuse_pi(
+            cayuse_data['principal_investigator'],
+            cayuse_data['proposal']['employee_id'],
+            resolver)
 
-    return key_personnel
+    return resolver.missing
 
 
-def get_performance_sites(proposal_id):
-    """Gets the PerformanceSites from Cayuse"""
+def find_unmapped_lotus_values(proposal):
+    """Dry-runs the EAS lookups for a Lotus proposal and returns every value without a mapping"""
 
-    response = _make_cayuse_request('custom/PerformanceSites')
+    resolver = EASMappingResolver('L', collect_missing=True)
+    for lotus_field, fk_field_name in Proposal.LOTUS_FK_LOOKUPS.items():
+        lotus_value = getattr(proposal, lotus_field)
+        if lotus_value:
+            cast_lotus_value(Proposal._meta.get_field(fk_field_name), lotus_value, resolver)
 
-    f = StringIO.StringIO(response.content)
-    reader = csv.reader(f, delimiter=',')
+    return resolver.missing
 
-    header = reader.next()
 
-    performance_sites = []
+def get_cayuse_summary(proposal_id, resolver=None):
+    """Get all the data about a proposal from Cayuse"""
 
-    for row in reader:
-        site = dict(zip(header, row))
-        # Unfortunately, the performance site endpoint doesn't let us filter on proposal_id
-        # so we have to filter manually
-        if site['Proposal_id'] == str(proposal_id):
-            performance_sites.append(site)
+    if resolver is None:
+        resolver = EASMappingResolver('C')
 
-    f.close()
+    return cast_cayuse_summary(_read_cayuse_rows('custom/summary?id=%s' % proposal_id)[0], resolver)
+
+
+def get_cayuse_pi(pi_info, employee_id, resolver=None):
+    """Tries to get the local AwardManager from the info that came from Cayuse.
+    If it doesn't exist in the database, raises an EASMappingException to force
+    the user to create a new mapping with that data.
+    """
+    try:
+        award_manager = AwardManager.objects.get(gwid=employee_id)
+    except AwardManager.DoesNotExist:
+        full_name = '%s, %s %s' % (
+            pi_info['last_name'], pi_info['first_name'], pi_info['middle_name'])
+        if resolver is None:
+            resolver = EASMappingResolver('C')
+        award_manager = resolver.resolve('principal_investigator', full_name, AwardManager)
+
+    return award_manager
+
+
+def get_key_personnel(proposal_id, resolver=None):
+    """Gets the KeyPersonnel from Cayuse"""
+
+    if resolver is None:
+        resolver = EASMappingResolver('C')
+
+    return [cast_cayuse_row(KeyPersonnel, person, resolver)
+            for person in _read_cayuse_rows('view/keypersons?id=%s' % proposal_id)]
 
-    performance_site_fields = PerformanceSite._meta.get_all_field_names()
 
-    for site in performance_sites:
-        for key in site.keys():
-            if key in performance_site_fields:
-                site[key] = cast_field_value(
-                    PerformanceSite._meta.get_field(key),
-                    site[key])
-            else:
-                del site[key]
+def get_performance_sites(proposal_id, resolver=None):
+    """Gets the PerformanceSites from Cayuse"""
+
+    if resolver is None:
+        resolver = EASMappingResolver('C')
 
-    return performance_sites
+    return [cast_cayuse_row(PerformanceSite, site, resolver)
+            for site in fetch_cayuse_proposal_performance_sites(proposal_id)]
 
 
 def get_proposal_statistics_report(from_date, to_date, all_fields=False):
@@ -362,4 +481,106 @@ def get_proposal_statistics_report(from_date, to_date, all_fields=False):
                 entry = [proposal[field] for field in header_fields]
                 proposals.append(entry)
 
-    return header_fields, proposals
\ No newline at end of file
+    return header_fields, proposals
+
+AUDIT_TRAIL_EXPORT_COLUMNS = ['Award', 'Modification', 'Workflow Step', 'Date Created', 'Date Completed',
+                              'Assigned User']
+
+# Number of ATPAuditTrail rows read from the database at a time during an export
+AUDIT_TRAIL_EXPORT_CHUNK_SIZE = 2000
+
+
+class LocalDatetimeFormatter(object):
+    """Formats aware datetimes in local time as MM/DD/YYYY HH:MM:SS.
+
+    Converting every value with astimezone() and strftime() dominates the cost of a large
+    export, so the UTC offset is looked up once per hour (DST changes on the hour) and the
+    string is built directly.
+    """
+
+    MAX_CACHED_HOURS = 10000
+
+    def __init__(self, tz=None):
+        self.tz = tz or tzlocal()
+        self._offsets = {}
+
+    def format(self, value):
+        if value is None:
+            return None
+
+        hour = value.replace(minute=0, second=0, microsecond=0)
+        offset = self._offsets.get(hour)
+        if offset is None:
+            if len(self._offsets) >= self.MAX_CACHED_HOURS:
+                self._offsets.clear()
+            offset = self._offsets[hour] = hour.astimezone(self.tz).utcoffset()
+
+        local = value + offset
+        return '%02d/%02d/%04d %02d:%02d:%02d' % (
+            local.month, local.day, local.year, local.hour, local.minute, local.second)
+
+
+def iter_audit_trail_chunks(queryset, chunk_size=AUDIT_TRAIL_EXPORT_CHUNK_SIZE):
+    """Yields the export rows for the ATPAuditTrail entries in queryset, a chunk at a time.
+    Each chunk is its own keyset-paginated query, so memory use stays the same however large
+    the trail gets (MySQLdb buffers a whole result set, even with iterator()).
+    """
+
+    formatter = LocalDatetimeFormatter()
+    rows = queryset.order_by('id').values_list(
+        'id', 'award', 'modification', 'workflow_step', 'date_created', 'date_completed', 'assigned_user')
+
+    last_id = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last_id)[:chunk_size].iterator())
+        if not chunk:
+            return
+
+        last_id = chunk[-1][0]
+        yield [[award, modification, workflow_step, formatter.format(date_created),
+                formatter.format(date_completed), assigned_user]
+               for _, award, modification, workflow_step, date_created, date_completed, assigned_user in chunk]
+
+        if len(chunk) < chunk_size:
+            return
+
+
+class _EchoBuffer(object):
+    """A file-like object that hands back whatever is written to it, so csv.writer can be
+    used to build lines for a streaming response
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_audit_trail_csv(chunks):
+    """Yields the audit trail export as CSV text, one chunk of rows at a time"""
+
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(AUDIT_TRAIL_EXPORT_COLUMNS)
+    for chunk in chunks:
+        yield ''.join(writer.writerow([value.encode('utf-8') if isinstance(value, unicode) else value
+                                       for value in row]) for row in chunk)
+
+
+def write_audit_trail_xlsx(chunks, output):
+    """Writes the audit trail export to output as an .xlsx workbook. openpyxl's write-only
+    mode spools rows to a temporary file instead of keeping them in memory.
+    """
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title='ATP')
+
+    header = []
+    for column in AUDIT_TRAIL_EXPORT_COLUMNS:
+        cell = WriteOnlyCell(worksheet, value=column)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    worksheet.append(header)
+
+    for chunk in chunks:
+        for row in chunk:
+            worksheet.append(row)
+
+    workbook.save(output)
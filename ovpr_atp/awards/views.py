@@ -6,18 +6,25 @@
 
 import re
 from django.shortcuts import render, redirect, get_object_or_404, resolve_url
-from django.http import Http404, HttpResponseRedirect, HttpResponse
+from django.http import Http404, HttpResponseRedirect, HttpResponse, StreamingHttpResponse
 from django.core import management
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
 from django.db import transaction
 from django.db.models import Q
 from django.apps import apps
 from django.views.generic import TemplateView
 from django.views.generic.detail import DetailView
-from django.views.generic.edit import FormView, UpdateView, CreateView, DeleteView
-from django.utils import timezone
+from django.views.generic.edit import FormView, UpdateView, CreateView, DeleteView, BaseUpdateView
+from django.core.exceptions import NON_FIELD_ERRORS, PermissionDenied
+from django.utils import formats, timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.datastructures import MultiValueDict
+from django.utils.encoding import force_text
+from django.views.decorators.http import condition
 from django.contrib.auth import (
     REDIRECT_FIELD_NAME, get_user_model, logout as auth_logout, update_session_auth_hash,
 )
@@ -25,56 +32,31 @@ from django.utils.translation import LANGUAGE_SESSION_KEY
 from crispy_forms.utils import render_crispy_form
 import copy
 import csv
-from datetime import date, datetime
+from datetime import date, datetime, time, timedelta
+from functools import wraps
 import json
+import reversion
 from StringIO import StringIO
-import xlwt
-from dateutil.tz import tzutc, tzlocal
+import tempfile
+from wsgiref.util import FileWrapper
 
 from .forms import AwardForm, EditAwardForm, ProposalIntakeStandaloneForm, ProposalIntakeForm, ProposalForm, \
     KeyPersonnelForm, PerformanceSiteForm, AwardAcceptanceForm, AwardNegotiationForm, AwardSetupForm, PTANumberForm, \
     SubawardListForm, SubawardForm, AwardManagementForm, PriorApprovalForm, ReportSubmissionForm, AwardCloseoutForm, \
-    FinalReportForm, EASMappingForm, ProposalStatisticsReportForm, AwardREAssaignementForm
+    FinalReportForm, EASMappingForm, EASMappingReconciliationForm, ProposalStatisticsReportForm, AwardREAssaignementForm, \
+    AuditTrailExportForm
 from .models import ProposalIntake, Proposal, KeyPersonnel, PerformanceSite, Award, AwardAcceptance, AwardNegotiation,\
     AwardSetup, PTANumber, Subaward, AwardManagement, PriorApproval, ReportSubmission, AwardCloseout, FinalReport, \
-    EASMapping, EASMappingException, AwardModification, NegotiationStatus, ATPAuditTrail
-from .utils import get_cayuse_submissions, get_cayuse_summary, get_cayuse_pi, get_key_personnel, get_performance_sites, \
-    cast_lotus_value, get_proposal_statistics_report, get_cayuse_submissions_from_proposals_table
+    EASMapping, EASMappingException, AwardModification, NegotiationStatus, ATPAuditTrail, BackgroundJob, \
+    SectionVersionConflict, AutocompleteMixin, eas_mapping_index, feed_changes
+from .utils import get_cayuse_submissions, get_cayuse_pi, cast_lotus_value, get_proposal_statistics_report, \
+    get_cayuse_submissions_from_proposals_table, EASMappingResolver, fetch_cayuse_proposal, cast_cayuse_proposal, \
+    find_unmapped_cayuse_values, find_unmapped_lotus_values, iter_audit_trail_chunks, iter_audit_trail_csv, \
+    write_audit_trail_xlsx
+from .jobs import start_job
 from core.utils import make_eas_request
 
 
-@login_required
-def audittrail_activity_history(request):
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = 'attachment; filename="audit_trail_history.xls"'
-
-    wb = xlwt.Workbook(encoding='utf-8')
-    ws = wb.add_sheet('ATP')
-
-    row_num = 0
-
-    font_style = xlwt.XFStyle()
-    font_style.font.bold = True
-
-    columns = ['Award', 'Modification', 'Workflow Step', 'Date Created', 'Date Completed', 'Assigned User', ]
-
-    for col_num in range(len(columns)):
-        ws.write(row_num, col_num, columns[col_num], font_style)
-
-    font_style = xlwt.XFStyle()
-
-    rows = ATPAuditTrail.objects.all().values_list('award', 'modification', 'workflow_step', 'date_created', 'date_completed', 'assigned_user')
-    for row in rows:
-        row_num += 1
-        for col_num in range(len(row)):
-            if type(row[col_num]) == datetime:
-                ws.write(row_num, col_num, row[col_num].astimezone(tzlocal()).strftime('%m/%d/%Y %H:%M:%S'), font_style)
-            else:
-                ws.write(row_num, col_num, row[col_num], font_style)
-
-    wb.save(response)
-    return response
-
 def required(wrapping_functions,patterns_rslt):
     if not hasattr(wrapping_functions,'__iter__'):
         wrapping_functions = (wrapping_functions,)
@@ -205,7 +187,26 @@ class FullAwardSearchView(TemplateView):
         return context
 
 
+def revalidated_feed(view):
+    """Lets browsers keep a JSON feed, as long as they check with us before using it again.
+    They're answered with a 304 if nothing in the feeds has changed since, without running the view.
+    """
+
+    conditional_view = condition(etag_func=lambda request, *args, **kwargs: feed_changes.get_etag(),
+                                 last_modified_func=lambda request, *args, **kwargs: feed_changes.get())(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        # Also stops DisableClientSideCachingMiddleware from marking the response never-cache
+        patch_cache_control(response, private=True, no_cache=True, max_age=0)
+        return response
+
+    return wrapper
+
+
 @login_required
+@revalidated_feed
 def get_awards_ajax(request):
     """Provide homepage award data as JSON to improve render time"""
 
@@ -381,6 +382,7 @@ def get_search_filters_query(request, callingSection):
     return query
 
 @login_required
+@revalidated_feed
 def get_search_awards_ajax(request):
     """Provide full search award data as JSON to improve render time"""
     query = get_search_filters_query(request, 'award')
@@ -460,6 +462,7 @@ def get_search_awards_ajax(request):
     return HttpResponse(json_data, content_type="application/json")
 
 @login_required
+@revalidated_feed
 def get_search_subawards_ajax(request):
     """Provide full search subaward data as JSON to improve render time"""
     
@@ -496,6 +499,7 @@ def get_search_subawards_ajax(request):
     return HttpResponse(json_data, content_type="application/json")
 
 @login_required
+@revalidated_feed
 def get_search_pta_numbers_ajax(request):
     """Provide full search pta number data as JSON to improve render time"""
 
@@ -562,6 +566,33 @@ def get_search_filter_ajax(request, field_name):
     return HttpResponse(unicode(result))
 
 @login_required
+def get_autocomplete_options(request, model_name):
+    """Returns a page of the objects matching an autocomplete widget's search term,
+    as JSON in the format Select2 expects
+    """
+
+    try:
+        model = apps.get_model('awards', model_name)
+    except LookupError:
+        raise Http404
+    if not issubclass(model, AutocompleteMixin):
+        raise Http404
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    objects, more = model.autocomplete(request.GET.get('term', ''), page)
+
+    response = {
+        'results': [{'id': obj.pk, 'text': unicode(obj)} for obj in objects],
+        'more': more,
+    }
+    return HttpResponse(json.dumps(response), content_type="application/json")
+
+@login_required
+@revalidated_feed
 def get_lotus_proposals_ajax(request, award_pk):
     """Provide Lotus proposals as JSON to improve render time"""
 
@@ -673,11 +704,42 @@ def pick_proposal(request, award_pk, lotus=False):
 
 @login_required
 def get_cayuse_proposals(request):
-    proposals = get_cayuse_submissions()
-    for proposal in proposals:
-        prop = Proposal(**proposal)
-        prop.save()
-    return render(request, 'awards/import_cayuse_proposals.html', {})
+    """Starts the Cayuse sync in the background (or joins the one already running)
+    and renders a page that tracks its progress.
+    """
+
+    job = start_job(BackgroundJob.CAYUSE_SYNC, request.user)
+    return render(request, 'awards/import_cayuse_proposals.html', {'job': job})
+
+
+@login_required
+def get_background_job_status(request, job_pk):
+    """Returns the progress of a background job as JSON, for the page to poll"""
+
+    job = get_object_or_404(BackgroundJob, pk=job_pk)
+
+    return HttpResponse(json.dumps(job.get_progress()), content_type='application/json')
+
+
+# Session key and lifetime of the Cayuse data kept while the user reconciles EAS mappings
+CAYUSE_PROPOSAL_SESSION_KEY = 'cayuse_proposal'
+CAYUSE_PROPOSAL_REUSE_TIME = timedelta(minutes=15)
+
+
+def get_stashed_cayuse_proposal(request, proposal_id):
+    """Gets the Cayuse data stashed for this proposal when the user was sent to reconcile
+    EAS mappings, unless it's too old to trust. Returns None if it has to be fetched again.
+    """
+
+    stashed = request.session.get(CAYUSE_PROPOSAL_SESSION_KEY)
+    if not stashed or stashed['proposal_id'] != proposal_id:
+        return None
+
+    fetched = parse_datetime(stashed['fetched'])
+    if fetched is None or timezone.now() - fetched > CAYUSE_PROPOSAL_REUSE_TIME:
+        return None
+
+    return stashed
 
 
 @login_required
@@ -701,25 +763,34 @@ def import_proposal(request, proposal_id, award_pk):
         else:
             existing_proposal.delete()
 
-    # Import the proposal from Cayuse
-    try:
-        cayuse_data = get_cayuse_summary(proposal_id)
-        pi = get_cayuse_pi(
-            cayuse_data['principal_investigator'],
-            cayuse_data['proposal']['employee_id'])
-
-    # Ask the user to manually reconcile data to an EAS-approved value if ATP 
-    # doesn't know how to already
-    except EASMappingException as e:
-        eas_mapping_url = reverse(
-            'create_eas_mapping',
-            kwargs={
-                'interface': e.interface,
-                'field': e.field,
-                'incoming_value': e.incoming_value,
-                'atp_model': e.atp_model.__name__})
+    # Import the proposal from Cayuse, reusing the data we already fetched if the
+    # user was just sent to reconcile EAS mappings for it
+    stashed = get_stashed_cayuse_proposal(request, proposal_id)
+    if stashed is None:
+        stashed = {
+            'proposal_id': proposal_id,
+            'fetched': timezone.now().isoformat(),
+            'rows': fetch_cayuse_proposal(proposal_id)}
+    request.session.pop(CAYUSE_PROPOSAL_SESSION_KEY, None)
+    cayuse_rows = stashed['rows']
+
+    # Ask the user to manually reconcile data to an EAS-approved value if ATP
+    # doesn't know how to already (all of the unknown values at once)
+    unmapped_values = find_unmapped_cayuse_values([cayuse_rows])
+    if unmapped_values:
+        # Only one proposal's data is kept, so starting another import drops it
+        request.session[CAYUSE_PROPOSAL_SESSION_KEY] = stashed
+        request.session['unmapped_values'] = unmapped_values
+        request.session['award_url'] = award.get_absolute_url()
         request.session['import_url'] = request.path
-        return HttpResponseRedirect(eas_mapping_url)
+        return redirect('reconcile_eas_mappings')
+
+    resolver = EASMappingResolver('C')
+    cayuse_data = cast_cayuse_proposal(cayuse_rows, resolver)
+    pi = get_cayuse_pi(
+        cayuse_data['principal_investigator'],
+        cayuse_data['proposal']['employee_id'],
+        resolver)
 
     # Create the proposal
     proposal = Proposal.objects.create(
@@ -731,13 +802,9 @@ def import_proposal(request, proposal_id, award_pk):
     [setattr(pi, key, value) for key, value in cayuse_data['principal_investigator'].items()]
     pi.save()
 
-    # Fetch and create KeyPersonnel
-    key_personnel = get_key_personnel(proposal_id)
-    [KeyPersonnel.objects.create(proposal=proposal, **person) for person in key_personnel]
-
-    # Fetch and create PerformanceSites
-    performance_sites = get_performance_sites(proposal_id)
-    [PerformanceSite.objects.create(proposal=proposal, **site) for site in performance_sites]
+    # Create KeyPersonnel and PerformanceSites
+    [KeyPersonnel.objects.create(proposal=proposal, **person) for person in cayuse_data['key_personnel']]
+    [PerformanceSite.objects.create(proposal=proposal, **site) for site in cayuse_data['performance_sites']]
 
     return redirect(award)
 
@@ -760,7 +827,16 @@ def import_lotus_proposal(request, lotus_id, award_pk):
             need to associate it with another award, contact an administrator." % proposal)
         return redirect(proposal.award)
 
+    # Ask the user to reconcile every Lotus Notes value without an EAS mapping at once
+    unmapped_values = find_unmapped_lotus_values(proposal)
+    if unmapped_values:
+        request.session['unmapped_values'] = unmapped_values
+        request.session['award_url'] = award.get_absolute_url()
+        request.session['import_url'] = request.path
+        return redirect('reconcile_eas_mappings')
+
     # Associate Lotus Notes values to EAS-approved values (similar to process above)
+    resolver = EASMappingResolver('L')
     for lotus_field, fk_field_name in Proposal.LOTUS_FK_LOOKUPS.items():
         fk_field = Proposal._meta.get_field(fk_field_name)
         lotus_value = getattr(proposal, lotus_field)
@@ -768,20 +844,7 @@ def import_lotus_proposal(request, lotus_id, award_pk):
         if not lotus_value:
             continue
 
-        try:
-            eas_value = cast_lotus_value(fk_field, lotus_value)
-            setattr(proposal, fk_field_name, eas_value)
-        except EASMappingException as e:
-            eas_mapping_url = reverse(
-                'create_eas_mapping',
-                kwargs={
-                    'interface': e.interface,
-                    'field': e.field,
-                    'incoming_value': e.incoming_value,
-                    'atp_model': e.atp_model.__name__})
-            request.session['award_url'] = award.get_absolute_url()
-            request.session['import_url'] = request.path
-            return HttpResponseRedirect(eas_mapping_url)
+        setattr(proposal, fk_field_name, cast_lotus_value(fk_field, lotus_value, resolver))
 
     proposal.award = award
     proposal.save()
@@ -789,6 +852,53 @@ def import_lotus_proposal(request, lotus_id, award_pk):
     return redirect(award)
 
 
+@login_required
+def reconcile_eas_mappings(request):
+    """Renders the page that allows users to map all of the values an import didn't
+    recognize in one go, then resumes the import.
+    """
+
+    import_url = request.session.get('import_url')
+    if not import_url:
+        return redirect('home')
+
+    # Skip anything that was mapped in the meantime (if the user clicked the back button mid-import)
+    unmapped_values = [
+        unmapped_value for unmapped_value in request.session.get('unmapped_values', [])
+        if eas_mapping_index.get_atp_pk(
+            unmapped_value['interface'],
+            unmapped_value['field'],
+            unmapped_value['incoming_value'],
+            unmapped_value['atp_model']) is None]
+
+    if not unmapped_values:
+        request.session.pop('unmapped_values', None)
+        return HttpResponseRedirect(request.session.pop('import_url'))
+
+    if request.method == 'POST':
+        # Create the new EAS mappings and re-try the import
+        form = EASMappingReconciliationForm(unmapped_values, request.POST)
+        if form.is_valid():
+            with transaction.atomic():
+                for unmapped_value, atp_value in form.get_mappings():
+                    EASMapping.objects.get_or_create(
+                        interface=unmapped_value['interface'],
+                        field=unmapped_value['field'],
+                        incoming_value=unmapped_value['incoming_value'],
+                        atp_model=unmapped_value['atp_model'],
+                        defaults={'atp_pk': atp_value.pk})
+
+            request.session.pop('unmapped_values', None)
+            return HttpResponseRedirect(request.session.pop('import_url'))
+    else:
+        form = EASMappingReconciliationForm(unmapped_values)
+
+    return render(request, 'awards/reconcile_eas_mappings.html', {
+        'form': form,
+        'award_url': request.session.get('award_url', None)
+    })
+
+
 @login_required
 def create_eas_mapping(request, interface, field, incoming_value, atp_model):
     """Renders the page that allows users to create a mapping between data that came
@@ -801,13 +911,13 @@ def create_eas_mapping(request, interface, field, incoming_value, atp_model):
         # Create a new EAS mapping and re-try the import
         form = EASMappingForm(atp_model, request.POST)
         if form.is_valid():
-            mapping = EASMapping(
+            # A mapping is unique per value, so a repeated submit keeps the first one
+            EASMapping.objects.get_or_create(
                 interface=interface,
                 field=field,
                 incoming_value=incoming_value,
-                atp_model=atp_model.__name__)
-            mapping.atp_pk = form.cleaned_data['atp_value'].pk
-            mapping.save()
+                atp_model=atp_model.__name__,
+                defaults={'atp_pk': form.cleaned_data['atp_value'].pk})
 
             import_url = request.session.pop('import_url')
             return HttpResponseRedirect(import_url)
@@ -900,6 +1010,8 @@ def create_modification(request, award_pk):
 
                 new_section.save()
 
+            award.increment_modification_count()
+
         # Reset the award's status to Award Intake
         try:
             setup_object = AwardSetup.objects.get(award=award)
@@ -1017,13 +1129,38 @@ class EditAwardView(UpdateView):
     pk_url_kwarg = 'award_pk'
 
 
-class AwardDetailView(DetailView):
+class AwardGraphMixin(object):
+    """Fetches the award in the URL once per request, so the other mixins, the view and the
+    templates all share it
+    """
+
+    def get_award(self):
+        """Gets the award, with the GRAPH_SELECT_RELATED relations"""
+
+        if getattr(self, '_award', None) is None:
+            self._award = get_object_or_404(
+                Award.objects.select_related(*Award.GRAPH_SELECT_RELATED),
+                pk=self.kwargs['award_pk'])
+        return self._award
+
+    def get_award_graph(self):
+        """Gets the award with everything its page shows loaded"""
+
+        award = self.get_award()
+        award.load_graph()
+        return award
+
+
+class AwardDetailView(AwardGraphMixin, DetailView):
     """Read-only view of all data for an individual award"""
 
     model = Award
     pk_url_kwarg = 'award_pk'
     template_name = 'awards/award_base.html'
 
+    def get_object(self, queryset=None):
+        return self.get_award_graph()
+
     def get_context_data(self, **kwargs):
         context = super(AwardDetailView, self).get_context_data(**kwargs)
         context['editable_sections'] = context['award'].get_editable_sections()
@@ -1031,24 +1168,26 @@ class AwardDetailView(DetailView):
         award_modification_flag = False
         if award.send_to_modification or award.common_modification:
             award_modification_flag = True
-        section_object = AwardModification.objects.all().filter(award=award).order_by('-id')
+        section_object = award.get_modifications()
         if section_object:
             section_object = section_object[0]
         context['modification_obj'] = section_object
         context['award_modification_flag'] = award_modification_flag
 
-        pta_instance = PTANumber.objects.all().filter(award_id=context['award'].id, is_edited=True).order_by('pta_number_updated')
+        pta_instance = sorted([pta_number for pta_number in award.ptanumber_set.all() if pta_number.is_edited],
+                              key=lambda pta_number: pta_number.pta_number_updated)
         if pta_instance:
             pta_instance = pta_instance[0]
         context['pta_nuber_instance'] = pta_instance
+        context['latest_revisions'] = award.get_latest_revisions()
         return context
 
 
-class CheckEditPermissionsMixin(object):
+class CheckEditPermissionsMixin(AwardGraphMixin):
     """Checks to make sure the current user can edit the requested section"""
 
     def dispatch(self, request, *args, **kwargs):
-        award = get_object_or_404(Award, pk=self.kwargs['award_pk'])
+        award = self.get_award()
         redirect_url = HttpResponseRedirect(award.get_absolute_url())
 
         # Make sure that the requested PTA # is associated with this award
@@ -1091,14 +1230,15 @@ class CheckEditPermissionsMixin(object):
             **kwargs)
 
 
-class AwardContextMixin(object):
+class AwardContextMixin(AwardGraphMixin):
     """Adds extra context data to a response"""
 
     def get_context_data(self, **kwargs):
         context = super(AwardContextMixin, self).get_context_data(**kwargs)
-        award = Award.objects.get(pk=self.kwargs['award_pk'])
+        award = self.get_award_graph()
         context['award'] = award
         context['editable_sections'] = award.get_editable_sections()
+        context['latest_revisions'] = award.get_latest_revisions()
 
         if hasattr(self, 'disable_autosave'):
             context['disable_autosave'] = self.disable_autosave
@@ -1117,9 +1257,7 @@ class MoveToNextStepMixin(object):
         super(MoveToNextStepMixin, self).form_valid(form)
 
         award = Award.objects.get(pk=self.kwargs['award_pk'])
-        count_value = AwardAcceptance.objects.filter(award=award).count()
-        modification = 'Modification #%s' % (count_value - 1)
-        origional_text = 'Original Award'
+        modification = award.get_modification_label(modification_only=True)
         setup_workflow = 'AwardSetup'
         modification_workflow = 'AwardModification'
         if form.cleaned_data.get('do_not_send_to_next_step'):
@@ -1130,10 +1268,7 @@ class MoveToNextStepMixin(object):
                     setup_object = AwardSetup.objects.get(award=self.award)
                     setup_object.setup_completion_date = timezone.localtime(timezone.now())
                     setup_object.save()
-                    if count_value < 2:
-                        award.record_current_state_to_atptrail(origional_text, setup_workflow)
-                    else:
-                        award.record_current_state_to_atptrail(modification, setup_workflow)
+                    award.record_current_state_to_atptrail(award.get_modification_label(), setup_workflow)
                 except:
                     pass
             if all([award.award_dual_modification, award.common_modification]):
@@ -1186,9 +1321,8 @@ class MoveToNextStepMixin(object):
                              user.get_full_name() for user in award.get_users_for_active_sections()])))
                 return HttpResponseRedirect(award.get_absolute_url())
             elif self.model.__name__ == 'AwardAcceptance':
-                atp_query = AwardAcceptance.objects.filter(award_id=self.award.id)
                 if not form.cleaned_data.get('pta_modification') and not form.cleaned_data.get('move_to_multiple_steps')\
-                        and atp_query.count() > 1:
+                        and award.modification_count > 0:
                     award.move_setup_or_modification_step(setup_flag=True)
                     messages.info(
                         self.request,
@@ -1250,7 +1384,178 @@ class MoveToNextStepMixin(object):
 
 
 class AutosaveFormMixin(object):
-    """Handles AJAX responses for autosave requests"""
+    """Handles AJAX responses for autosave requests.
+
+    An autosave that lists its changed fields in AUTOSAVE_FIELDS_PARAM only needs to post
+    those. The rest of the form is filled in from the object, only the changed columns are
+    saved, and the response is JSON (errors and normalized values by field, and the
+    object's version) instead of the re-rendered form.
+
+    Saves that post the VERSION_PARAM the page was rendered with only save over that
+    version. If someone else saved the object in the meantime, nothing is saved: an autosave
+    gets back the object's current values instead, and a full save shows the form again
+    with an error.
+    """
+
+    AUTOSAVE_FIELDS_PARAM = 'autosave_fields'
+    VERSION_PARAM = 'version'
+    VERSION_CONFLICT_MESSAGE = 'Someone else saved changes to this section while you were editing it. ' \
+                               'Check the fields below and save again to keep your changes.'
+
+    def get_autosave_fields(self):
+        """Gets the names of the fields a JSON autosave changed, or None for any other request"""
+
+        if self.request.method != 'POST' or not self.request.is_ajax():
+            return None
+
+        fields = self.request.POST.get(self.AUTOSAVE_FIELDS_PARAM)
+        if fields is None or not isinstance(self, BaseUpdateView):
+            return None
+
+        return [name for name in fields.split(',') if name]
+
+    def get_expected_version(self):
+        """Gets the version of the object that a save started from, if it posted one"""
+
+        if self.request.method != 'POST' or not isinstance(self, BaseUpdateView):
+            return None
+
+        try:
+            return int(self.request.POST[self.VERSION_PARAM])
+        except (KeyError, ValueError):
+            return None
+
+    def get_autosave_changes(self):
+        """Gets any other values an autosave sets on the object, by field name"""
+
+        return {}
+
+    def get_form_kwargs(self):
+        kwargs = super(AutosaveFormMixin, self).get_form_kwargs()
+
+        autosave_fields = self.get_autosave_fields()
+        if autosave_fields is not None:
+            kwargs['data'] = self.get_autosave_data(kwargs, autosave_fields)
+
+        return kwargs
+
+    def get_autosave_data(self, form_kwargs, autosave_fields):
+        """Gets the posted values of the changed fields, and the object's values for the rest"""
+
+        unbound_form = self.get_form_class()(**dict(form_kwargs, data=None, files=None))
+
+        data = MultiValueDict()
+        for name in unbound_form.fields:
+            if name in autosave_fields:
+                # A changed field that isn't posted (like an unticked checkbox) was cleared
+                data.setlist(name, self.request.POST.getlist(name))
+            else:
+                value = unbound_form[name].value()
+                data.setlist(name, list(value) if isinstance(value, (list, tuple)) else [value])
+
+        return data
+
+    def get_form(self, form_class=None):
+        form = super(AutosaveFormMixin, self).get_form(form_class)
+
+        expected_version = self.get_expected_version()
+        if expected_version is not None and hasattr(form.instance, 'expected_version'):
+            form.instance.expected_version = expected_version
+
+        return form
+
+    def post(self, request, *args, **kwargs):
+        autosave_fields = self.get_autosave_fields()
+        if autosave_fields is None:
+            try:
+                return super(AutosaveFormMixin, self).post(request, *args, **kwargs)
+            except SectionVersionConflict:
+                return self.version_conflict()
+
+        self.object = self.get_object()
+        form = self.get_form(self.get_form_class())
+        return self.autosave(form, autosave_fields)
+
+    def version_conflict(self):
+        """Shows the posted form again over the object's current version, with an error"""
+
+        self.object = self.get_object()
+        form = self.get_form(self.get_form_class())
+        form.is_valid()
+        form.add_error(None, self.VERSION_CONFLICT_MESSAGE)
+        return self.form_invalid(form)
+
+    def autosave(self, form, autosave_fields):
+        """Saves the changed fields if they're valid, and describes the outcome as JSON.
+        Errors in fields that weren't changed don't stop the save, since they're already saved.
+        """
+
+        form.is_valid()
+        errors = dict((name, [error['message'] for error in form.errors[name].get_json_data()])
+                      for name in autosave_fields + [NON_FIELD_ERRORS] if name in form.errors)
+
+        saved = not errors
+        conflict = False
+        if saved:
+            instance = form.instance
+            model_fields = set(field.name for field in instance._meta.fields)
+            update_fields = set(name for name in autosave_fields if name in model_fields)
+            # The section forms mark the object as edited in clean()
+            if form.cleaned_data.get('is_edited') and 'is_edited' in model_fields:
+                update_fields.add('is_edited')
+            for name, value in self.get_autosave_changes().items():
+                setattr(instance, name, value)
+                update_fields.add(name)
+            if update_fields:
+                try:
+                    instance.save(update_fields=list(update_fields))
+                except SectionVersionConflict:
+                    saved = False
+                    conflict = True
+            if saved:
+                self.autosave_saved(form, autosave_fields)
+
+        if conflict:
+            # Send back what's saved now, so the user can see what they'd be replacing
+            self.object = self.get_object()
+            form_kwargs = super(AutosaveFormMixin, self).get_form_kwargs()
+            form = self.get_form_class()(**dict(form_kwargs, data=None, files=None))
+            values = dict((name, self.format_autosave_value(form.fields[name], form[name].value()))
+                          for name in autosave_fields if name in form.fields)
+        else:
+            values = dict((name, self.get_autosave_value(form, name)) for name in autosave_fields
+                          if name in form.fields and name in form.cleaned_data)
+
+        response = {
+            'saved': saved,
+            'conflict': conflict,
+            'errors': errors,
+            'values': values,
+            'version': getattr(self.object, 'version', None),
+        }
+        return HttpResponse(json.dumps(response), content_type='application/json')
+
+    def autosave_saved(self, form, autosave_fields):
+        """Called after an autosave is saved, since form_valid isn't. Views whose form_valid
+        does more than save the object should do the same for the autosaved fields here.
+        """
+
+        pass
+
+    def get_autosave_value(self, form, name):
+        """Gets a field's cleaned value the way its widget would show it"""
+
+        field = form.fields[name]
+        return self.format_autosave_value(field, field.prepare_value(form.cleaned_data[name]))
+
+    def format_autosave_value(self, field, value):
+        """Formats a field's prepared value for the JSON response"""
+
+        if isinstance(value, (list, tuple)):
+            return [force_text(item) for item in value]
+        if value is None or isinstance(value, bool):
+            return value
+        return force_text(formats.localize_input(value, getattr(field.widget, 'format', None)))
 
     def render_to_ajax_response(self, context, **response_kwargs):
         form_html = render_crispy_form(context['form'], context=context)
@@ -1349,9 +1654,10 @@ class EditSectionView(
 
     def get_object(self):
 
-        pk = self.kwargs.get(self.pk_url_kwarg, None)
+        # The section is fetched on its own, so changes the form makes to it don't show up
+        # elsewhere on the page
         try:
-            award = Award.objects.get(pk=pk)
+            award = self.get_award()
             if self.model in [AwardAcceptance, AwardNegotiation]:
                 section_object = self.model.objects.get(
                     award=award,
@@ -1633,37 +1939,10 @@ class AwardNegotiationView(EditSectionView):
 
         super(AwardNegotiationView, self).form_valid(form)
 
-        # Mark the award as completed if the user chose that option
         award = Award.objects.get(pk=self.kwargs['award_pk'])
+        self.record_negotiation_status(award, form.cleaned_data)
 
-        if award and form.cleaned_data:
-            negotiation_status = form.cleaned_data['negotiation_status']
-            negotiation_status_user = self.request.user.get_full_name()
-            negotiation_notes = form.cleaned_data['negotiation_notes']
-            existing_negotiation_object = NegotiationStatus.objects.filter(award=award).order_by('-id')
-            status_dict = NegotiationStatus.NEGOTIATION_CHOICES_DICT
-            if negotiation_status:
-                if not existing_negotiation_object:
-                    if negotiation_status in status_dict:
-                        negotiation_status = str(status_dict[negotiation_status])
-                    negotiation_object = NegotiationStatus.objects.create(negotiation_status=negotiation_status,
-                                                                          negotiation_notes=negotiation_notes,
-                                                                          award=award,
-                                                                          negotiation_status_changed_user=negotiation_status_user,
-                                                                          negotiation_status_date=timezone.localtime(timezone.now()))
-                    negotiation_object.save()
-                elif existing_negotiation_object:
-                    if existing_negotiation_object[0].negotiation_status != status_dict[negotiation_status]:
-                        if negotiation_status in status_dict:
-                            negotiation_status = str(status_dict[negotiation_status])
-                        negotiation_object = NegotiationStatus.objects.create(negotiation_status=negotiation_status,
-                                                                              negotiation_notes=negotiation_notes,
-                                                                              award=award,
-                                                                              negotiation_status_changed_user=negotiation_status_user,
-                                                                              negotiation_status_date=timezone.localtime(
-                                                                                  timezone.now()))
-                        negotiation_object.save()
-
+        # Mark the award as completed if the user chose that option
         if form.cleaned_data['close_award']:
             award.status = award.END_STATUS
             award.save()
@@ -1684,6 +1963,31 @@ class AwardNegotiationView(EditSectionView):
                 pass
         return HttpResponseRedirect(award.get_absolute_url())
 
+    def autosave_saved(self, form, autosave_fields):
+        if 'negotiation_status' in autosave_fields or 'negotiation_notes' in autosave_fields:
+            self.record_negotiation_status(Award.objects.get(pk=self.kwargs['award_pk']), form.cleaned_data)
+
+    def record_negotiation_status(self, award, cleaned_data):
+        """Adds an entry to the award's negotiation status history if the status changed"""
+
+        negotiation_status = cleaned_data.get('negotiation_status')
+        if not negotiation_status:
+            return
+
+        status_dict = NegotiationStatus.NEGOTIATION_CHOICES_DICT
+        existing_negotiation_object = NegotiationStatus.objects.filter(award=award).order_by('-id').first()
+        if existing_negotiation_object and \
+                existing_negotiation_object.negotiation_status == status_dict[negotiation_status]:
+            return
+
+        if negotiation_status in status_dict:
+            negotiation_status = str(status_dict[negotiation_status])
+        NegotiationStatus.objects.create(negotiation_status=negotiation_status,
+                                         negotiation_notes=cleaned_data.get('negotiation_notes', ''),
+                                         award=award,
+                                         negotiation_status_changed_user=self.request.user.get_full_name(),
+                                         negotiation_status_date=timezone.localtime(timezone.now()))
+
 
 class AwardSetupView(EditSectionView):
     """Edit AwardSetup"""
@@ -1743,6 +2047,10 @@ class EditPTANumberView(
     parent_edit_url = 'edit_award_setup'
     pk_url_kwarg = 'pta_pk'
 
+    def get_autosave_changes(self):
+        # The same values ChildSectionMixin.form_valid sets on a full save
+        return {'is_edited': True, 'pta_number_updated': datetime.now()}
+
 
 class DeletePTANumberView(
         CheckEditPermissionsMixin,
@@ -2027,132 +2335,126 @@ class ProposalStatisticsReportView(FormView):
         return response
 
 
+class AuditTrailExportView(FormView):
+    """Exports the ATP audit trail as a CSV or Excel file, streaming it so the whole trail
+    never has to be held in memory
+    """
+
+    form_class = AuditTrailExportForm
+    template_name = 'awards/audit_trail_export.html'
+
+    def get_audit_trail(self, form):
+        """Gets the audit trail entries matching the form's filters"""
+
+        audit_trail = ATPAuditTrail.objects.all()
+        current_timezone = timezone.get_current_timezone()
+
+        from_date = form.cleaned_data['from_date']
+        if from_date:
+            audit_trail = audit_trail.filter(
+                date_created__gte=timezone.make_aware(datetime.combine(from_date, time.min), current_timezone))
+
+        to_date = form.cleaned_data['to_date']
+        if to_date:
+            audit_trail = audit_trail.filter(
+                date_created__lt=timezone.make_aware(
+                    datetime.combine(to_date + timedelta(days=1), time.min), current_timezone))
+
+        if form.cleaned_data['award']:
+            audit_trail = audit_trail.filter(award_id=form.cleaned_data['award'])
+
+        return audit_trail
+
+    def form_valid(self, form):
+        """If the submitted form is valid, stream the matching audit trail entries"""
+
+        chunks = iter_audit_trail_chunks(self.get_audit_trail(form))
+
+        if form.cleaned_data['file_format'] == 'csv':
+            response = StreamingHttpResponse(iter_audit_trail_csv(chunks), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="audit_trail_history.csv"'
+            return response
+
+        # An .xlsx file is a zip archive, which can't be written out until it's complete, so
+        # build it in a temporary file and stream that
+        output = tempfile.TemporaryFile()
+        write_audit_trail_xlsx(chunks, output)
+        content_length = output.tell()
+        output.seek(0)
+
+        response = StreamingHttpResponse(
+            FileWrapper(output),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response['Content-Disposition'] = 'attachment; filename="audit_trail_history.xlsx"'
+        response['Content-Length'] = content_length
+        return response
+
+
+def check_reassignment_permission(user):
+    """Reassignment is an admin tool, so only staff can see or move other users' assignments"""
+
+    if not user.is_staff:
+        raise PermissionDenied
+
+
 class AwardREAssaignmentView(FormView):
     """Grab all the awards from the atp awards table and re-assign to a selected user"""
 
     form_class = AwardREAssaignementForm
     template_name = 'awards/award_reassignment.html'
 
+    def dispatch(self, request, *args, **kwargs):
+        check_reassignment_permission(request.user)
+        return super(AwardREAssaignmentView, self).dispatch(request, *args, **kwargs)
+
     def get_success_url(self):
         return reverse('award_re_assignment')
 
-    def get_department_verified(self, awards, user_dept):
-        assigns = []
-        for assignment in awards:
-            if assignment.proposal_set.get_queryset():
-                propsal = assignment.proposal_set.get_queryset()[0]
-                try:
-                    if propsal.department_name == None:
-                        assigns.append(assignment)
-                    elif propsal.department_name.name == user_dept:
-                        assigns.append(assignment)
-                except:
-                    pass
-
-        return assigns
-
     def form_valid(self, form):
-        atp_user = form.cleaned_data.get('atp_user')
-        assignment_user = form.cleaned_data.get('assignment_user')
+        atp_user = int(form.cleaned_data.get('atp_user'))
+        assignment_user = int(form.cleaned_data.get('assignment_user'))
         user_department = form.cleaned_data.get('user_department')
 
-        assignment_user = int(assignment_user)
-        atp_user = int(atp_user)
-        awards = Award.objects.all().filter(Q(Q(award_acceptance_user_id=atp_user) | Q(award_closeout_user_id=atp_user) |
-                                             Q(award_management_user_id=atp_user) |
-                                             Q(award_modification_user_id=atp_user) | Q(subaward_user_id=atp_user) |
-                                             Q(award_negotiation_user_id=atp_user) | Q(award_setup_user_id=atp_user)) &
-                                            Q(status__lt=6))
-        if all([user_department, assignment_user, atp_user]):
-            assigns = self.get_department_verified(awards, str(user_department))
-        else:
-            assigns = awards
-        for award in assigns:
-            if award.award_acceptance_user_id == atp_user:
-                award.award_acceptance_user_id = assignment_user
+        award_ids = Award.reassign(atp_user, assignment_user, user_department or None)
 
-            if award.award_closeout_user_id == atp_user:
-                award.award_closeout_user_id = assignment_user
+        if award_ids:
+            # The UPDATEs bypass save(), so record the new assignments in one revision ourselves
+            reversion.default_revision_manager.save_revision(
+                list(Award.objects.filter(id__in=award_ids)),
+                user=self.request.user,
+                comment='Reassigned %s award(s) from user #%s to user #%s' % (
+                    len(award_ids), atp_user, assignment_user))
 
-            if award.award_management_user_id == atp_user:
-                award.award_management_user_id = assignment_user
+            Award.send_reassignment_notification(User.objects.get(pk=assignment_user), award_ids)
 
-            if award.award_modification_user_id == atp_user:
-                award.award_modification_user_id = assignment_user
+        return HttpResponseRedirect(self.get_success_url())
 
-            if award.subaward_user_id == atp_user:
-                award.subaward_user_id = assignment_user
 
-            if award.award_negotiation_user_id == atp_user:
-                award.award_negotiation_user_id = assignment_user
-
-            if award.award_setup_user_id == atp_user:
-                award.award_setup_user_id = assignment_user
-            award.save()
-
-        return HttpResponseRedirect(self.get_success_url())
+def _get_assignment_rows_json(atp_user, department=None):
+    statuses = dict(Award.STATUS_CHOICES)
+    return [{'id': award_id, 'status': statuses.get(status), 'department': department_name}
+            for award_id, status, department_name in Award.get_open_assignment_rows(atp_user, department)]
 
 
+@login_required
 def get_re_assignment_awards(request, atp_user):
-    """This mentod is reponsible for getting all the assignments for a particular ATP user.
-    It is an ajax call and atp user will come as input paramenter"""
-    award_statuses = {1: 'Award Intake', 2: 'Award Negotiation', 3: 'Award Setup', 4: 'Subaward & Award Management',
-                      5: 'Award Closeout'}
-    if request.is_ajax() and atp_user:
-        assigns = Award.objects.filter(Q(Q(award_acceptance_user_id=atp_user) | Q(award_closeout_user_id=atp_user) |
-                                         Q(award_management_user_id=atp_user) |
-                                         Q(award_modification_user_id=atp_user) | Q(subaward_user_id=atp_user) |
-                                         Q(award_negotiation_user_id=atp_user) | Q(award_setup_user_id=atp_user)) &
-                                       Q(status__lt=6))
-        table_string = '<table id="award_re_assignment" class="table table-striped table-bordered">' \
-                       '<thead><th>Award</th><th>Award Status</th></thead>'
-        drop_string = '<option selected="selected" value="">---------</option>'
-        department_names = []
-        if assigns:
-            for assignment in assigns:
-                record = '<tr><td>%d</td><td>%s</td></tr>' % (assignment.id, award_statuses.get(assignment.status))
-                table_string = table_string + record
-                if assignment.proposal_set.get_queryset():
-                    propsal = assignment.proposal_set.get_queryset()[0]
-                    department_names.append(propsal.department_name)
-            for dept in set(department_names):
-                drop_string = drop_string + '<option value="%s">%s</option>' % (dept, dept)
-            data = {'table_string': table_string,
-                    'drop_string': drop_string}
-            return HttpResponse(json.dumps(data), content_type="application/json")
-        else:
-            return HttpResponse('')
+    """Gets all the open assignments for an ATP user, and the departments they're in, as JSON.
+    The reassignment page renders the table and department dropdown from this.
+    """
+
+    check_reassignment_permission(request.user)
+    data = {
+        'awards': _get_assignment_rows_json(atp_user),
+        'departments': [{'name': name, 'award_count': award_count} for name, award_count in
+                        Award.get_open_assignment_departments(atp_user)],
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
 
 
+@login_required
 def get_department_awards(request, atp_user, user_dept):
-    award_statuses = {1: 'Award Intake', 2: 'Award Negotiation', 3: 'Award Setup', 4: 'Subaward & Award Management',
-                      5: 'Award Closeout'}
-
-    if request.is_ajax() and atp_user and user_dept:
-        assigns = Award.objects.filter(Q(Q(award_acceptance_user_id=atp_user) | Q(award_closeout_user_id=atp_user) |
-                                         Q(award_management_user_id=atp_user) |
-                                         Q(award_modification_user_id=atp_user) | Q(subaward_user_id=atp_user) |
-                                         Q(award_negotiation_user_id=atp_user) | Q(award_setup_user_id=atp_user)) &
-                                       Q(status__lt=6))
-        table_string = '<table id="award_re_assignment" class="table table-striped table-bordered">' \
-                       '<thead><th>Award</th><th>Award Status</th></thead>'
-        if assigns:
-            for assignment in assigns:
-                if assignment.proposal_set.get_queryset():
-                    propsal = assignment.proposal_set.get_queryset()[0]
-                    try:
-                        if propsal.department_name == None:
-                            record = '<tr><td>%d</td><td>%s</td></tr>' % (
-                                assignment.id, award_statuses.get(assignment.status))
-                            table_string = table_string + record
-                        elif propsal.department_name.name == user_dept:
-                            record = '<tr><td>%d</td><td>%s</td></tr>' % (
-                                assignment.id, award_statuses.get(assignment.status))
-                            table_string = table_string + record
-                    except:
-                        pass
-
-            data = {'table_string': table_string}
-            return HttpResponse(json.dumps(data), content_type="application/json")
-        else:
-            return HttpResponse('')
+    """Gets the open assignments for an ATP user that a reassignment to the department would move, as JSON"""
+
+    check_reassignment_permission(request.user)
+    data = {'awards': _get_assignment_rows_json(atp_user, user_dept)}
+    return HttpResponse(json.dumps(data), content_type="application/json")
@@ -0,0 +1,50 @@
+# Custom django-admin command for backfilling Award.modification_count.
+#
+# The count is normally kept up to date when a modification is created; this recalculates
+# it from the awards' AwardAcceptances, e.g. after sections were added or removed by hand.
+#
+# See Django documentation at https://docs.djangoproject.com/en/1.6/howto/custom-management-commands/
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from optparse import make_option
+
+from awards.models import Award, AwardAcceptance
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the modification count of every award from its AwardAcceptances'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Reports the awards that would change without saving them'),
+    )
+
+    def get_modification_counts(self):
+        """Gets the number of modifications for every award, in a single query"""
+
+        acceptance_counts = AwardAcceptance.objects.values_list('award').annotate(Count('id')).order_by()
+        return dict((award_id, max(count - 1, 0)) for award_id, count in acceptance_counts)
+
+    def handle(self, *args, **options):
+        modification_counts = self.get_modification_counts()
+
+        # Group the out of date awards by their new count, so each count takes one UPDATE
+        changed = {}
+        for award_id, current_count in Award.objects.values_list('id', 'modification_count'):
+            count = modification_counts.get(award_id, 0)
+            if count != current_count:
+                changed.setdefault(count, []).append(award_id)
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                for count, award_ids in changed.items():
+                    Award.objects.filter(id__in=award_ids).update(modification_count=count)
+
+        total = sum(len(award_ids) for award_ids in changed.values())
+        self.stdout.write('%s %s award(s)' % ('Would update' if options['dry_run'] else 'Updated', total))
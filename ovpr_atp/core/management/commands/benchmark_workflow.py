@@ -0,0 +1,112 @@
+# Custom django-admin command for benchmarking Award workflow transitions.
+#
+# Creates throwaway awards, runs each kind of transition on them and reports the number
+# of queries each one took. Everything is rolled back at the end, and emails are kept in
+# memory instead of being sent.
+#
+# See Django documentation at https://docs.djangoproject.com/en/1.6/howto/custom-management-commands/
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from awards.models import Award, AwardModification
+
+
+class Rollback(Exception):
+    pass
+
+
+# (name, whether the award has a negotiation user, transitions to run before the measured one,
+#  the measured transition)
+TRANSITION_BENCHMARKS = [
+    ('New -> Award Intake', True, [],
+     lambda award: award.move_to_next_step()),
+    ('Award Intake -> Award Negotiation', True, ['intake'],
+     lambda award: award.move_to_next_step('AwardAcceptance')),
+    ('Award Intake -> Award Setup (no negotiation user)', False, ['intake'],
+     lambda award: award.move_to_next_step('AwardAcceptance')),
+    ('Award Negotiation -> Award Setup', True, ['intake', 'negotiation'],
+     lambda award: award.move_to_next_step('AwardNegotiation')),
+    ('Award Setup -> Subaward & Award Management', True, ['intake', 'negotiation', 'setup'],
+     lambda award: award.move_to_next_step('AwardSetup')),
+    ('Subaward completed', True, ['intake', 'negotiation', 'setup', 'management'],
+     lambda award: award.move_to_next_step('Subaward')),
+    ('Award Management -> Award Closeout', True, ['intake', 'negotiation', 'setup', 'management', 'subaward'],
+     lambda award: award.move_to_next_step('AwardManagement')),
+    ('Award Closeout -> Complete', True, ['intake', 'negotiation', 'setup', 'management', 'subaward', 'closeout'],
+     lambda award: award.move_to_next_step('AwardCloseout')),
+    ('Negotiation and Setup in parallel', True, ['intake'],
+     lambda award: award.move_award_to_multiple_steps(True)),
+    ('Negotiation and Modification in parallel', True, ['intake', 'modification'],
+     lambda award: award.move_award_to_negotiation_and_modification(True)),
+    ('Send to Award Modification', True, ['intake'],
+     lambda award: award.move_setup_or_modification_step(modification_flag=True)),
+]
+
+SETUP_STEPS = {
+    'intake': lambda award: award.move_to_next_step(),
+    'negotiation': lambda award: award.move_to_next_step('AwardAcceptance'),
+    'setup': lambda award: award.move_to_next_step('AwardNegotiation'),
+    'management': lambda award: award.move_to_next_step('AwardSetup'),
+    'subaward': lambda award: award.move_to_next_step('Subaward'),
+    'closeout': lambda award: award.move_to_next_step('AwardManagement'),
+    'modification': lambda award: AwardModification.objects.create(award=award),
+}
+
+USER_GROUPS = {
+    'award_acceptance_user': 'Award Acceptance',
+    'award_negotiation_user': 'Award Negotiation',
+    'award_setup_user': 'Award Setup',
+    'award_modification_user': 'Award Modification',
+    'subaward_user': 'Subaward Management',
+    'award_management_user': 'Award Management',
+    'award_closeout_user': 'Award Closeout',
+}
+
+
+class Command(BaseCommand):
+    help = 'Reports the number of queries each Award workflow transition takes'
+
+    def get_users(self):
+        users = {}
+        for user_field, group in USER_GROUPS.items():
+            user = User.objects.filter(groups__name=group).first()
+            if not user:
+                raise CommandError('There are no users in the %s group' % group)
+            users[user_field] = user
+        return users
+
+    def run_benchmarks(self, users):
+        results = []
+
+        for name, negotiation, setup_steps, measured_step in TRANSITION_BENCHMARKS:
+            award_users = dict(users)
+            if not negotiation:
+                award_users['award_negotiation_user'] = None
+
+            award = Award.objects.create(**award_users)
+            for step in setup_steps:
+                SETUP_STEPS[step](Award.objects.get(pk=award.pk))
+
+            award = Award.objects.get(pk=award.pk)
+            with CaptureQueriesContext(connection) as queries:
+                measured_step(award)
+            results.append((name, len(queries)))
+
+        return results
+
+    def handle(self, *args, **options):
+        users = self.get_users()
+
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            try:
+                with transaction.atomic():
+                    results = self.run_benchmarks(users)
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        for name, query_count in results:
+            self.stdout.write('%-55s %4d queries' % (name, query_count))
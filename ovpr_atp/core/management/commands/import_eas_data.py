@@ -16,7 +16,8 @@ from datetime import datetime, timedelta
 import ssl
 import xml.etree.ElementTree as ET
 
-from awards.models import PrimeSponsor, AllowedCostSchedule, AwardManager, AwardOrganization, AwardTemplate, CFDANumber, FedNegRate, FundingSource, IndirectCost
+from awards.models import PrimeSponsor, AllowedCostSchedule, AwardManager, AwardOrganization, AwardTemplate, CFDANumber, FedNegRate, FundingSource, IndirectCost, \
+    feed_changes, reference_data_changes
 
 
 class OracleAdapter(HTTPAdapter):
@@ -232,26 +233,28 @@ class Command(BaseCommand):
         else:
             endpoints = args
 
-        for endpoint in endpoints:
-            model = self.ENDPOINTS[endpoint]
+        # Each saved row would otherwise mark the JSON feeds and cached section details as changed on its own
+        with feed_changes.deferred(), reference_data_changes.deferred():
+            for endpoint in endpoints:
+                model = self.ENDPOINTS[endpoint]
 
-            self.stdout.write('Beginning %s import' % model.__name__)
+                self.stdout.write('Beginning %s import' % model.__name__)
 
-            if model == AwardManager and options['complete']:
-                self._import_all_award_manager()
-                self.stdout.write('Award Manager import complete')
-            else:
-                from_date = None
-                if options['from']:
-                    from_date = datetime.strptime(options['from'], '%Y-%m-%d')
+                if model == AwardManager and options['complete']:
+                    self._import_all_award_manager()
+                    self.stdout.write('Award Manager import complete')
+                else:
+                    from_date = None
+                    if options['from']:
+                        from_date = datetime.strptime(options['from'], '%Y-%m-%d')
                 
-                to_date = None
-                if options['to']:
-                    to_date = datetime.strptime(options['to'], '%Y-%m-%d')
-
-                objects_imported = self._import_eas_field(endpoint, model, from_date, to_date)
-                self.stdout.write(
-                    '%s import complete - %s objects processed' %
-                    (model.__name__, objects_imported))
+                    to_date = None
+                    if options['to']:
+                        to_date = datetime.strptime(options['to'], '%Y-%m-%d')
+
+                    objects_imported = self._import_eas_field(endpoint, model, from_date, to_date)
+                    self.stdout.write(
+                        '%s import complete - %s objects processed' %
+                        (model.__name__, objects_imported))
 
         self.stdout.write('EAS import complete')
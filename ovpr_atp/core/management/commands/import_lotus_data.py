@@ -7,11 +7,13 @@
 
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from datetime import datetime, timedelta
+from optparse import make_option
 from os.path import join
 
-from awards.models import Award, Proposal, AwardAcceptance
+from awards.models import Award, Proposal, AwardAcceptance, feed_changes
 
 import csv
 
@@ -42,87 +44,206 @@ LOTUS_FIELD_MAPPING = {
     'AP_ID,C,15': {'model': 'Proposal', 'field': 'lotus_id', 'field_type': 'char'},
 }
 
+# Columns used to decide whether a record gets imported at all
+LOTUS_FILTER_FIELDS = ['OUTCOME,C,10', 'OUT_DATE,D']
+
+LOTUS_DATE_FORMAT = "%m/%d/%y"
+
+# Only records from June 2009 onwards are imported
+LOTUS_CUTOFF_DATE = datetime(2009, 06, 01, 00, 00)
+
+_parsed_lotus_dates = {}
+
+
+def parse_lotus_date(value):
+    """Parses a Lotus date string. The exports repeat the same dates over and over,
+    so each distinct value is only parsed once.
+    """
+
+    try:
+        return _parsed_lotus_dates[value]
+    except KeyError:
+        parsed = _parsed_lotus_dates[value] = datetime.strptime(value, LOTUS_DATE_FORMAT)
+        return parsed
+
+
 class Command(BaseCommand):
     args = '[export directory]'
     help = 'Imports Lotus Notes data into ATP'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--bulk',
+            action='store_true',
+            dest='bulk',
+            default=False,
+            help='Inserts proposals in batches inside one transaction instead of saving them one at a time'),
+        make_option(
+            '--batch-size',
+            dest='batch_size',
+            type='int',
+            default=500,
+            help='Number of proposals per insert in bulk mode'),
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Reports what would be imported without writing anything'),
+    )
+
+    def process_file(self, directory, filename, fields=None):
+        """Read the given CSV file and pull out only the data we need.
+        If fields is given, only those columns are kept for each record.
+        """
 
-    def process_file(self, directory, filename):
-        """Read the given CSV file and pull out only the data we need"""
+        tracker = {}
+
+        for entry in self.read_file(directory, filename):
+            if fields is not None:
+                entry = dict((field, entry[field]) for field in fields if field in entry)
+            tracker[entry['AP_ID,C,15']] = entry
+
+        return tracker
+
+    def read_file(self, directory, filename):
+        """Yields each record in the given CSV file that has a Lotus ID"""
 
         f = open(join(directory, filename), 'rb')
         reader = csv.reader(f)
 
         header = reader.next()
 
-        tracker = {}
-
         for row in reader:
             entry = dict(zip(header, row))
             if entry['AP_ID,C,15']:
-                tracker[entry['AP_ID,C,15']] = entry
+                yield entry
 
         f.close()
 
-        return tracker
-
-    def handle(self, *args, **options):
-        """The 'main' method of this command.  Gets called by default when running the command."""
+    def iter_records(self, directory):
+        """Joins the three Lotus exports on the Lotus ID.
+        AP-Log is streamed; only the columns we import are kept from the other two.
+        """
 
-        csv_directory = args[0]
-        
-        ap_log = self.process_file(csv_directory, AP_LOG_FILENAME)
-        ap_specs = self.process_file(csv_directory, AP_SPECS_FILENAME)
-        complytrak = self.process_file(csv_directory, COMPLYTRAK_FILENAME)
+        fields = LOTUS_FIELD_MAPPING.keys() + LOTUS_FILTER_FIELDS
+        ap_specs = self.process_file(directory, AP_SPECS_FILENAME, fields)
+        complytrak = self.process_file(directory, COMPLYTRAK_FILENAME, fields)
 
-        # Combine them
-        for key in ap_log.keys():
+        for record in self.read_file(directory, AP_LOG_FILENAME):
+            key = record['AP_ID,C,15']
             if key in ap_specs:
-                ap_log[key].update(ap_specs[key])
+                record.update(ap_specs[key])
             if key in complytrak:
-                ap_log[key].update(complytrak[key])
+                record.update(complytrak[key])
+            yield key, record
 
-        import_counter = 0
-        for key in ap_log.keys():
-            # Skip if this proposal has been imported already
-            try:
-                Proposal.objects.get(lotus_id=key)
-                self.stdout.write('Skipping import for %s' % key)
-                continue
-            except Proposal.DoesNotExist:
-                pass
+    def should_import(self, record):
+        """Checks whether a Lotus record should become a Proposal"""
 
-            record = ap_log[key]
+        # Don't import records that aren't proposals or awards
+        if record['OUTCOME,C,10'] not in ('P', 'A'):
+            return False
 
-            # Don't import records that aren't proposals or awards
-            if record['OUTCOME,C,10'] not in ('P', 'A'):
-                continue
+        # Don't import records from earlier than June 2009
+        if 'OUT_DATE,D' in record:
+            if record['OUT_DATE,D'] == '':
+                return False
+            elif parse_lotus_date(record['OUT_DATE,D']) < LOTUS_CUTOFF_DATE:
+                return False
 
-            # Don't import records from earlier than June 2009
-            if 'OUT_DATE,D' in record:
-                if record['OUT_DATE,D'] == '':
-                    continue
-                elif datetime.strptime(record['OUT_DATE,D'], "%m/%d/%y") < datetime(2009, 06, 01, 00, 00):
-                    continue
+        return True
 
-            proposal_values = {}
+    def get_proposal_values(self, record):
+        """Converts a Lotus record into keyword arguments for Proposal"""
 
-            for import_field in LOTUS_FIELD_MAPPING.keys():
-                mapping_entry = LOTUS_FIELD_MAPPING[import_field]
-                if import_field in record:
-                    field_data = record[import_field]
-                    if mapping_entry['field_type'] in ['date', 'decimal'] and not field_data:
-                        field_data = None
-                    elif mapping_entry['field_type'] == 'date':
-                        field_data = datetime.strptime(field_data, "%m/%d/%y")
+        proposal_values = {}
 
-                    if mapping_entry['model'] == 'Proposal':
-                        proposal_values[mapping_entry['field']] = field_data
+        for import_field in LOTUS_FIELD_MAPPING.keys():
+            mapping_entry = LOTUS_FIELD_MAPPING[import_field]
+            if import_field in record:
+                field_data = record[import_field]
+                if mapping_entry['field_type'] in ['date', 'decimal'] and not field_data:
+                    field_data = None
+                elif mapping_entry['field_type'] == 'date':
+                    field_data = parse_lotus_date(field_data)
 
-            proposal = Proposal(**proposal_values)
-            proposal.lotus_id = key
-            proposal.save()
+                if mapping_entry['model'] == 'Proposal':
+                    proposal_values[mapping_entry['field']] = field_data
+
+        return proposal_values
+
+    def handle(self, *args, **options):
+        """The 'main' method of this command.  Gets called by default when running the command."""
+
+        if not args:
+            raise CommandError('Please provide the directory containing the Lotus exports')
+
+        csv_directory = args[0]
+        bulk = options['bulk']
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        # The JSON feeds are only marked as changed once, at the end
+        with feed_changes.deferred():
+            if bulk and not dry_run:
+                with transaction.atomic():
+                    counters = self.import_records(csv_directory, bulk, dry_run, batch_size)
+            else:
+                counters = self.import_records(csv_directory, bulk, dry_run, batch_size)
+
+        if dry_run:
+            self.stdout.write('Dry run complete. %s proposals would be imported, %s already imported, '
+                              '%s not eligible.' % counters)
+        else:
+            self.stdout.write('Import complete. %s proposals imported.' % counters[0])
+
+    def import_records(self, csv_directory, bulk, dry_run, batch_size):
+        """Creates a Proposal for each new, eligible Lotus record.
+        Returns the number of records imported, already imported and not eligible.
+        """
+
+        # Proposals imported on a previous run are skipped, so the command can safely be re-run
+        existing_lotus_ids = set(Proposal.objects.exclude(lotus_id='').values_list('lotus_id', flat=True))
+
+        import_counter = 0
+        skip_counter = 0
+        filter_counter = 0
+        pending = []
+
+        for key, record in self.iter_records(csv_directory):
+            # Skip if this proposal has been imported already
+            if key in existing_lotus_ids:
+                if not bulk:
+                    self.stdout.write('Skipping import for %s' % key)
+                skip_counter += 1
+                continue
 
-            self.stdout.write('Successfully created "%s"' % proposal)
-            import_counter+=1
+            if not self.should_import(record):
+                filter_counter += 1
+                continue
 
-        self.stdout.write('Import complete. %s proposals imported.' % import_counter)
+            proposal = Proposal(**self.get_proposal_values(record))
+            proposal.lotus_id = key
+            existing_lotus_ids.add(key)
+            import_counter += 1
+
+            if dry_run:
+                continue
+            elif bulk:
+                # Lotus proposals aren't tied to an award yet, so skipping Proposal.save
+                # and its signals only leaves the JSON feeds to mark as changed (below)
+                pending.append(proposal)
+                if len(pending) >= batch_size:
+                    Proposal.objects.bulk_create(pending)
+                    pending = []
+            else:
+                proposal.save()
+                self.stdout.write('Successfully created "%s"' % proposal)
+
+        if pending:
+            Proposal.objects.bulk_create(pending)
+
+        if bulk and import_counter and not dry_run:
+            feed_changes.touch()
+
+        return import_counter, skip_counter, filter_counter
@@ -0,0 +1,33 @@
+# Custom django-admin command for running queued background jobs (e.g. the Cayuse sync).
+#
+# Jobs normally start on a thread as soon as they're requested; this picks up any
+# that didn't. Can be run manually or via a scheduled job.
+#
+# See Django documentation at https://docs.djangoproject.com/en/1.6/howto/custom-management-commands/
+
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+
+from awards.jobs import run_queued_jobs, start_job
+from awards.models import BackgroundJob
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--enqueue',
+            dest='enqueue',
+            default=None,
+            help='Queues a job of the given type (e.g. %s) before running' % BackgroundJob.CAYUSE_SYNC),
+    )
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job, created = BackgroundJob.enqueue(options['enqueue'])
+            if not created:
+                self.stdout.write('%s is already active' % job)
+
+        count = run_queued_jobs()
+        self.stdout.write('Ran %s background job(s)' % count)
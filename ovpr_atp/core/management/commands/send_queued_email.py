@@ -0,0 +1,59 @@
+# Custom django-admin command for sending the notification emails queued in OutboundEmail.
+#
+# Run it from a scheduled job, or leave it running with --loop. Each batch is sent over one
+# connection to the mail server; emails that fail are retried later and eventually marked
+# as failed.
+#
+# See Django documentation at https://docs.djangoproject.com/en/1.6/howto/custom-management-commands/
+
+from django.core.management.base import BaseCommand
+
+from optparse import make_option
+import time
+
+from awards.jobs import EMAIL_BATCH_SIZE, send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Sends queued notification emails'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            dest='batch_size',
+            type='int',
+            default=EMAIL_BATCH_SIZE,
+            help='Number of emails to send over each connection'),
+        make_option(
+            '--loop',
+            action='store_true',
+            dest='loop',
+            default=False,
+            help='Keeps running, checking for new emails every --interval seconds'),
+        make_option(
+            '--interval',
+            dest='interval',
+            type='int',
+            default=10,
+            help='Seconds to wait between checks when running with --loop'),
+    )
+
+    def send_all(self, batch_size):
+        """Sends batches until there's nothing left that is due"""
+
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued_emails(batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                return total_sent, total_failed
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.send_all(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write('Sent %s email(s), %s failed' % (sent, failed))
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -263,6 +263,14 @@ MESSAGE_TAGS = {
 EMAIL_URL_HOSTNAME = 'https://awards.research.gwu.edu'
 
 PHS_FUNDED_RECIPIENTS = ['rescomp@gwu.edu']
+
+# Notification emails are queued in the database and sent by the send_queued_email command.
+# Set this to False to send them during the request instead.
+EMAIL_USE_OUTBOX = True
+
+# Queued notifications to the same person within this many minutes are combined into one
+# digest email. Set this to 0 to send each notification separately.
+EMAIL_DIGEST_MINUTES = 5
 ########## END EMAIL CONFIGURATION
 
 
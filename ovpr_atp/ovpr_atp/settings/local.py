@@ -20,6 +20,9 @@ TEMPLATE_DEBUG = DEBUG
 ########## EMAIL CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#email-backend
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Print emails as soon as they're sent instead of waiting for send_queued_email
+EMAIL_USE_OUTBOX = False
 ########## END EMAIL CONFIGURATION
 
 
@@ -42,7 +45,17 @@ DATABASES = {
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    # Rendered award sections, used by the {% cache %} template tag. Kept apart from the
+    # default cache so they can't push anything else out.
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
 }
 ########## END CACHE CONFIGURATION
 
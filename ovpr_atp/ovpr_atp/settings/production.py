@@ -59,9 +59,25 @@ DATABASES = {
 ########## CACHE CONFIGURATION
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#caches
 CACHES = {
+    # Shared by every Apache process, so they all see the same cached choices and feed stamps.
+    # The table is created with `python manage.py createcachetable`.
     'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'atp_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    # Rendered award sections, used by the {% cache %} template tag. Kept apart from the
+    # default cache so they can't push anything else out.
+    'template_fragments': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'template_fragments',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
 }
 ########## END CACHE CONFIGURATION
 
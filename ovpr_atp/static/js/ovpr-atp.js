@@ -4,6 +4,8 @@
 var reloadTimer = 0;
 var autosaveTimer = 0;
 var isDirty = false;
+// Names of the fields changed since the last autosave
+var changedFields = {};
 
 function autoReload() {
     if (isDirty !== true) {
@@ -74,6 +76,12 @@ function submitPOSTSectionForm(form) {
       .attr('name', "csrfmiddlewaretoken")
       .attr('value', csrftoken)
       .appendTo(form);
+    if (form.data("version") !== undefined) {
+        $('<input />').attr('type', 'hidden')
+          .attr('name', "version")
+          .attr('value', form.data("version"))
+          .appendTo(form);
+    }
     isDirty = false;
     form.submit();
 }
@@ -117,8 +125,34 @@ function setInputHandlers() {
         submitPOSTSectionForm($("#section-form"));
     });
 
-    $(".select2").not(".award-manager-select").select2();
-    $(".award-manager-select").select2({minimumInputLength:2});
+    $(".select2").select2();
+    setAutocompleteSelects();
+}
+
+// Turns the AutocompleteSelect inputs into Select2 boxes that fetch their options as the user types
+function setAutocompleteSelects(container) {
+    $("input[data-autocomplete-url]", container || document).not(".select2-offscreen").each(function () {
+        var input = $(this);
+        input.select2({
+            minimumInputLength: 2,
+            allowClear: true,
+            placeholder: "---------",
+            ajax: {
+                url: input.data("autocomplete-url"),
+                dataType: "json",
+                quietMillis: 250,
+                data: function (term, page) {
+                    return {term: term, page: page};
+                },
+                results: function (data, page) {
+                    return data;
+                }
+            },
+            initSelection: function (element, callback) {
+                callback({id: element.val(), text: element.data("text")});
+            }
+        });
+    });
 }
 
 function updateAutosaveMessage(showId) {
@@ -133,41 +167,103 @@ function updateAutosaveMessage(showId) {
     }
 }
 
+function showAutosaveErrors(form, errors) {
+    form.find(".autosave-error").remove();
+    form.find(".autosave-has-error").removeClass("has-error autosave-has-error");
+
+    $.each(errors, function (name, messages) {
+        var container = form.find("#div_id_" + name);
+        if (container.length == 0) {
+            container = form;
+        }
+        container.addClass("has-error autosave-has-error")
+            .append($('<span class="help-block autosave-error"></span>').text(messages.join(" ")));
+    });
+}
+
+function showAutosaveValues(form, values) {
+    $.each(values, function (name, value) {
+        // Leave alone anything that was changed again while the autosave ran
+        if (changedFields[name] || $.isArray(value) || typeof value === "boolean") {
+            return;
+        }
+        form.find('input[name="' + name + '"]').not(":checkbox, :radio, [type=hidden]").val(value);
+    });
+}
+
+function showAutosaveConflicts(form, values) {
+    var messages = {};
+    $.each(values, function (name, value) {
+        if ($.isArray(value)) {
+            value = value.join(", ");
+        } else if (typeof value === "boolean") {
+            value = value ? "checked" : "unchecked";
+        } else if (value === null || value === "") {
+            value = "blank";
+        }
+        messages[name] = ["Someone else saved this as \"" + value + "\" while you were editing. " +
+                          "Save again to keep your change."];
+    });
+    showAutosaveErrors(form, messages);
+}
+
 function submitAJAXSectionForm(changedInput) {
     $(".datePicker").datepicker("hide");
     cleanNumberInputs();
 
     var form = $(changedInput.form);
 
-    var csrftoken = getCookie('csrftoken');
-    
-    $('<input />').attr('type', 'hidden')
-      .attr('name', "csrfmiddlewaretoken")
-      .attr('value', csrftoken)
-      .appendTo(form);
+    // Only the changed fields are sent; the server fills in the rest
+    var fieldNames = Object.keys(changedFields);
+    changedFields = {};
+
+    var data = $.grep(form.serializeArray(), function (item) {
+        return $.inArray(item.name, fieldNames) > -1;
+    });
+    data.push({name: "csrfmiddlewaretoken", value: getCookie('csrftoken')});
+    data.push({name: "autosave_fields", value: fieldNames.join(",")});
+    // Only save over the version this page is showing
+    if (form.data("version") !== undefined) {
+        data.push({name: "version", value: form.data("version")});
+    }
 
     updateAutosaveMessage("saving");
-    
+
     $.ajax({
-        type: form.attr('method'),
+        type: "post",
         url: form.attr('action'),
-        data: form.serialize(),
-    }).done(function (data) {
-            var form = $(changedInput.form)[0];
-            $(form).replaceWith(data);
-
-            if ($("[id^=error]").length > 0 || $(".alert.alert-block.alert-danger").length > 0) {
-                updateAutosaveMessage("form-error");
-            } else {
-                isDirty = false;
-                updateAutosaveMessage("saved");
-            }
+        data: $.param(data),
+        dataType: "json"
+    }).done(function (response) {
+        form.data("version", response.version);
+
+        if (response.conflict) {
+            // Keep what the user entered; saving again will replace the other changes
+            showAutosaveConflicts(form, response.values);
+            $.each(fieldNames, function (index, name) {
+                changedFields[name] = true;
+            });
+            updateAutosaveMessage("conflict");
+            return;
+        }
+
+        showAutosaveErrors(form, response.errors);
+        showAutosaveValues(form, response.values);
 
-            setInputHandlers();
-            $("form").submit(function() {
-                submitPOSTSectionForm(this);
+        if (response.saved) {
+            isDirty = Object.keys(changedFields).length > 0;
+            updateAutosaveMessage("saved");
+        } else {
+            // Nothing was saved, so send these again with the next autosave
+            $.each(fieldNames, function (index, name) {
+                changedFields[name] = true;
             });
-    }).fail(function(data) {
+            updateAutosaveMessage("form-error");
+        }
+    }).fail(function () {
+        $.each(fieldNames, function (index, name) {
+            changedFields[name] = true;
+        });
         updateAutosaveMessage("ajax-error");
     });
 
@@ -176,6 +272,7 @@ function submitAJAXSectionForm(changedInput) {
 
 function autosave(changedInput) {
     isDirty = true;
+    changedFields[changedInput.name] = true;
     updateAutosaveMessage("pending");
 
     if (autosaveTimer) {
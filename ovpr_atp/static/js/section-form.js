@@ -2,8 +2,8 @@ $(document).ready(function() {
     if (disableAutosave) {
         $('#autosave-disabled').show();
         $(".datePicker").datepicker();
-        $(".select2").not(".award-manager-select").select2();
-        $(".award-manager-select").select2({minimumInputLength:2});
+        $(".select2").select2();
+        setAutocompleteSelects();
 
         $("#save-and-return").click(function() {
             $("#id_return_to_parent").val("True");